@@ -0,0 +1,105 @@
+"""Click writes saved by the dedup window on a replayed click trace.
+
+    python -m benchmarks.bench_click_dedup [--windows 0,2,5,10,30] [--visits 50000] [--trace clicks.csv]
+
+Replays a trace through ``ClickDeduplicator`` on the trace's own clock, the way
+``record_click`` calls it, and reports for each window how many clicks would still be
+written, the reduction, the peak number of tracked entries and the cost per click. The
+default trace is synthetic: ``--visits`` visits over an hour on Zipf-distributed codes,
+some preceded by a link preview fetch, some double clicked before the cookie is set and
+some stuck in a refresh loop. ``--trace`` replays a ``/_export/<code>`` CSV instead.
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import random
+import time
+
+from lnkshrtnr.clicks import ClickDeduplicator
+
+
+def synthetic_trace(visits, codes, seed, duration=3600.0):
+    """``[(seconds, code, clicker or None, ip)]`` in time order."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(codes)]
+    previewers = [f"203.0.113.{n}" for n in range(20)]
+    clickers = itertools.count()
+    trace = []
+    for _ in range(visits):
+        at = rng.uniform(0, duration)
+        code = f"code{rng.choices(range(codes), weights)[0]}"
+        ip = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+        returning = rng.random() < 0.4
+        clicker = next(clickers) if returning else None
+        if rng.random() < 0.1:
+            trace.append((at - rng.uniform(0.1, 2), code, None, rng.choice(previewers)))
+        trace.append((at, code, clicker, ip))
+        if rng.random() < 0.15:
+            # A double click lands before the first response sets the cookie.
+            trace.append((at + rng.uniform(0.1, 0.6), code, clicker, ip))
+        if rng.random() < 0.05:
+            clicker = clicker if clicker is not None else next(clickers)
+            for _ in range(rng.randint(3, 20)):
+                at += rng.uniform(1, 5)
+                trace.append((at, code, clicker, ip))
+    trace.sort(key=lambda click: click[0])
+    return trace
+
+
+def exported_trace(path):
+    trace = []
+    with open(path, newline="") as export:
+        for row in csv.DictReader(export):
+            clicked_at = datetime.datetime.fromisoformat(row["clicked_at"]).timestamp()
+            trace.append((clicked_at, row["link_id"], row["clicker"] or None, row["client_ip"]))
+    trace.sort(key=lambda click: click[0])
+    return trace
+
+
+def replay(trace, window):
+    if window <= 0:
+        return dict(window=window, written=len(trace), suppressed=0, reduction=0.0, peak_tracked=0, us_per_click=0.0)
+    now = [trace[0][0] if trace else 0.0]
+    dedup = ClickDeduplicator(window, clock=lambda: now[0])
+    fresh = itertools.count()
+    peak = 0
+    started = time.perf_counter()
+    for at, code, clicker, ip in trace:
+        now[0] = at
+        if clicker is not None:
+            clients = [clicker]
+        else:
+            clicker = f"new-{next(fresh)}"
+            clients = [ip, clicker] if ip else [clicker]
+        dedup.is_duplicate(code, clients)
+        peak = max(peak, len(dedup._current) + len(dedup._previous))
+    elapsed = time.perf_counter() - started
+    stats = dedup.stats()
+    return dict(
+        window=window,
+        written=stats["recorded"],
+        suppressed=stats["suppressed"],
+        reduction=round(stats["suppressed"] / len(trace), 4) if trace else 0.0,
+        peak_tracked=peak,
+        us_per_click=round(elapsed / max(len(trace), 1) * 1e6, 3),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--windows", default="0,2,5,10,30")
+    parser.add_argument("--visits", type=int, default=50000)
+    parser.add_argument("--codes", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", default=None)
+    args = parser.parse_args()
+
+    trace = exported_trace(args.trace) if args.trace else synthetic_trace(args.visits, args.codes, args.seed)
+    windows = [float(window) for window in args.windows.split(",")]
+    print(json.dumps(dict(clicks=len(trace), results=[replay(trace, window) for window in windows]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
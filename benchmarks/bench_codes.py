@@ -0,0 +1,64 @@
+"""Short code allocation cost as the link table grows.
+
+    python -m benchmarks.bench_codes [--sizes 10000,100000,1000000,10000000] [--allocations 20000]
+
+Fills a scratch sqlite table with existing codes up to each size and then times
+``CodeAllocator.allocate()`` against it, including the per-block existence check. The cost
+per code should stay flat: the only database work is one indexed ``IN`` query per block.
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import string
+import tempfile
+import time
+
+from lnkshrtnr.codes import CodeAllocator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--allocations", type=int, default=20000)
+    parser.add_argument("--block-size", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        connection = sqlite3.connect(os.path.join(scratch, "codes.db"))
+        connection.execute("CREATE TABLE shortened_link (code TEXT PRIMARY KEY)")
+        blocks = itertools.count()
+
+        def taken(codes):
+            placeholders = ",".join("?" * len(codes))
+            query = f"SELECT code FROM shortened_link WHERE code IN ({placeholders})"  # nosec
+            return {code for (code,) in connection.execute(query, codes)}
+
+        allocator = CodeAllocator(
+            string.digits + string.ascii_lowercase,
+            8,
+            "benchmark",
+            block_size=args.block_size,
+            reserve_block=lambda: next(blocks),
+            taken=taken,
+        )
+        results = []
+        for size in (int(size) for size in args.sizes.split(",")):
+            rows = connection.execute("SELECT count(*) FROM shortened_link").fetchone()[0]
+            while rows < size:
+                batch = [(allocator.allocate(),) for _ in range(min(100000, size - rows))]
+                connection.executemany("INSERT INTO shortened_link VALUES (?)", batch)
+                rows += len(batch)
+            connection.commit()
+            started = time.perf_counter()
+            for _ in range(args.allocations):
+                allocator.allocate()
+            elapsed = time.perf_counter() - started
+            results.append(dict(rows=rows, us_per_code=round(elapsed / args.allocations * 1e6, 2)))
+            print(json.dumps(results[-1]), flush=True)
+        print(json.dumps(dict(block_size=args.block_size, results=results, allocator=allocator.stats()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
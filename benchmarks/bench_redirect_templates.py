@@ -0,0 +1,57 @@
+"""Building redirect URLs from compiled templates vs. reparsing ``redirect_to``.
+
+    python -m benchmarks.bench_redirect_templates [--iterations 100000]
+
+Compares ``RedirectTemplate.url`` against the per-request ``str.replace`` and
+``merge_utm_tags`` it replaces, for plain and parameterized links, with and without UTM tags.
+"""
+import argparse
+import json
+import time
+
+from lnkshrtnr.repository import PARAMETER_PLACEHOLDER, RedirectTemplate, merge_utm_tags
+
+CASES = {
+    "simple": ("https://example.com/landing?ref=lnk", None, {}),
+    "simple_utm": ("https://example.com/landing?ref=lnk", None, dict(source="newsletter", campaign="fall")),
+    "parameterized": (f"https://example.com/items/{PARAMETER_PLACEHOLDER}?ref=lnk", "1234", {}),
+    "parameterized_utm": (
+        f"https://example.com/items/{PARAMETER_PLACEHOLDER}?ref=lnk",
+        "1234",
+        dict(source="newsletter", campaign="fall"),
+    ),
+}
+
+
+def reparse(redirect_to, parameter, utm_tags):
+    if parameter is not None:
+        redirect_to = redirect_to.replace(PARAMETER_PLACEHOLDER, parameter, 1)
+    return merge_utm_tags(redirect_to, utm_tags)
+
+
+def per_call(fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    args = parser.parse_args()
+
+    results = {}
+    for name, (redirect_to, parameter, utm_tags) in CASES.items():
+        template = RedirectTemplate(redirect_to)
+        assert template.url(parameter, utm_tags) == reparse(redirect_to, parameter, utm_tags)
+        before = per_call(lambda: reparse(redirect_to, parameter, utm_tags), args.iterations)
+        after = per_call(lambda: template.url(parameter, utm_tags), args.iterations)
+        results[name] = dict(
+            reparse_us=round(before * 1e6, 3), template_us=round(after * 1e6, 3), speedup=round(before / after, 1)
+        )
+    print(json.dumps(dict(iterations=args.iterations, cases=results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Cold vs. warm cost of user-agent classification.
+
+    python -m benchmarks.bench_user_agents [--distinct 2000] [--requests 100000]
+
+"Cold" parses every distinct header once with an empty cache, which is what every redirect
+paid before memoization. "Warm" replays a skewed request trace over the same headers.
+"""
+import argparse
+import json
+import random
+import time
+
+from lnkshrtnr.agents import classify_user_agent, stats
+
+TEMPLATES = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.{b}.{p} Safari/537.36",  # noqa: E501
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.{b} Safari/605.1.15",  # noqa: E501
+    "Mozilla/5.0 (iPhone; CPU iPhone OS {v}_{b} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E{p}",
+    "Mozilla/5.0 (Linux; Android {v}; SM-G{p}) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{b}.0 Mobile Safari/537.36",  # noqa: E501
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.{b}",
+    "Slackbot-LinkExpanding {v}.{b} (+https://api.slack.com/robots)",
+    "Mozilla/5.0 (compatible; Googlebot/{v}.{b}; +http://www.google.com/bot.html)",
+]
+
+
+def user_agents(count, seed):
+    rng = random.Random(seed)
+    seen = set()
+    while len(seen) < count:
+        seen.add(rng.choice(TEMPLATES).format(v=rng.randint(9, 120), b=rng.randint(0, 99), p=rng.randint(100, 999)))
+    return sorted(seen)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--distinct", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    headers = user_agents(args.distinct, args.seed)
+    rng = random.Random(args.seed)
+    trace = rng.choices(headers, weights=[1 / (rank + 1) for rank in range(len(headers))], k=args.requests)
+
+    classify_user_agent.cache_clear()
+    started = time.perf_counter()
+    for header in headers:
+        classify_user_agent(header)
+    cold = (time.perf_counter() - started) / len(headers)
+
+    started = time.perf_counter()
+    for header in trace:
+        classify_user_agent(header)
+    warm = (time.perf_counter() - started) / len(trace)
+
+    print(
+        json.dumps(
+            dict(
+                distinct=len(headers),
+                requests=len(trace),
+                cold_us_per_call=round(cold * 1e6, 2),
+                warm_us_per_call=round(warm * 1e6, 3),
+                speedup=round(cold / warm, 1),
+                cache=stats(),
+            ),
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
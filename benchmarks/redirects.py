@@ -0,0 +1,250 @@
+"""Redirect load test and latency benchmark.
+
+    python -m benchmarks.redirects [--database-url sqlite:///bench.db] [--links 1000] [--clicks 10000]
+                                   [--requests 2000] [--concurrency 8] [--output results.json]
+                                   [--baseline previous.json]
+
+Seeds ``--links`` links (a quarter of them parameterized) and ``--clicks`` historical clicks,
+then drives each scenario through the WSGI app with ``--concurrency`` threads:
+
+* ``simple_redirect``: ``GET /<code>``
+* ``redirect_with_parameter``: ``GET /<code>/<parameter>``
+* ``qrcode``: ``GET /<code>?qr=png``
+* ``create``: ``POST /``
+
+Codes are drawn from a Zipf-like distribution so the hottest links dominate, as they do in
+production. For every scenario it reports throughput and p50/p95/p99 latency, overall and
+for each phase of the request that ran (lookup, UA parse, click write, QR render, commit).
+Results are printed as JSON and optionally written to ``--output``; ``--baseline`` prints
+the relative change against an earlier results file. The database defaults to a scratch
+sqlite file; pass a Postgres URL to benchmark against a local server. The app is configured
+from the environment as usual, so e.g. ``CLICK_WRITER=sync`` benchmarks inline click writes.
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import random
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ["simple_redirect", "redirect_with_parameter", "qrcode", "create"]
+UA_STRING = "Mozilla/5.0 (iPhone; CPU iPhone OS 16_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.5 Mobile/15E148 Safari/604.1"  # noqa: E501
+
+_phases = threading.local()
+
+
+def timed(phase, fn):
+    @functools.wraps(fn)
+    def __wrapped__(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings = getattr(_phases, "timings", None)
+            if timings is not None:
+                timings[phase] = timings.get(phase, 0) + time.perf_counter() - started
+
+    return __wrapped__
+
+
+def instrument():
+    """Wrap the hot-path steps so each request's time can be broken down by phase."""
+    from lnkshrtnr import clicks, repository
+    from lnkshrtnr.database import db
+
+    repository.resolve_link = timed("lookup", repository.resolve_link)
+    repository.classify_user_agent = timed("ua_parse", repository.classify_user_agent)
+    clicks.submit = timed("click_write", clicks.submit)
+    repository.qrcode_for_link = timed("qr_render", repository.qrcode_for_link)
+    session_class = type(db.session)
+    session_class.commit = timed("commit", session_class.commit)
+
+
+def seed(app, links, click_count):
+    from lnkshrtnr import clicks, repository
+    from lnkshrtnr.database import db
+    from lnkshrtnr.models import ShortenedLink
+
+    rng = random.Random(0)
+    with app.app_context():
+        # The app no longer migrates on import outside of tests; the scratch database starts empty.
+        app.extensions["alembic"].upgrade()
+        db.session.query(ShortenedLink).filter(ShortenedLink.code.like("bench-%")).delete(synchronize_session=False)
+        db.session.commit()
+        rows = []
+        for n in range(links):
+            parameterized = n % 4 == 3
+            rows.append(
+                dict(
+                    code=f"bench-{n}",
+                    redirect_to=f"https://example.com/{n}/"
+                    + (repository.PARAMETER_PLACEHOLDER if parameterized else ""),
+                    default_parameter="default" if parameterized else None,
+                    created_by="benchmark",
+                )
+            )
+        for start in range(0, len(rows), 1000):
+            repository._insert_links(rows[start : start + 1000])
+        batch = []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for _ in range(click_count):
+            batch.append(
+                clicks.Click(
+                    link_id=f"bench-{rng.randrange(links)}",
+                    clicker=uuid.uuid4(),
+                    clicked_at=now - datetime.timedelta(minutes=rng.randrange(60 * 24 * 30)),
+                    client_ip="127.0.0.1",
+                    referer="",
+                    user_agent=UA_STRING,
+                    source=rng.choice([None, "newsletter", "twitter"]),
+                    medium=None,
+                    campaign=None,
+                    term=None,
+                    content=None,
+                )
+            )
+            if len(batch) == 5000:
+                clicks.write_clicks(batch)
+                batch = []
+        clicks.write_clicks(batch)
+        db.session.commit()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(samples):
+    summary = {}
+    for key in sorted({key for sample in samples for key in sample}):
+        values = [sample[key] * 1000 for sample in samples if key in sample]
+        summary[key] = dict(
+            count=len(values),
+            mean_ms=round(statistics.mean(values), 3),
+            p50_ms=round(percentile(values, 0.50), 3),
+            p95_ms=round(percentile(values, 0.95), 3),
+            p99_ms=round(percentile(values, 0.99), 3),
+        )
+    return summary
+
+
+def run_scenario(app, scenario, links, requests, concurrency):
+    from lnkshrtnr import repository
+
+    parameterized = [n for n in range(links) if n % 4 == 3]
+    simple = [n for n in range(links) if n % 4 != 3]
+    weights = {
+        "simple": [1 / (rank + 1) for rank in range(len(simple))],
+        "parameterized": [1 / (rank + 1) for rank in range(len(parameterized))],
+    }
+    local = threading.local()
+
+    def request(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+            local.rng = random.Random(threading.get_ident())
+        rng = local.rng
+        _phases.timings = {}
+        started = time.perf_counter()
+        if scenario == "simple_redirect":
+            n = rng.choices(simple, weights["simple"])[0]
+            response = client.get(f"/bench-{n}", headers={"User-Agent": UA_STRING})
+        elif scenario == "redirect_with_parameter":
+            n = rng.choices(parameterized, weights["parameterized"])[0]
+            response = client.get(
+                f"/bench-{n}/p{rng.randrange(100)}?utm_source=bench", headers={"User-Agent": UA_STRING}
+            )
+        elif scenario == "qrcode":
+            n = rng.choices(simple, weights["simple"])[0]
+            response = client.get(f"/bench-{n}?qr=png")
+        else:
+            response = client.post(
+                "/",
+                json=dict(redirect_to=f"https://example.com/new/{uuid.uuid4()}", created_by="benchmark"),
+                headers={"Authorization": f"PSK {os.getenv('PRIVATE_SHARED_KEY')}"},
+            )
+        elapsed = time.perf_counter() - started
+        assert response.status_code < 400, (scenario, response.status_code)
+        return dict(_phases.timings, total=elapsed)
+
+    repository.link_cache.clear()
+    repository.qr_cache.clear()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(request, range(requests)))
+    elapsed = time.perf_counter() - started
+    return dict(
+        requests=requests, seconds=round(elapsed, 3), rps=round(requests / elapsed, 1), latency=summarize(samples)
+    )
+
+
+def compare(results, baseline):
+    for scenario, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if previous is None:
+            continue
+        changes = dict(rps=f"{(result['rps'] / previous['rps'] - 1) * 100:+.1f}%")
+        for phase, latency in result["latency"].items():
+            if phase in previous["latency"]:
+                old = previous["latency"][phase]["p95_ms"]
+                changes[f"{phase}_p95"] = f"{(latency['p95_ms'] / old - 1) * 100:+.1f}%" if old else "n/a"
+        print(f"{scenario}: {json.dumps(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--links", type=int, default=1000)
+    parser.add_argument("--clicks", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="lnkshrtnr-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+    os.environ.setdefault("HOSTNAME", "bench.example.com")
+    os.environ.setdefault("PRIVATE_SHARED_KEY", "benchmark")
+    # Every request comes from one client.
+    os.environ.setdefault("RATE_LIMIT", "off")
+    import logging
+
+    from lnkshrtnr.app import app
+
+    logging.getLogger("lnkshrtnr").setLevel(logging.WARNING)
+    seed(app, args.links, args.clicks)
+    instrument()
+
+    results = dict(
+        commit=subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip(),  # nosec
+        database=os.environ["DATABASE_URL"].split("://")[0],
+        links=args.links,
+        clicks=args.clicks,
+        concurrency=args.concurrency,
+        scenarios={},
+    )
+    for scenario in args.scenarios.split(","):
+        results["scenarios"][scenario] = run_scenario(app, scenario, args.links, args.requests, args.concurrency)
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
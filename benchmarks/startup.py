@@ -0,0 +1,93 @@
+"""Worker startup cost: app import time and first-request latency.
+
+    python -m benchmarks.startup [--runs 10] [--database-url sqlite:///startup.db]
+
+Each run is a fresh interpreter, as a new gunicorn worker without ``--preload`` would be:
+it imports ``lnkshrtnr.app``, then times the first redirect and the first QR code, which pay
+for whatever was deferred (the user-agent regexes, the QR library, the first connection).
+The database is migrated once up front, the way the release phase does it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child():
+    started = time.perf_counter()
+    from lnkshrtnr.app import app
+
+    imported = time.perf_counter() - started
+    client = app.test_client()
+    headers = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/118.0"}
+    timings = dict(import_ms=imported)
+    for name, path in [
+        ("first_redirect_ms", "/startup"),
+        ("second_redirect_ms", "/startup"),
+        ("first_qr_ms", "/startup?qr=png"),
+    ]:
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        timings[name] = time.perf_counter() - started
+        assert response.status_code < 400, (path, response.status_code)
+    print(json.dumps({key: round(value * 1000, 2) for key, value in timings.items()}))
+
+
+def seed():
+    from lnkshrtnr.app import app
+    from lnkshrtnr.database import db
+    from lnkshrtnr.models import ShortenedLink
+
+    with app.app_context():
+        if db.session.get(ShortenedLink, "startup") is None:
+            db.session.add(ShortenedLink(code="startup", redirect_to="https://example.com/", created_by="benchmark"))
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--seed", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+    if args.seed:
+        return seed()
+
+    scratch = tempfile.mkdtemp(prefix="lnkshrtnr-startup-")
+    env = dict(os.environ, CLICK_WRITER="sync", HOSTNAME=os.getenv("HOSTNAME", "bench.example.com"))
+    env["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(scratch, 'startup.db')}"
+    env.pop("TESTING", None)
+    subprocess.run(  # nosec
+        [sys.executable, "-m", "flask", "--app", "lnkshrtnr.app", "db", "upgrade"],
+        env=dict(env, SCHEMA_CHECK="off"),
+        check=True,
+        capture_output=True,
+    )
+    subprocess.run([sys.executable, "-m", "benchmarks.startup", "--seed"], env=env, check=True)  # nosec
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(  # nosec
+            [sys.executable, "-m", "benchmarks.startup", "--child"],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    summary = {
+        key: dict(median=round(statistics.median(run[key] for run in runs), 2), max=max(run[key] for run in runs))
+        for key in runs[0]
+    }
+    print(json.dumps(dict(runs=len(runs), database=env["DATABASE_URL"].split("://")[0], ms=summary), indent=2))
+
+
+if __name__ == "__main__":
+    main()
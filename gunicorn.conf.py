@@ -0,0 +1,43 @@
+"""gunicorn settings; loaded automatically from the working directory."""
+import os
+import shutil
+
+
+def on_starting(server):
+    # Metrics files left by a previous master would be summed into this one's.
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def when_ready(server):
+    # The app defers these imports so CLI commands and unpreloaded workers don't pay for
+    # them; with --preload, load them once here so every forked worker starts with them.
+    if server.cfg.preload_app:
+        import pyqrcode  # noqa: F401
+        import user_agents  # noqa: F401
+
+
+def post_worker_init(worker):
+    # After the app is loaded in this worker and before it serves anything.
+    from lnkshrtnr import hot, repository
+    from lnkshrtnr.app import app
+
+    with app.app_context():
+        try:
+            repository.build_code_filter()
+        except Exception:
+            repository.logger.exception("Failed to build the code filter.")
+        if os.getenv("HOT_PREWARM", "on") != "off":
+            try:
+                hot.prewarm()
+            except Exception:
+                hot.logger.exception("Failed to pre-warm caches.")
@@ -23,5 +23,13 @@ def setup_app():
     app.config["SQLALCHEMY_DATABASE_URI"] = (
         "sqlite://" if os.getenv("TESTING") else os.getenv("DATABASE_URL").replace("postgres://", "postgresql://")
     )
+    # Optional read replicas for link lookups and analytics, e.g. DATABASE_REPLICA_URLS=postgres://a,postgres://b
+    replica_urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    app.config["SQLALCHEMY_BINDS"] = {
+        f"replica_{n}": url.replace("postgres://", "postgresql://") for n, url in enumerate(replica_urls)
+    }
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dict(pool_recycle=600)
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
+        # Batch the per-link counter UPDATEs issued by the click writer into one round trip.
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["executemany_mode"] = "values_plus_batch"
     return app
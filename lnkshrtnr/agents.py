@@ -0,0 +1,43 @@
+"""Memoized user-agent classification.
+
+ua-parser runs a long cascade of regular expressions for every string it sees, and its own
+cache is cleared wholesale every 200 entries, while real traffic only carries a few thousand
+distinct user-agent headers. ``classify_user_agent`` keeps the parsed result for the last
+``UA_CACHE_SIZE`` distinct headers in a thread-safe LRU.
+"""
+import functools
+import os
+from collections import namedtuple
+
+UserAgentClass = namedtuple("UserAgentClass", ["is_bot", "browser", "os", "device", "device_class"])
+
+
+@functools.lru_cache(maxsize=int(os.getenv("UA_CACHE_SIZE", "4096")))
+def classify_user_agent(user_agent):
+    # Imported here because loading ua-parser's regexes is most of the app's import time.
+    from user_agents import parse
+
+    parsed = parse(user_agent or "")
+    if parsed.is_bot:
+        device_class = "bot"
+    elif parsed.is_mobile:
+        device_class = "mobile"
+    elif parsed.is_tablet:
+        device_class = "tablet"
+    elif parsed.is_pc:
+        device_class = "pc"
+    else:
+        device_class = "other"
+    return UserAgentClass(parsed.is_bot, parsed.browser.family, parsed.os.family, parsed.device.family, device_class)
+
+
+def stats():
+    info = classify_user_agent.cache_info()
+    lookups = info.hits + info.misses
+    return dict(
+        size=info.currsize,
+        maxsize=info.maxsize,
+        hits=info.hits,
+        misses=info.misses,
+        hit_rate=(info.hits / lookups) if lookups else None,
+    )
@@ -1,17 +1,32 @@
+import functools
+
 from flask import request
-from slack_bolt.adapter.flask import SlackRequestHandler
 
-from . import setup_app, slack_app
-from .database import setup_database
+from . import clicks, commands, hot, invalidation, metrics, setup_app
+from .database import db, setup_database
 
 app = setup_app()
 setup_database(app)
+invalidation.init_app(app)
+clicks.init_app(app)
+hot.init_app(app)
+metrics.init_app(app, db)
+commands.register(app)
 
 from . import routes  # noqa
 
-slack_handler = SlackRequestHandler(slack_app.app)
+
+@functools.lru_cache(maxsize=None)
+def slack_handler():
+    # Built on first use: importing Bolt and the token check its App makes would otherwise
+    # run on every boot for a route that sees a handful of requests a day.
+    from slack_bolt.adapter.flask import SlackRequestHandler
+
+    from . import slack_app
+
+    return SlackRequestHandler(slack_app.app)
 
 
 @app.route("/_slack/command", methods=["POST"])
 def slack_route():
-    return slack_handler.handle(request)
+    return slack_handler().handle(request)
@@ -0,0 +1,226 @@
+"""Cold archive of old raw clicks.
+
+``flask archive-clicks`` moves each month of clicks older than ``CLICK_ARCHIVE_AFTER_MONTHS``
+out of the database into ``CLICK_ARCHIVE_DIR``, then drops the month's partition.
+Rollups and link counters are untouched, so stats don't change; exports read archived
+months back through ``repository.iter_clicks``. The directory has to be durable and
+readable wherever exports are served.
+
+A month is written as one or more parts, ``clicks-2025-01-<digest>.json.gz``: gzipped
+lines of JSON, a header, then one block per link holding that link's clicks column by
+column (``{"link_id": ..., "columns": {"clicked_at": [...], ...}}``), then a trailer with
+the row count. Blocks are in link order and rows in (clicked_at, id) order. Clicks that
+arrive for a month after it was archived become another part on the next run. The digest
+covers the archived click ids, so rerunning after a failure between writing a part and
+deleting its rows overwrites the same part rather than duplicating it.
+"""
+import datetime
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import re
+import tempfile
+import uuid
+from collections import namedtuple
+
+import woodchipper
+from sqlalchemy import func, select
+
+from . import partitions
+from .database import db, naive_utc
+from .models import ShortenedLinkClick
+
+logger = woodchipper.get_logger(__name__)
+
+# Version 2 added the enrichment ids; version 1 parts read back with them unset.
+ARCHIVE_VERSION = 2
+READABLE_VERSIONS = {1, 2}
+COLUMNS = [
+    "id",
+    "link_id",
+    "clicker",
+    "clicked_at",
+    "client_ip",
+    "referer",
+    "user_agent",
+    "source",
+    "medium",
+    "campaign",
+    "term",
+    "content",
+    "browser_id",
+    "os_id",
+    "device_class_id",
+    "referer_host_id",
+]
+BLOCK_COLUMNS = [column for column in COLUMNS if column != "link_id"]
+PART_RE = re.compile(r"^clicks-(\d{4})-(\d{2})-[0-9a-f]+\.json\.gz$")
+
+
+class ArchivedClick(namedtuple("ArchivedClick", COLUMNS)):
+    """An archived click, readable like the rows ``iter_clicks`` yields from the database."""
+
+    __slots__ = ()
+
+    @property
+    def _mapping(self):
+        return self._asdict()
+
+
+def archive_dir():
+    return os.getenv("CLICK_ARCHIVE_DIR")
+
+
+def archived_months():
+    """``{month: [part paths]}`` for every month with archived clicks."""
+    months = {}
+    directory = archive_dir()
+    if not directory or not os.path.isdir(directory):
+        return months
+    for name in sorted(os.listdir(directory)):
+        match = PART_RE.match(name)
+        if match:
+            month = datetime.datetime(int(match.group(1)), int(match.group(2)), 1)
+            months.setdefault(month, []).append(os.path.join(directory, name))
+    return months
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _decode(column, value):
+    if value is None:
+        return None
+    if column == "clicked_at":
+        return datetime.datetime.fromisoformat(value)
+    if column in {"id", "clicker"}:
+        return uuid.UUID(value)
+    return value
+
+
+def write_part(month, rows):
+    """Write ``rows`` (in link, clicked_at, id order) as a part of ``month``; returns (path, count)."""
+    directory = archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    count = 0
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+
+            def write_block(link_id, block):
+                f.write((json.dumps(dict(link_id=link_id, columns=block)) + "\n").encode("utf8"))
+
+            f.write((json.dumps(dict(version=ARCHIVE_VERSION, month=month.strftime("%Y-%m"))) + "\n").encode("utf8"))
+            link_id, block = None, None
+            for row in rows:
+                if block is None or row.link_id != link_id:
+                    if block is not None:
+                        write_block(link_id, block)
+                    link_id, block = row.link_id, {column: [] for column in BLOCK_COLUMNS}
+                for column in BLOCK_COLUMNS:
+                    block[column].append(_encode(getattr(row, column)))
+                digest.update(row.id.bytes if isinstance(row.id, uuid.UUID) else str(row.id).encode("utf8"))
+                count += 1
+            if block is not None:
+                write_block(link_id, block)
+            f.write((json.dumps(dict(rows=count)) + "\n").encode("utf8"))
+        path = os.path.join(directory, f"clicks-{month.strftime('%Y-%m')}-{digest.hexdigest()[:16]}.json.gz")
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+    return path, count
+
+
+def read_part(path, code=None):
+    """Yield the ``ArchivedClick``s in a part, only ``code``'s if given."""
+    with gzip.open(path, "rt", encoding="utf8") as f:
+        header = json.loads(f.readline())
+        if header.get("version") not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported click archive version in {path}")
+        for line in f:
+            record = json.loads(line)
+            if "link_id" not in record:
+                continue
+            if code is not None and record["link_id"] != code:
+                continue
+            columns = record["columns"]
+            missing = [None] * len(columns["id"])
+            for index in range(len(columns["id"])):
+                yield ArchivedClick(
+                    link_id=record["link_id"],
+                    **{column: _decode(column, columns.get(column, missing)[index]) for column in BLOCK_COLUMNS},
+                )
+
+
+def _count_part(path):
+    with gzip.open(path, "rt", encoding="utf8") as f:
+        last = None
+        for line in f:
+            last = line
+    return json.loads(last).get("rows")
+
+
+def iter_archived_clicks(code, since=None, until=None):
+    """Archived clicks on ``code`` in (clicked_at, id) order, month by month."""
+    # Archived timestamps are naive UTC, like the database's.
+    since = naive_utc(since) if since is not None else None
+    until = naive_utc(until) if until is not None else None
+    for month, paths in sorted(archived_months().items()):
+        if since is not None and partitions.next_month(month) <= since:
+            continue
+        if until is not None and month >= until:
+            break
+        # Each part is already in order; several are merged rather than read into memory.
+        parts = [read_part(path, code) for path in paths]
+        rows = parts[0] if len(parts) == 1 else heapq.merge(*parts, key=lambda row: (row.clicked_at, row.id))
+        for row in rows:
+            if (since is None or row.clicked_at >= since) and (until is None or row.clicked_at < until):
+                yield row
+
+
+def default_cutoff(now=None):
+    """The first month kept in the database under ``CLICK_ARCHIVE_AFTER_MONTHS``."""
+    month = partitions.month_start(now or datetime.datetime.utcnow())
+    for _ in range(int(os.getenv("CLICK_ARCHIVE_AFTER_MONTHS", "12"))):
+        month = datetime.datetime(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+    return month
+
+
+def archive_clicks(cutoff):
+    """Archive and remove every month of clicks before ``cutoff``, one month per transaction."""
+    if not archive_dir():
+        raise RuntimeError("CLICK_ARCHIVE_DIR is not set")
+    table = ShortenedLinkClick.__table__
+    earliest = db.session.query(func.min(table.c.clicked_at)).scalar()
+    if isinstance(earliest, str):
+        earliest = datetime.datetime.fromisoformat(earliest)
+    archived = []
+    month = partitions.month_start(earliest) if earliest is not None else cutoff
+    while month < cutoff:
+        end = partitions.next_month(month)
+        in_month = (table.c.clicked_at >= month) & (table.c.clicked_at < end)
+        statement = select(table).where(in_month).order_by(table.c.link_id, table.c.clicked_at, table.c.id)
+        rows = db.session.execute(statement, execution_options=dict(stream_results=True, yield_per=5000))
+        path, count = write_part(month, rows)
+        if count == 0:
+            os.unlink(path)
+        elif _count_part(path) != count:
+            raise RuntimeError(f"Click archive {path} is incomplete")
+        dropped = partitions.drop_partition(month)
+        # Anything left over: the default partition's share, or the whole month off Postgres.
+        db.session.execute(table.delete().where(in_month))
+        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        if count:
+            logger.info("Archived clicks.", month=month.strftime("%Y-%m"), rows=count, path=path, dropped=dropped)
+            archived.append((month, count))
+        month = end
+    return archived
@@ -4,13 +4,27 @@ import os
 from flask import abort, request
 
 
+def _check_psk():
+    if request.headers.get("Authorization", "") != f"PSK {os.getenv('PRIVATE_SHARED_KEY')}":
+        abort(401)
+
+
 def write_requires_psk(fn):
     @functools.wraps(fn)
     def __wrapped__(*args, **kwargs):
         if not os.getenv("BYPASS_AUTH"):
             if request.method in {"POST", "PUT", "PATCH", "DELETE"}:
-                if request.headers.get("Authorization", "") != f"PSK {os.getenv('PRIVATE_SHARED_KEY')}":
-                    abort(401)
+                _check_psk()
+        return fn(*args, **kwargs)
+
+    return __wrapped__
+
+
+def requires_psk(fn):
+    @functools.wraps(fn)
+    def __wrapped__(*args, **kwargs):
+        if not os.getenv("BYPASS_AUTH"):
+            _check_psk()
         return fn(*args, **kwargs)
 
     return __wrapped__
@@ -0,0 +1,207 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A small thread-safe LRU cache with an optional per-entry TTL.
+
+    ``maxsize`` bounds the number of entries, or their total weight when a ``weigh``
+    function is given (e.g. ``weigh=len`` to bound a cache of bytes by size).
+    Counters are kept for hits, misses, evictions (capacity) and expirations (TTL) so the
+    cache can be sized from production numbers.
+    """
+
+    def __init__(self, maxsize, ttl=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 1
+        if weight > self.maxsize:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, expires_at, weight)
+            self.weight += weight
+            while self.weight > self.maxsize:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._data),
+            weight=self.weight,
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            hit_rate=(self.hits / lookups) if lookups else None,
+        )
+
+
+class DiskCache:
+    """Content-addressed blobs in a directory, bounded by total size.
+
+    The directory may be shared by every worker on a host. Writes are atomic renames, reads
+    refresh a file's mtime, and when this worker's running estimate of the directory size
+    goes over ``max_bytes`` it rescans and deletes the least recently used files.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        filename = os.path.join(self.path, key)
+        try:
+            with open(filename, "rb") as f:
+                value = f.read()
+            os.utime(filename)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        fd, temp_name = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(temp_name, os.path.join(self.path, key))
+        with self._lock:
+            self.size += len(value)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another worker sharing the directory.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            path=self.path,
+            size=self.size,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=(self.hits / lookups) if lookups else None,
+        )
+
+
+class BloomFilter:
+    """A fixed-size set of strings with no false negatives and about ``error_rate`` false positives.
+
+    Sized for ``capacity`` members: ``-capacity * ln(error_rate) / ln(2) ** 2`` bits, e.g.
+    about 1.2MB per million members at 1%, 1.8MB at 0.1%. The false positive rate climbs
+    past ``error_rate`` as membership grows beyond ``capacity``. Members can't be removed.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def stats(self):
+        return dict(
+            capacity=self.capacity,
+            error_rate=self.error_rate,
+            count=self.count,
+            bytes=len(self._array),
+            hashes=self.hashes,
+        )
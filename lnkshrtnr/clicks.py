@@ -0,0 +1,389 @@
+"""Click ingestion.
+
+Redirects hand a compact ``Click`` record to ``submit()``. In async mode (the default outside
+of tests) each worker runs a background thread that drains a bounded queue and writes clicks
+in batches: one multi-row INSERT into ``shortened_link_click`` and one aggregated counter
+UPDATE per link, committed together, whenever ``CLICK_BATCH_SIZE`` clicks are waiting or
+``CLICK_FLUSH_INTERVAL`` seconds have passed. When the queue is full the request writes its
+own click inline, so a slow database degrades latency back to the old behaviour instead of
+dropping clicks. The queue is drained on interpreter exit, which gunicorn workers reach on a
+graceful shutdown.
+
+With ``CLICK_COUNTER_FOLD_INTERVAL`` set, the writer stops touching ``shortened_link.clicks``
+on every batch. Increments are coalesced in memory per link and folded into the counter
+every that-many seconds, in code order so concurrent workers never deadlock. On a viral
+link this turns one row lock per batch per worker into one per fold interval per worker.
+``pending_count()`` reports increments that have not been folded yet.
+
+With ``CLICK_DEDUP_WINDOW`` set, a repeat click on the same link by the same client (the
+``clicker`` cookie, or the IP when there is none) within that many seconds of the last
+recorded one is dropped before it is queued: link previews, double clicks and refresh loops
+count once. A click without a cookie is remembered under both its IP and the clicker it is
+given, so the second half of a double click matches either way (and, being dropped, gets no
+cookie that would replace the first one's). Like the rate limits, deduplication is per
+worker: repeats that land on different workers are each recorded. ``ClickDeduplicator`` keeps
+two generations, one window each, of (link, client) hashes and when they were last recorded,
+at most ``CLICK_DEDUP_MAX_ENTRIES`` per generation; past that, clicks are recorded without
+being remembered. Dropped clicks are counted as ``lnkshrtnr_clicks_total{kind="duplicate"}``
+and in ``dedup_stats()``.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+
+import woodchipper
+from sqlalchemy import bindparam, insert, update
+
+from . import rollups, visitors
+from .database import db
+from .models import ShortenedLink, ShortenedLinkClick
+
+logger = woodchipper.get_logger(__name__)
+
+Click = namedtuple(
+    "Click",
+    [
+        "link_id",
+        "clicker",
+        "clicked_at",
+        "client_ip",
+        "referer",
+        "user_agent",
+        "source",
+        "medium",
+        "campaign",
+        "term",
+        "content",
+        "is_bot",
+    ],
+    defaults=(False,),
+)
+
+_STOP = object()
+
+writer = None
+deduplicator = None
+
+
+def write_clicks(batch, count=True):
+    """Write ``batch`` in the current session without committing.
+
+    Pass ``count=False`` to insert the click rows only and leave the link counters to the caller.
+    """
+    if not batch:
+        return
+    humans = [click for click in batch if not click.is_bot]
+    if humans:
+        db.session.execute(
+            insert(ShortenedLinkClick.__table__),
+            [_click_row(click) for click in humans],
+        )
+        if count:
+            update_click_counts(Counter(click.link_id for click in humans))
+    rollups.record_clicks(batch)
+    # Visitor estimates are derived data (and can be backfilled); never lose clicks over them.
+    try:
+        with db.session.begin_nested():
+            visitors.record_clicks(batch)
+    except Exception:
+        logger.exception("Failed to update visitor sketches.", clicks=len(batch))
+
+
+def _click_row(click):
+    row = click._asdict()
+    del row["is_bot"]
+    row["id"] = uuid.uuid4()
+    return row
+
+
+def update_click_counts(counts):
+    """Add ``counts`` (code -> increment) to the link counters in the current session."""
+    if not counts:
+        return
+    link_table = ShortenedLink.__table__
+    db.session.execute(
+        update(link_table)
+        .where(link_table.c.code == bindparam("link_code"))
+        .values(clicks=link_table.c.clicks + bindparam("click_count")),
+        [dict(link_code=code, click_count=count) for code, count in sorted(counts.items())],
+    )
+
+
+class CounterCoalescer:
+    """Per-link click increments waiting to be folded into ``shortened_link.clicks``."""
+
+    def __init__(self, fold_interval):
+        self.fold_interval = fold_interval
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._next_fold = time.monotonic() + fold_interval
+        self.folds = 0
+
+    def add(self, counts):
+        with self._lock:
+            self._pending.update(counts)
+
+    def pending(self, code):
+        return self._pending.get(code, 0)
+
+    def due(self):
+        return time.monotonic() >= self._next_fold
+
+    def timeout(self):
+        return max(self._next_fold - time.monotonic(), 0)
+
+    def take(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        self._next_fold = time.monotonic() + self.fold_interval
+        return pending
+
+    def restore(self, counts):
+        self.add(counts)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class ClickDeduplicator:
+    """When each (link, client) pair was last recorded, for the last one to two ``window`` seconds."""
+
+    def __init__(self, window, max_entries=100000, clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self._clock = clock
+        # Hashes rather than the pairs themselves; a collision can only drop a click that should count.
+        self._current = {}
+        self._previous = {}
+        self._rotate_at = clock() + window
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.suppressed = 0
+        self.untracked = 0
+
+    def is_duplicate(self, code, clients):
+        """Whether any of ``clients`` was recorded clicking ``code`` within the window; if not, record them all."""
+        now = self._clock()
+        keys = [hash((code, client)) for client in clients]
+        with self._lock:
+            if now >= self._rotate_at:
+                # The previous generation is now older than a window; drop it.
+                self._previous = self._current if now < self._rotate_at + self.window else {}
+                self._current = {}
+                self._rotate_at = now + self.window
+            for key in keys:
+                last = self._current.get(key)
+                if last is None:
+                    last = self._previous.get(key)
+                if last is not None and now - last < self.window:
+                    self.suppressed += 1
+                    return True
+            self.recorded += 1
+            for key in keys:
+                if key in self._current or len(self._current) < self.max_entries:
+                    self._current[key] = now
+                else:
+                    self.untracked += 1
+            return False
+
+    def stats(self):
+        return dict(
+            window=self.window,
+            tracked=len(self._current) + len(self._previous),
+            recorded=self.recorded,
+            suppressed=self.suppressed,
+            untracked=self.untracked,
+        )
+
+
+class ClickWriter:
+    def __init__(
+        self,
+        app,
+        batch_size=500,
+        flush_interval=1.0,
+        max_queue=10000,
+        drain_timeout=10.0,
+        max_attempts=3,
+        fold_interval=0,
+    ):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drain_timeout = drain_timeout
+        self.max_attempts = max_attempts
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.counters = CounterCoalescer(fold_interval) if fold_interval > 0 else None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.overflowed = 0
+        self.dropped = 0
+
+    def submit(self, click):
+        """Queue ``click`` for writing; returns ``False`` if the queue is full."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(click)
+            return True
+        except queue.Full:
+            self.overflowed += 1
+            return False
+
+    def stop(self):
+        """Flush everything queued so far and stop the writer thread."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            self.queue.put(_STOP, timeout=self.drain_timeout)
+        except queue.Full:
+            logger.warning("Click queue still full at shutdown.", queued=self.queue.qsize())
+        self._thread.join(self.drain_timeout)
+
+    def stats(self):
+        return dict(
+            queued=self.queue.qsize(),
+            max_queue=self.queue.maxsize,
+            written=self.written,
+            batches=self.batches,
+            overflowed=self.overflowed,
+            dropped=self.dropped,
+            pending_counters=len(self.counters) if self.counters is not None else None,
+            folds=self.counters.folds if self.counters is not None else None,
+        )
+
+    def pending_count(self, code):
+        return self.counters.pending(code) if self.counters is not None else 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name="lnkshrtnr-click-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._flush(batch)
+            if self.counters is not None and self.counters.due():
+                self._fold()
+        # Pick up anything submitted after the stop marker.
+        batch = []
+        while True:
+            try:
+                click = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if click is not _STOP:
+                batch.append(click)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        if self.counters is not None:
+            self._fold()
+
+    def _collect(self):
+        try:
+            batch = [self.queue.get(timeout=self.counters.timeout() if self.counters is not None else None)]
+        except queue.Empty:
+            return [], False
+        deadline = time.monotonic() + self.flush_interval
+        while batch[-1] is not _STOP and len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if batch[-1] is _STOP:
+            return batch[:-1], True
+        return batch, False
+
+    def _flush(self, batch):
+        for attempt in range(1, self.max_attempts + 1):
+            with self.app.app_context():
+                try:
+                    write_clicks(batch, count=self.counters is None)
+                    db.session.commit()
+                    if self.counters is not None:
+                        self.counters.add(Counter(click.link_id for click in batch if not click.is_bot))
+                    self.written += len(batch)
+                    self.batches += 1
+                    return
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Failed to write click batch.", clicks=len(batch), attempt=attempt)
+            if attempt < self.max_attempts:
+                time.sleep(attempt)
+        self.dropped += len(batch)
+
+    def _fold(self):
+        pending = self.counters.take()
+        if not pending:
+            return
+        with self.app.app_context():
+            try:
+                update_click_counts(pending)
+                db.session.commit()
+                self.counters.folds += 1
+            except Exception:
+                db.session.rollback()
+                self.counters.restore(pending)
+                logger.exception("Failed to fold click counters.", links=len(pending))
+
+
+def init_app(app):
+    global writer, deduplicator
+    dedup_window = float(os.getenv("CLICK_DEDUP_WINDOW", "0"))
+    if dedup_window > 0:
+        deduplicator = ClickDeduplicator(dedup_window, int(os.getenv("CLICK_DEDUP_MAX_ENTRIES", "100000")))
+    if os.getenv("TESTING") or os.getenv("CLICK_WRITER", "async") != "async":
+        return
+    writer = ClickWriter(
+        app,
+        batch_size=int(os.getenv("CLICK_BATCH_SIZE", "500")),
+        flush_interval=float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0")),
+        max_queue=int(os.getenv("CLICK_QUEUE_SIZE", "10000")),
+        drain_timeout=float(os.getenv("CLICK_DRAIN_TIMEOUT", "10")),
+        fold_interval=float(os.getenv("CLICK_COUNTER_FOLD_INTERVAL", "0")),
+    )
+    atexit.register(writer.stop)
+
+
+def submit(click):
+    """Record ``click``, in the background if possible, otherwise in the current session."""
+    if writer is None or not writer.submit(click):
+        write_clicks([click])
+
+
+def is_duplicate(code, clients):
+    """Whether to drop a click on ``code`` by any of ``clients`` as a repeat within ``CLICK_DEDUP_WINDOW``."""
+    return deduplicator is not None and deduplicator.is_duplicate(code, clients)
+
+
+def pending_count(code):
+    """Clicks on ``code`` written by this worker but not yet added to its counter."""
+    return writer.pending_count(code) if writer is not None else 0
+
+
+def stats():
+    return writer.stats() if writer is not None else None
+
+
+def dedup_stats():
+    return deduplicator.stats() if deduplicator is not None else None
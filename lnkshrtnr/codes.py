@@ -0,0 +1,168 @@
+"""Collision-free short code allocation.
+
+Generated codes are a keyed permutation of a sequence: the n-th code is ``encode(P(n))``
+where ``P`` is a Feistel network over ``[0, len(CODE_ALPHABET) ** CODE_LENGTH)`` keyed with
+``CODE_KEY``. Being a bijection, distinct sequence numbers can never produce the same
+code, and without the key consecutive codes look random.
+
+Each worker reserves ``CODE_BLOCK_SIZE`` sequence numbers at a time from a shared database
+sequence and hands them out from memory, so allocating a code normally touches nothing but
+the CPU. When a block is reserved, the codes in it are checked against existing links in
+one indexed query and any custom code that happens to match is skipped; that is the only
+database cost, and it does not grow with the table.
+
+Changing the alphabet, length or key changes the permutation, and may reissue codes already
+generated under the old settings; the reservation check skips those, but prefer a new
+length over reusing the old space.
+
+Without a key the sequence would be public and every issued code could be enumerated, so
+when ``CODE_KEY`` is unset (outside of tests) codes are drawn at random instead, as they
+were before, each checked against existing links, and a warning is logged at startup.
+"""
+import hashlib
+import os
+import secrets
+import string
+import threading
+
+import woodchipper
+from sqlalchemy import insert, select, text
+
+from .database import db
+from .exceptions import LinkShortenerException
+from .models import CodeBlock, ShortenedLink
+
+logger = woodchipper.get_logger(__name__)
+
+RANDOM_ATTEMPTS = 10
+
+
+class FeistelPermutation:
+    """A keyed bijection on ``range(domain)``, built from a balanced Feistel network with cycle-walking."""
+
+    def __init__(self, domain, key, rounds=4):
+        self.domain = domain
+        self.half_bits = ((domain - 1).bit_length() + 1) // 2
+        self.half_bytes = max((self.half_bits + 7) // 8, 1)
+        self.mask = (1 << self.half_bits) - 1
+        self.round_keys = [
+            hashlib.blake2b(key.encode("utf8"), digest_size=16, person=bytes([r])).digest() for r in range(rounds)
+        ]
+
+    def _round(self, round_key, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(self.half_bytes, "big"), digest_size=self.half_bytes, key=round_key
+        ).digest()
+        return int.from_bytes(digest, "big") & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for round_key in self.round_keys:
+            left, right = right, left ^ self._round(round_key, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value):
+        # The network permutes [0, 4 ** half_bits), at most 4x the domain; walking the cycle
+        # until we land back inside the domain keeps it a bijection on the domain.
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+        return value
+
+
+class CodeAllocator:
+    def __init__(self, alphabet, length, key, block_size=100, reserve_block=None, taken=None):
+        if len(set(alphabet)) != len(alphabet) or any(
+            c not in string.ascii_lowercase + string.digits + "_.-" for c in alphabet
+        ):
+            raise ValueError("Code alphabet must be distinct characters valid in a code.")
+        self.alphabet = alphabet
+        self.length = length
+        self.domain = len(alphabet) ** length
+        self.block_size = block_size
+        self.permutation = FeistelPermutation(self.domain, key)
+        self.reserve_block = reserve_block or _reserve_block
+        self.taken = taken or _taken_codes
+        self._codes = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.blocks = 0
+        self.skipped = 0
+
+    def encode(self, value):
+        digits = []
+        for _ in range(self.length):
+            value, digit = divmod(value, len(self.alphabet))
+            digits.append(self.alphabet[digit])
+        return "".join(reversed(digits))
+
+    def code_for(self, sequence_number):
+        return self.encode(self.permutation(sequence_number))
+
+    def allocate(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share a reserved block with a forked sibling.
+                self._codes = []
+                self._pid = os.getpid()
+            while not self._codes:
+                self._codes = self._reserve()
+            return self._codes.pop()
+
+    def _reserve(self):
+        start = self.reserve_block() * self.block_size
+        if start >= self.domain:
+            raise LinkShortenerException("Short code space exhausted", "exhausted")
+        codes = [self.code_for(n) for n in range(start, min(start + self.block_size, self.domain))]
+        taken = self.taken(codes)
+        self.blocks += 1
+        self.skipped += len(taken)
+        return [code for code in reversed(codes) if code not in taken]
+
+    def stats(self):
+        return dict(
+            domain=self.domain,
+            block_size=self.block_size,
+            available=len(self._codes),
+            blocks=self.blocks,
+            skipped=self.skipped,
+        )
+
+
+class RandomCodeAllocator(CodeAllocator):
+    """Uniformly random codes, each checked against existing links; for when there is no key."""
+
+    def __init__(self, alphabet, length, taken=None):
+        super().__init__(alphabet, length, key="", taken=taken)
+
+    def allocate(self):
+        for _ in range(RANDOM_ATTEMPTS):
+            code = self.encode(secrets.randbelow(self.domain))
+            if not self.taken([code]):
+                return code
+            self.skipped += 1
+        raise LinkShortenerException("Short code space exhausted", "exhausted")
+
+
+def _reserve_block():
+    if db.engine.dialect.name == "postgresql":
+        # nextval() is never rolled back, so a block is never handed out twice.
+        return db.session.execute(text("SELECT nextval('shortened_link_code_block_seq')")).scalar()
+    return db.session.execute(insert(CodeBlock.__table__)).inserted_primary_key[0]
+
+
+def _taken_codes(codes):
+    return set(db.session.execute(select(ShortenedLink.code).where(ShortenedLink.code.in_(codes))).scalars())
+
+
+def default_allocator():
+    alphabet = os.getenv("CODE_ALPHABET", string.digits + string.ascii_lowercase)
+    length = int(os.getenv("CODE_LENGTH", "8"))
+    key = os.getenv("CODE_KEY", "")
+    if not key and not os.getenv("TESTING"):
+        logger.warning("CODE_KEY is not set; generating random short codes instead of a keyed sequence.")
+        return RandomCodeAllocator(alphabet, length)
+    return CodeAllocator(alphabet, length, key, block_size=int(os.getenv("CODE_BLOCK_SIZE", "100")))
+
+
+allocator = default_allocator()
@@ -0,0 +1,105 @@
+import os
+
+import click
+from flask.cli import with_appcontext
+
+from . import archive, enrichment, partitions, rollups, snapshot, spool, visitors
+from .database import db
+
+
+@click.command("backfill-rollups")
+@click.option(
+    "--until",
+    type=click.DateTime(),
+    default=None,
+    help="Rebuild rollups from clicks before this UTC time. Defaults to the first incrementally maintained hour.",
+)
+@with_appcontext
+def backfill_rollups(until):
+    """Build hourly/daily click rollups from existing raw clicks."""
+    cutoff = rollups.hour_bucket(until) if until is not None else rollups.default_backfill_cutoff()
+    click.echo(f"Backfilling click rollups before {cutoff.isoformat()} (rerun with --until to resume).")
+    rollups.backfill(cutoff)
+
+
+@click.command("backfill-visitor-sketches")
+@with_appcontext
+def backfill_visitor_sketches():
+    """Fold all recorded clicks into the daily unique-visitor sketches (safe to rerun)."""
+    visitors.backfill()
+
+
+@click.command("maintain-click-partitions")
+@click.option("--ahead", type=int, default=3, show_default=True, help="Months to create partitions for in advance.")
+@with_appcontext
+def maintain_click_partitions(ahead):
+    """Create monthly click partitions ahead of time (Postgres only)."""
+    created = partitions.ensure_partitions(ahead=ahead)
+    db.session.flush() if os.getenv("TESTING") else db.session.commit()
+    click.echo(f"Created {len(created)} click partitions: {', '.join(created) or 'none needed'}.")
+
+
+@click.command("archive-clicks")
+@click.option(
+    "--before",
+    type=click.DateTime(formats=["%Y-%m"]),
+    default=None,
+    help="Archive months before this one (YYYY-MM). Defaults to CLICK_ARCHIVE_AFTER_MONTHS (12) ago.",
+)
+@with_appcontext
+def archive_clicks(before):
+    """Move old raw clicks into compressed archive files in CLICK_ARCHIVE_DIR."""
+    if not archive.archive_dir():
+        raise click.UsageError("CLICK_ARCHIVE_DIR must be set.")
+    cutoff = before or archive.default_cutoff()
+    for month, count in archive.archive_clicks(cutoff):
+        click.echo(f"Archived {count} clicks from {month.strftime('%Y-%m')}.")
+
+
+@click.command("export-link-snapshot")
+@click.option("--full", is_flag=True, help="Write a new base snapshot instead of a delta.")
+@with_appcontext
+def export_link_snapshot(full):
+    """Export live links to LINK_SNAPSHOT_DIR for the standalone resolver."""
+    directory = os.getenv("LINK_SNAPSHOT_DIR")
+    if not directory:
+        raise click.UsageError("LINK_SNAPSHOT_DIR must be set.")
+    path, count = snapshot.export_links(directory, full=full)
+    click.echo(f"Wrote {count} links to {path}." if path else "No links changed.")
+
+
+@click.command("ingest-click-spool")
+@click.option("--all", "include_open", is_flag=True, help="Also ingest files that may still be written to.")
+@with_appcontext
+def ingest_click_spool(include_open):
+    """Record the clicks the standalone resolver spooled to CLICK_SPOOL_DIR."""
+    directory = os.getenv("CLICK_SPOOL_DIR")
+    if not directory:
+        raise click.UsageError("CLICK_SPOOL_DIR must be set.")
+    for path, count in spool.ingest(directory, include_open=include_open):
+        click.echo(f"Ingested {count} clicks from {path}.")
+
+
+@click.command("enrich-clicks")
+@click.option(
+    "--batch-size", type=int, default=None, help="Clicks per batch. Defaults to ENRICHMENT_BATCH_SIZE (10000)."
+)
+@click.option("--follow", is_flag=True, help="Keep enriching new clicks every ENRICHMENT_INTERVAL seconds.")
+@with_appcontext
+def enrich_clicks(batch_size, follow):
+    """Fill in browser, OS, device class and referer host ids on unenriched clicks."""
+    count = enrichment.enrich_clicks(batch_size=batch_size, follow=follow)
+    click.echo(f"Enriched {count} clicks (checkpoint: {enrichment.checkpoint()}).")
+
+
+def register(app):
+    for command in [
+        backfill_rollups,
+        backfill_visitor_sketches,
+        maintain_click_partitions,
+        archive_clicks,
+        export_link_snapshot,
+        ingest_click_spool,
+        enrich_clicks,
+    ]:
+        app.cli.add_command(command)
@@ -1,7 +1,48 @@
+import contextlib
+import contextvars
+import datetime
+import os
+import random
+
+import woodchipper
+from alembic.runtime.migration import MigrationContext
 from flask_alembic import Alembic
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = woodchipper.get_logger(__name__)
+
+_read_from_replica = contextvars.ContextVar("read_from_replica", default=False)
+
+# Engines for the SQLALCHEMY_BINDS named replica_*, filled in by setup_database.
+replica_engines = []
+
+
+class RoutingSession(Session):
+    """Sends reads made inside ``replica()`` to a read replica, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replica_engines and _read_from_replica.get() and not self._flushing:
+            return random.choice(replica_engines)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options=dict(class_=RoutingSession))
 
-db = SQLAlchemy()
+
+@contextlib.contextmanager
+def replica(enabled=True):
+    """Run the statements executed in this block on a replica, if any are configured.
+
+    Only for reads that can tolerate replica lag. Results that are streamed keep the
+    connection chosen when they were executed, so they can be consumed outside the block.
+    """
+    token = _read_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
 
 
 def setup_database(app):
@@ -11,4 +52,53 @@ def setup_database(app):
     alembic.init_app(app)
 
     with app.app_context():
-        alembic.upgrade()
+        if os.getenv("TESTING"):
+            # The in-memory test database starts empty.
+            alembic.upgrade()
+        else:
+            # Replicas follow the primary's schema; only the primary is migrated, at release.
+            check_schema(alembic)
+            # Don't hand the connection to forked workers when the app is preloaded.
+            db.engine.dispose()
+        replica_engines[:] = [
+            engine for key, engine in sorted(db.engines.items()) if key and key.startswith("replica")
+        ]
+
+
+def check_schema(alembic, mode=None):
+    """Compare the database's Alembic revision with this code's head revision.
+
+    Migrations run once per release with ``flask db upgrade``, not in each worker. A
+    mismatch is logged, or raised with ``SCHEMA_CHECK=strict``; ``SCHEMA_CHECK=off`` skips
+    the check, e.g. for the release command itself. Returns whether the schema is current.
+    """
+    mode = mode or os.getenv("SCHEMA_CHECK", "warn")
+    if mode == "off":
+        return True
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    expected = set(alembic.script_directory.get_heads())
+    if current == expected:
+        return True
+    if mode == "strict":
+        raise RuntimeError(
+            f"Database schema is at {sorted(current)}, expected {sorted(expected)}; run flask db upgrade."
+        )
+    logger.warning(
+        "Database schema is not at the expected revision.", current=sorted(current), expected=sorted(expected)
+    )
+    return False
+
+
+def naive_utc(timestamp):
+    """``timestamp`` as the naive UTC datetime the database stores; naive ones are taken as UTC."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def dialect_insert(table):
+    """An INSERT construct supporting ``on_conflict_do_*`` on both Postgres and sqlite."""
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
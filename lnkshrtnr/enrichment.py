@@ -0,0 +1,187 @@
+"""Deferred enrichment of raw clicks.
+
+Clicks are written with the raw ``user_agent`` and ``referer`` strings. ``flask
+enrich-clicks`` (``--follow`` to keep running) goes through clicks that haven't been
+enriched yet, oldest first, ``ENRICHMENT_BATCH_SIZE`` (10000) at a time. It parses each
+distinct user agent in a batch once, and resolves browser family, OS family, device class
+and referer host to small integer ids in ``click_dimension``. Then it writes the ids onto
+the clicks. Breakdowns (``breakdown()``, ``/_stats/<code>/breakdown``) group on those ids
+and only look up the handful of names at the end.
+
+Unenriched clicks are the ones with no ``device_class_id``, found through a partial index
+that only holds those, so clicks that arrive late (e.g. ingested from the resolver's
+spool) are picked up whenever they show up. Each batch commits together with the
+``enrichment_checkpoint`` row, which records the newest click enriched so far for
+monitoring the enricher's lag.
+"""
+import os
+import time
+from urllib.parse import urlparse
+
+import woodchipper
+from sqlalchemy import bindparam, func, select, update
+
+from .agents import classify_user_agent
+from .database import db, dialect_insert, naive_utc, replica
+from .models import ClickDimension, EnrichmentCheckpoint, ShortenedLinkClick
+
+logger = woodchipper.get_logger(__name__)
+
+CHECKPOINT = "clicks"
+# Breakdown name -> click column.
+DIMENSIONS = {
+    "browser": "browser_id",
+    "os": "os_id",
+    "device_class": "device_class_id",
+    "referer_host": "referer_host_id",
+}
+
+# (kind, value) -> id; rows in click_dimension never change, so this never goes stale.
+_dimension_ids = {}
+_dimension_values = {}
+
+
+def forget_dimensions():
+    _dimension_ids.clear()
+    _dimension_values.clear()
+
+
+def referer_host(referer):
+    try:
+        host = urlparse(referer).hostname if referer else None
+    except ValueError:
+        host = None
+    return host or None
+
+
+def dimension_ids(pairs):
+    """Ids for ``(kind, value)`` pairs, adding any new ones to ``click_dimension``."""
+    missing = sorted(pair for pair in set(pairs) if pair not in _dimension_ids)
+    if missing:
+        table = ClickDimension.__table__
+        db.session.execute(
+            dialect_insert(table)
+            .values([dict(kind=kind, value=value) for kind, value in missing])
+            .on_conflict_do_nothing(index_elements=["kind", "value"])
+        )
+        for kind in {kind for kind, _ in missing}:
+            values = [value for missing_kind, value in missing if missing_kind == kind]
+            for row in db.session.execute(
+                select(table.c.id, table.c.value).where(table.c.kind == kind, table.c.value.in_(values))
+            ):
+                _dimension_ids[(kind, row.value)] = row.id
+                _dimension_values[row.id] = row.value
+    return {pair: _dimension_ids[pair] for pair in pairs}
+
+
+def dimension_values(ids):
+    """Names for dimension ids."""
+    missing = [id for id in set(ids) if id is not None and id not in _dimension_values]
+    if missing:
+        table = ClickDimension.__table__
+        for row in db.session.execute(select(table.c.id, table.c.value).where(table.c.id.in_(missing))):
+            _dimension_values[row.id] = row.value
+    return {id: _dimension_values.get(id) for id in ids}
+
+
+def enrich_batch(batch_size=10000):
+    """Enrich the oldest ``batch_size`` unenriched clicks in the current session; returns how many."""
+    table = ShortenedLinkClick.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.clicked_at, table.c.user_agent, table.c.referer)
+        .where(table.c.device_class_id == None)  # noqa: E711
+        .order_by(table.c.clicked_at, table.c.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+    # The batch is already deduplicated, so skip the request path's cache rather than flush it.
+    agents = {
+        user_agent: classify_user_agent.__wrapped__(user_agent) for user_agent in {row.user_agent for row in rows}
+    }
+    hosts = {referer: referer_host(referer) for referer in {row.referer for row in rows}}
+    pairs = set()
+    for agent in agents.values():
+        pairs.update([("browser", agent.browser), ("os", agent.os), ("device_class", agent.device_class)])
+    pairs.update(("referer_host", host) for host in hosts.values() if host is not None)
+    ids = dimension_ids(pairs)
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam("click_id"), table.c.clicked_at == bindparam("click_clicked_at"))
+        .values(
+            browser_id=bindparam("browser"),
+            os_id=bindparam("os"),
+            device_class_id=bindparam("device_class"),
+            referer_host_id=bindparam("referer_host"),
+        ),
+        [
+            dict(
+                click_id=row.id,
+                click_clicked_at=row.clicked_at,
+                browser=ids[("browser", agents[row.user_agent].browser)],
+                os=ids[("os", agents[row.user_agent].os)],
+                device_class=ids[("device_class", agents[row.user_agent].device_class)],
+                referer_host=ids.get(("referer_host", hosts[row.referer])),
+            )
+            for row in rows
+        ],
+    )
+    checkpoint = db.session.get(EnrichmentCheckpoint, CHECKPOINT)
+    if checkpoint is None:
+        checkpoint = EnrichmentCheckpoint(name=CHECKPOINT, clicked_at=rows[-1].clicked_at, enriched=0)
+        db.session.add(checkpoint)
+    checkpoint.clicked_at = max(checkpoint.clicked_at, rows[-1].clicked_at)
+    checkpoint.enriched += len(rows)
+    return len(rows)
+
+
+def enrich_clicks(batch_size=None, follow=False, interval=None):
+    """Enrich clicks one committed batch at a time until none are left (forever with ``follow``)."""
+    batch_size = batch_size or int(os.getenv("ENRICHMENT_BATCH_SIZE", "10000"))
+    interval = interval if interval is not None else float(os.getenv("ENRICHMENT_INTERVAL", "30"))
+    total = 0
+    while True:
+        started = time.monotonic()
+        try:
+            count = enrich_batch(batch_size)
+            db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Ids of dimensions inserted by the failed batch are gone with it.
+            forget_dimensions()
+            raise
+        total += count
+        if count:
+            logger.info("Enriched clicks.", clicks=count, seconds=round(time.monotonic() - started, 3))
+        if count < batch_size:
+            if not follow:
+                return total
+            time.sleep(interval)
+
+
+def checkpoint():
+    """The newest click enriched so far and how many have been, or ``None``."""
+    row = db.session.get(EnrichmentCheckpoint, CHECKPOINT)
+    return dict(clicked_at=row.clicked_at.isoformat(), enriched=row.enriched) if row is not None else None
+
+
+def breakdown(code, by, since=None, until=None):
+    """Clicks on ``code`` per browser, OS, device class or referer host.
+
+    Clicks not enriched yet are counted under ``pending``; clicks without a referer count
+    under a ``None`` referer host.
+    """
+    table = ShortenedLinkClick.__table__
+    column = table.c[DIMENSIONS[by]]
+    statement = select(column, func.count().label("clicks"), func.count(table.c.device_class_id).label("enriched"))
+    statement = statement.where(table.c.link_id == code)
+    if since is not None:
+        statement = statement.where(table.c.clicked_at >= naive_utc(since))
+    if until is not None:
+        statement = statement.where(table.c.clicked_at < naive_utc(until))
+    with replica():
+        rows = db.session.execute(statement.group_by(column)).all()
+    names = dimension_values([row[0] for row in rows])
+    series = [dict(value=names[row[0]], clicks=row.enriched) for row in rows if row.enriched]
+    series.sort(key=lambda entry: (-entry["clicks"], entry["value"] or ""))
+    return dict(series=series, pending=sum(row.clicks - row.enriched for row in rows))
@@ -2,4 +2,7 @@ REDIRECT_EVENT = "Shortened link redirect requested."
 UPDATE_EVENT = "Shortened link update request."
 DELETE_EVENT = "Shortened link delete requested."
 CREATE_EVENT = "Shortened link create requested."
+BULK_CREATE_EVENT = "Shortened link bulk create requested."
 INVALID_QR_FORMAT = "Invalid QR code format requested."
+QR_BATCH_EVENT = "QR code batch requested."
+EXPORT_EVENT = "Click export requested."
@@ -0,0 +1,103 @@
+"""HyperLogLog sketches for counting distinct clickers.
+
+A sketch of precision ``p`` keeps ``2 ** p`` one-byte registers and estimates the number of
+distinct values added to it with a relative standard error of ``1.04 / sqrt(2 ** p)``.
+At the default ``p = 12`` that is 1.6%: about two estimates in three are within 1.6% of
+the true count, 95% within 3.3% and 99% within 4.9%. Small counts (below ``2.5 * 2 ** p``,
+about 10,000 at ``p = 12``) use linear counting and are close to exact.
+
+Sketches merge losslessly (register-wise max), so the sketch of a date range is the merge
+of its days' sketches and carries the same error bound as a single sketch, and adding the
+same value twice, or merging the same sketch twice, changes nothing. Sketches of different
+precision merge at the lower one: the finer sketch is folded down first, which gives
+exactly the sketch the values would have produced at that precision.
+
+Serialized sketches are sparse (3 bytes per non-empty register) while that is smaller
+than the dense form (``2 ** p`` bytes), so a link with a handful of clicks in a day costs
+a few bytes.
+"""
+import hashlib
+import math
+import struct
+
+DEFAULT_PRECISION = 12
+_DENSE = 0
+_SPARSE = 1
+_ENTRY = struct.Struct(">HB")
+
+
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16.")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.size)
+
+    def add(self, value):
+        """Add ``value`` (bytes, or anything whose ``str()`` identifies it)."""
+        if not isinstance(value, bytes):
+            value = str(value).encode("utf8")
+        hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merge ``other`` into this sketch, at the lower of the two precisions."""
+        if other.precision > self.precision:
+            other = other.fold(self.precision)
+        elif other.precision < self.precision:
+            folded = self.fold(other.precision)
+            self.precision, self.size, self.registers = folded.precision, folded.size, folded.registers
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def fold(self, precision):
+        """This sketch at a lower ``precision``, as if its values had been added to that one."""
+        if precision > self.precision:
+            raise ValueError("Can't unfold a HyperLogLog sketch to a higher precision.")
+        shift = self.precision - precision
+        mask = (1 << shift) - 1
+        folded = HyperLogLog(precision)
+        for index, register in enumerate(self.registers):
+            if not register:
+                continue
+            # The index bits dropped from the bucket become the leading bits of the hash remainder.
+            dropped = index & mask
+            rank = shift - dropped.bit_length() + 1 if dropped else shift + register
+            if rank > folded.registers[index >> shift]:
+                folded.registers[index >> shift] = rank
+        return folded
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size**2 / sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return round(estimate)
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(self.size)
+
+    def to_bytes(self):
+        filled = [(index, register) for index, register in enumerate(self.registers) if register]
+        if len(filled) * _ENTRY.size < self.size:
+            return bytes([_SPARSE, self.precision]) + b"".join(_ENTRY.pack(*entry) for entry in filled)
+        return bytes([_DENSE, self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        encoding, precision = data[0], data[1]
+        if encoding == _DENSE:
+            return cls(precision, bytearray(data[2:]))
+        if encoding != _SPARSE:
+            raise ValueError("Unknown HyperLogLog encoding.")
+        sketch = cls(precision)
+        for index, register in _ENTRY.iter_unpack(data[2:]):
+            sketch.registers[index] = register
+        return sketch
@@ -0,0 +1,260 @@
+"""Heavy hitters: the links (and QR codes) getting the most requests right now.
+
+Every redirect and QR request is counted in this worker's Space-Saving summary of at
+most ``HOT_CAPACITY`` (1000) keys, so memory stays fixed however many codes are hit. A
+key's count is never underestimated and is overestimated by at most its ``error``, and
+every key with more than 1/capacity of a window's requests is guaranteed to be in the
+summary. Every ``HOT_WINDOW`` seconds (60) a background thread replaces this worker's
+rows in ``hot_link`` with the window's top ``HOT_PUBLISH_COUNT`` (100) keys and starts a
+new window. ``top()`` (``/_hot``) adds up the latest window of every worker that
+published recently, as requests per second.
+
+When a worker starts (gunicorn's ``post_worker_init``), ``prewarm()`` loads the hot links
+into the link cache and renders the hot QR codes into the QR cache, so a deploy doesn't
+send every new worker to Postgres for the same few codes at once.
+"""
+import atexit
+import datetime
+import heapq
+import os
+import socket
+import threading
+import time
+from urllib.parse import parse_qsl, quote, unquote, urlencode
+
+import woodchipper
+from sqlalchemy import delete, insert, select
+
+from . import invalidation, repository
+from .database import db
+from .models import HotLink
+
+logger = woodchipper.get_logger(__name__)
+
+LINK = "link"
+QR = "qr"
+
+tracker = None
+
+
+class SpaceSaving:
+    """The Space-Saving heavy hitters summary over at most ``capacity`` keys."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # One (count, key) entry per key; counts only grow, so an entry may be behind.
+        self._heap = []
+        self.total = 0
+
+    def add(self, key, count=1):
+        self.total += count
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = [count, 0]
+            heapq.heappush(self._heap, (count, key))
+            return
+        # Replace the key with the smallest count, which the new key inherits as its error.
+        while True:
+            smallest, evicted = heapq.heappop(self._heap)
+            current = self.counts[evicted][0]
+            if current == smallest:
+                break
+            heapq.heappush(self._heap, (current, evicted))
+        del self.counts[evicted]
+        self.counts[key] = [smallest + count, smallest]
+        heapq.heappush(self._heap, (smallest + count, key))
+
+    def top(self, n=None):
+        """``[(key, count, error)]`` by descending count."""
+        ranked = sorted(((key, count, error) for key, (count, error) in self.counts.items()), key=lambda e: -e[1])
+        return ranked[:n] if n is not None else ranked
+
+
+def qr_key(format, code, parameter=None, utm_tags=None):
+    """``<format>:<code>[/<parameter>][?<utm tags>]``: everything the QR cache key depends on."""
+    key = f"{format}:{code}" + (f"/{quote(parameter, safe='')}" if parameter else "")
+    return key + (f"?{urlencode(sorted(utm_tags.items()))}" if utm_tags else "")
+
+
+def parse_qr_key(key):
+    """``(format, code, parameter, utm_tags)`` from a ``qr_key``."""
+    key, _, query = key.partition("?")
+    format, _, rest = key.partition(":")
+    code, _, parameter = rest.partition("/")
+    return format, code, unquote(parameter) or None, dict(parse_qsl(query))
+
+
+class HotLinkTracker:
+    def __init__(self, app, capacity=1000, window=60.0, publish_count=100, background=True):
+        self.app = app
+        self.background = background
+        self.capacity = capacity
+        self.window = window
+        self.publish_count = publish_count
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self._summaries = {LINK: SpaceSaving(capacity), QR: SpaceSaving(capacity)}
+        self._window_start = datetime.datetime.utcnow()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def record(self, kind, key):
+        if self.background:
+            self._ensure_started()
+        with self._lock:
+            self._summaries[kind].add(key)
+
+    def current(self, kind, n=None):
+        """This worker's summary for the window in progress."""
+        with self._lock:
+            return self._summaries[kind].top(n)
+
+    def publish(self):
+        """Replace this worker's rows with the window just finished and start a new one."""
+        now = datetime.datetime.utcnow()
+        with self._lock:
+            summaries = self._summaries
+            self._summaries = {kind: SpaceSaving(self.capacity) for kind in summaries}
+            window_start, self._window_start = self._window_start, now
+        table = HotLink.__table__
+        rows = [
+            dict(
+                worker=self.worker,
+                kind=kind,
+                key=key,
+                requests=count,
+                error=error,
+                window_start=window_start,
+                window_end=now,
+            )
+            for kind, summary in summaries.items()
+            for key, count, error in summary.top(self.publish_count)
+        ]
+        stale = now - datetime.timedelta(seconds=10 * self.window)
+        db.session.execute(delete(table).where((table.c.worker == self.worker) | (table.c.window_end < stale)))
+        if rows:
+            db.session.execute(insert(table), rows)
+
+    def stop(self):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(10)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Forked from a preloaded master: start over under this process's name.
+            self.worker = f"{socket.gethostname()}-{os.getpid()}"
+            self._summaries = {kind: SpaceSaving(self.capacity) for kind in self._summaries}
+            self._window_start = datetime.datetime.utcnow()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="lnkshrtnr-hot-links", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            self._publish_committed()
+        self._publish_committed()
+
+    def _publish_committed(self):
+        with self.app.app_context():
+            try:
+                self.publish()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Failed to publish hot links.")
+
+
+def init_app(app):
+    global tracker
+    if os.getenv("HOT_LINKS", "on") == "off":
+        return
+    tracker = HotLinkTracker(
+        app,
+        capacity=int(os.getenv("HOT_CAPACITY", "1000")),
+        window=float(os.getenv("HOT_WINDOW", "60")),
+        publish_count=int(os.getenv("HOT_PUBLISH_COUNT", "100")),
+        # Tests publish by hand.
+        background=not os.getenv("TESTING"),
+    )
+    atexit.register(tracker.stop)
+
+
+def record(code):
+    if tracker is not None:
+        tracker.record(LINK, code)
+
+
+def record_qr(format, code, parameter=None, utm_tags=None):
+    if tracker is not None:
+        tracker.record(QR, qr_key(format, code, parameter, utm_tags))
+
+
+def top(kind=LINK, n=50, max_age=None):
+    """The hottest keys across workers that published in the last ``max_age`` seconds (two windows)."""
+    max_age = max_age if max_age is not None else 2 * float(os.getenv("HOT_WINDOW", "60"))
+    table = HotLink.__table__
+    since = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+    rows = db.session.execute(
+        select(table.c.key, table.c.requests, table.c.error, table.c.window_start, table.c.window_end).where(
+            table.c.kind == kind, table.c.window_end >= since
+        )
+    ).all()
+    merged = {}
+    for row in rows:
+        seconds = max((row.window_end - row.window_start).total_seconds(), 1)
+        entry = merged.setdefault(row.key, dict(key=row.key, requests=0, error=0, rate=0.0))
+        entry["requests"] += row.requests
+        entry["error"] += row.error
+        entry["rate"] += row.requests / seconds
+    ranked = sorted(merged.values(), key=lambda entry: -entry["rate"])[:n]
+    for entry in ranked:
+        entry["rate"] = round(entry["rate"], 3)
+    return ranked
+
+
+def prewarm(links=None, qrcodes=None):
+    """Fill this worker's link and QR caches with the hot set; call before serving traffic."""
+    links = links if links is not None else int(os.getenv("HOT_PREWARM_LINKS", "100"))
+    qrcodes = qrcodes if qrcodes is not None else int(os.getenv("HOT_PREWARM_QRCODES", "20"))
+    started = time.monotonic()
+    if not invalidation.wait_until_listening(timeout=10):
+        logger.warning("Not listening for invalidations yet; pre-warmed entries may be dropped.")
+    # Windows published by the workers this deploy replaces.
+    max_age = float(os.getenv("HOT_PREWARM_MAX_AGE", "3600"))
+    hot_links = top(LINK, links, max_age=max_age) if links else []
+    hot_qrcodes = top(QR, qrcodes, max_age=max_age) if qrcodes else []
+    for entry in hot_links:
+        repository.resolve_link(entry["key"])
+    for entry in hot_qrcodes:
+        format, code, parameter, utm_tags = parse_qr_key(entry["key"])
+        if repository.resolve_link(code) is not None:
+            repository.qrcode_for_link(format, code, parameter, **utm_tags)
+    logger.info(
+        "Pre-warmed caches with hot links.",
+        links=len(hot_links),
+        qrcodes=len(hot_qrcodes),
+        seconds=round(time.monotonic() - started, 3),
+    )
+
+
+def stats():
+    if tracker is None:
+        return None
+    return dict(
+        worker=tracker.worker,
+        tracked_links=len(tracker._summaries[LINK].counts),
+        tracked_qrcodes=len(tracker._summaries[QR].counts),
+        capacity=tracker.capacity,
+    )
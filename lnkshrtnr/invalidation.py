@@ -0,0 +1,132 @@
+"""Cross-worker invalidation over Postgres LISTEN/NOTIFY.
+
+Every gunicorn worker (and every dyno) keeps its own in-process caches. Writers call
+``publish()`` inside their transaction; Postgres only delivers the notification once that
+transaction commits, so listeners never drop an entry before the new row is visible. Each
+worker runs one daemon thread holding a dedicated LISTEN connection and dispatches payloads
+to the handlers registered with ``subscribe()``. The writing worker receives its own
+notification too, which closes the window between a local invalidation and the commit.
+
+On databases without LISTEN/NOTIFY (sqlite in tests) ``publish()`` is a no-op and caches
+rely on local invalidation plus their TTL.
+"""
+import os
+import select
+import threading
+import time
+
+import woodchipper
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+
+from .database import db
+
+CHANNEL = "lnkshrtnr_invalidate"
+MAX_PAYLOAD = 7900
+
+logger = woodchipper.get_logger(__name__)
+
+_handlers = {}
+_app = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+_listening = threading.Event()
+
+
+def init_app(app):
+    global _app
+    _app = app
+
+
+def subscribe(kind, handler):
+    """Register ``handler(code)`` for ``kind`` notifications.
+
+    Handlers are called with ``None`` when the listener (re)connects, since anything
+    published while it was disconnected has been missed and all state must be dropped.
+    """
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def publish(kind, *codes):
+    """Notify every worker about ``codes`` once the current transaction commits."""
+    if db.engine.dialect.name != "postgresql":
+        return
+    # Codes can't contain commas, so several share a payload, kept under the 8000 byte limit.
+    payloads = []
+    for code in codes:
+        if payloads and len(payloads[-1]) + len(code) < MAX_PAYLOAD:
+            payloads[-1] += f",{code}"
+        else:
+            payloads.append(f"{kind}:{code}")
+    for payload in payloads:
+        db.session.execute(sql_select(func.pg_notify(CHANNEL, payload)))
+
+
+def ensure_listening():
+    """Start this process's listener thread if it isn't running.
+
+    Cheap enough to call on every request; it is keyed on the pid so a worker forked from a
+    preloaded master starts its own thread.
+    """
+    global _listener_pid
+    if _listener_pid == os.getpid() or _app is None:
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        _listening.clear()
+        with _app.app_context():
+            if db.engine.dialect.name != "postgresql":
+                _listening.set()
+                return
+        threading.Thread(target=_listen, name="lnkshrtnr-invalidation", daemon=True).start()
+
+
+def wait_until_listening(timeout=None):
+    """Start the listener and wait until it is connected; returns whether it is.
+
+    Caches are cleared when the listener connects, so anything filled before then is lost.
+    """
+    ensure_listening()
+    return _listening.wait(timeout)
+
+
+def _dispatch(payload):
+    kind, _, codes = payload.partition(":")
+    for code in codes.split(","):
+        for handler in _handlers.get(kind, []):
+            handler(code)
+
+
+def _reset():
+    for handlers in _handlers.values():
+        for handler in handlers:
+            handler(None)
+
+
+def _listen():
+    while True:
+        connection = None
+        try:
+            with _app.app_context():
+                connection = db.engine.raw_connection()
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+            _reset()
+            _listening.set()
+            logger.info("Listening for cache invalidations.", channel=CHANNEL)
+            while True:
+                if select.select([dbapi_connection], [], [], 30) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    _dispatch(dbapi_connection.notifies.pop(0).payload)
+        except Exception:
+            _listening.clear()
+            logger.exception("Cache invalidation listener failed; reconnecting.")
+            if connection is not None:
+                connection.close()
+            time.sleep(5)
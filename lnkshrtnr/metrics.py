@@ -0,0 +1,104 @@
+"""Prometheus metrics, served from ``/_metrics``.
+
+Each gunicorn worker has its own counters, so under gunicorn ``PROMETHEUS_MULTIPROC_DIR``
+must point at a directory every worker can write to; ``gunicorn.conf.py`` empties it when
+the master starts and retires the files of workers that exit, and a scrape of any worker
+then aggregates all of them. Without it (tests, ``flask run``) metrics are per process.
+
+In-process cache and click writer statistics are exported as gauges summed over live
+workers, refreshed at most once a second per worker.
+"""
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+STEP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+REQUEST_SECONDS = Histogram("lnkshrtnr_request_seconds", "Request latency by route.", ["route", "method", "status"])
+STEP_SECONDS = Histogram("lnkshrtnr_step_seconds", "Latency of hot-path steps.", ["step"], buckets=STEP_BUCKETS)
+NOT_FOUND = Counter("lnkshrtnr_not_found_total", "Redirect requests for unknown or deleted codes.", ["route"])
+CLICKS = Counter(
+    "lnkshrtnr_clicks_total",
+    "Clicks recorded, by whether the user agent is a bot, or dropped as duplicates.",
+    ["kind"],
+)
+RATE_LIMITED = Counter(
+    "lnkshrtnr_rate_limited_total", "Requests over a client's rate limit, by class and action.", ["route", "action"]
+)
+QR_REQUESTS = Counter("lnkshrtnr_qr_requests_total", "QR code requests by how they were served.", ["served_from"])
+DB_POOL = Gauge(
+    "lnkshrtnr_db_pool_connections", "Database pool connections by state.", ["state"], multiprocess_mode="livesum"
+)
+CACHE = Gauge(
+    "lnkshrtnr_cache", "In-process cache counters and sizes.", ["cache", "stat"], multiprocess_mode="livesum"
+)
+
+REDIRECT_ENDPOINTS = {"simple_redirect", "redirect_with_parameter"}
+GAUGE_REFRESH_INTERVAL = 1.0
+
+_stats_sources = {}
+_last_refresh = 0
+
+
+def timer(step):
+    """Time a block or function as ``step``; usable as a context manager or decorator."""
+    return STEP_SECONDS.labels(step).time()
+
+
+def register_stats(name, stats):
+    """Export the numeric values of ``stats()`` as ``lnkshrtnr_cache{cache=name}`` gauges."""
+    _stats_sources[name] = stats
+
+
+def init_app(app, db):
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        route = request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+        started = getattr(g, "request_started", None)
+        if started is not None:
+            REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+        if route in REDIRECT_ENDPOINTS and response.status_code == 404:
+            NOT_FOUND.labels(route).inc()
+        _refresh_gauges(db)
+        return response
+
+
+def _refresh_gauges(db):
+    global _last_refresh
+    now = time.monotonic()
+    if now - _last_refresh < GAUGE_REFRESH_INTERVAL:
+        return
+    _last_refresh = now
+    pool = db.engine.pool
+    for state in ["size", "checkedin", "checkedout", "overflow"]:
+        if hasattr(pool, state):
+            DB_POOL.labels(state).set(getattr(pool, state)())
+    for name, stats in _stats_sources.items():
+        for stat, value in (stats() or {}).items():
+            # Ratios and settings don't sum across workers.
+            if isinstance(value, int) and not isinstance(value, bool) and stat not in {"ttl"}:
+                CACHE.labels(name, stat).set(value)
+
+
+def render():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,145 @@
+"""Partition clicks by month
+
+Revision ID: 2d1cc1f71943
+Revises: 8b2f6d0c3e19
+Create Date: 2026-10-18 18:21:58.107315
+
+"""
+import datetime
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2d1cc1f71943"
+down_revision = "8b2f6d0c3e19"
+branch_labels = ()
+depends_on = None
+
+COLUMNS = "id, clicker, link_id, clicked_at, client_ip, referer, user_agent, source, medium, campaign, term, content"
+# Months partitioned past the current one; `flask maintain-click-partitions` keeps this up.
+MONTHS_AHEAD = 3
+# Rows moved from the old table per transaction.
+BATCH_SIZE = 10000
+# Clicks without a timestamp can't be queried by time anyway; they land in the default partition.
+_MOVED_COLUMNS = COLUMNS.replace("clicked_at", "coalesce(clicked_at, to_timestamp(0)::timestamp)")
+
+
+def _next_month(month):
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _table_exists(name):
+    return op.get_bind().execute(sa.text("SELECT to_regclass(:name)"), dict(name=name)).scalar() is not None
+
+
+def _move_in_batches(source, target, select_columns=COLUMNS):
+    """Move every row of ``source`` into ``target``, committing after each batch.
+
+    The new table is already live, so click writes only wait for the (short) cut-over, not
+    for the copy. Reads of old clicks see them once their batch has moved.
+    """
+    with op.get_context().autocommit_block():
+        while True:
+            moved = (
+                op.get_bind()
+                .execute(
+                    sa.text(
+                        f"WITH moved AS (DELETE FROM {source} WHERE id IN (SELECT id FROM {source} LIMIT :batch_size)"
+                        f" RETURNING {COLUMNS}) INSERT INTO {target} ({COLUMNS}) SELECT {select_columns} FROM moved"
+                    ),
+                    dict(batch_size=BATCH_SIZE),
+                )
+                .rowcount
+            )
+            if not moved:
+                break
+    op.execute(f"DROP TABLE {source}")
+
+
+def upgrade() -> None:
+    # Only Postgres partitions; elsewhere (sqlite in tests) the table is left as it is.
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    if _table_exists("shortened_link_click_unpartitioned"):
+        # A previous run cut over and was interrupted while moving rows; finish the move.
+        _move_in_batches("shortened_link_click_unpartitioned", "shortened_link_click", _MOVED_COLUMNS)
+        return
+    op.execute("ALTER TABLE shortened_link_click RENAME TO shortened_link_click_unpartitioned")
+    op.execute(
+        "ALTER TABLE shortened_link_click_unpartitioned"
+        " RENAME CONSTRAINT shortened_link_click_pkey TO shortened_link_click_unpartitioned_pkey"
+    )
+    op.execute("DROP INDEX ix_shortened_link_click_link_id_clicked_at")
+    # The partition key has to be part of the primary key.
+    op.execute(
+        """
+        CREATE TABLE shortened_link_click (
+            id UUID NOT NULL,
+            clicker UUID,
+            link_id VARCHAR REFERENCES shortened_link (code),
+            clicked_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            client_ip VARCHAR NOT NULL,
+            referer VARCHAR NOT NULL,
+            user_agent VARCHAR NOT NULL,
+            source VARCHAR,
+            medium VARCHAR,
+            campaign VARCHAR,
+            term VARCHAR,
+            content VARCHAR,
+            CONSTRAINT shortened_link_click_pkey PRIMARY KEY (id, clicked_at)
+        ) PARTITION BY RANGE (clicked_at)
+        """
+    )
+    op.execute("CREATE INDEX ix_shortened_link_click_link_id_clicked_at ON shortened_link_click (link_id, clicked_at)")
+    op.execute("CREATE TABLE shortened_link_click_default PARTITION OF shortened_link_click DEFAULT")
+
+    earliest = (
+        op.get_bind().execute(sa.text("SELECT min(clicked_at) FROM shortened_link_click_unpartitioned")).scalar()
+    )
+    now = datetime.datetime.utcnow()
+    month = datetime.datetime((earliest or now).year, (earliest or now).month, 1)
+    last = datetime.datetime(now.year, now.month, 1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE shortened_link_click_y{month.year}m{month.month:02d} PARTITION OF shortened_link_click"
+            f" FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        )
+        month = _next_month(month)
+
+    _move_in_batches("shortened_link_click_unpartitioned", "shortened_link_click", _MOVED_COLUMNS)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("ALTER TABLE shortened_link_click RENAME TO shortened_link_click_partitioned")
+    op.execute(
+        "ALTER TABLE shortened_link_click_partitioned"
+        " RENAME CONSTRAINT shortened_link_click_pkey TO shortened_link_click_partitioned_pkey"
+    )
+    op.execute("DROP INDEX ix_shortened_link_click_link_id_clicked_at")
+    op.execute(
+        """
+        CREATE TABLE shortened_link_click (
+            id UUID NOT NULL,
+            clicker UUID,
+            link_id VARCHAR REFERENCES shortened_link (code),
+            clicked_at TIMESTAMP WITHOUT TIME ZONE,
+            client_ip VARCHAR NOT NULL,
+            referer VARCHAR NOT NULL,
+            user_agent VARCHAR NOT NULL,
+            source VARCHAR,
+            medium VARCHAR,
+            campaign VARCHAR,
+            term VARCHAR,
+            content VARCHAR,
+            CONSTRAINT shortened_link_click_pkey PRIMARY KEY (id)
+        )
+        """
+    )
+    op.execute("CREATE INDEX ix_shortened_link_click_link_id_clicked_at ON shortened_link_click (link_id, clicked_at)")
+    # Dropping the parent drops every partition.
+    _move_in_batches("shortened_link_click_partitioned", "shortened_link_click")
@@ -0,0 +1,57 @@
+"""Add click enrichment
+
+Revision ID: 3a3c03cc6d62
+Revises: 3cad2846070b
+Create Date: 2026-10-18 19:48:12.530117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3a3c03cc6d62"
+down_revision = "3cad2846070b"
+branch_labels = ()
+depends_on = None
+
+DIMENSION_COLUMNS = ["browser_id", "os_id", "device_class_id", "referer_host_id"]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "click_dimension",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("kind", "value"),
+    )
+    op.create_table(
+        "enrichment_checkpoint",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("clicked_at", sa.DateTime(), nullable=False),
+        sa.Column("enriched", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    # On Postgres these reach every click partition through the parent; sqlite copies the table.
+    with op.batch_alter_table("shortened_link_click") as batch_op:
+        for column in DIMENSION_COLUMNS:
+            batch_op.add_column(sa.Column(column, sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(f"shortened_link_click_{column}_fkey", "click_dimension", [column], ["id"])
+    op.create_index(
+        "ix_shortened_link_click_unenriched",
+        "shortened_link_click",
+        ["clicked_at", "id"],
+        postgresql_where=sa.text("device_class_id IS NULL"),
+        sqlite_where=sa.text("device_class_id IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_shortened_link_click_unenriched", table_name="shortened_link_click")
+    with op.batch_alter_table("shortened_link_click") as batch_op:
+        for column in DIMENSION_COLUMNS:
+            batch_op.drop_column(column)
+    op.drop_table("enrichment_checkpoint")
+    op.drop_table("click_dimension")
@@ -0,0 +1,39 @@
+"""Add click rollups
+
+Revision ID: 3c5e0f2a9b71
+Revises: af296672fac5
+Create Date: 2026-10-18 09:12:41.203118
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c5e0f2a9b71"
+down_revision = "af296672fac5"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    for table_name in ["shortened_link_click_hourly", "shortened_link_click_daily"]:
+        op.create_table(
+            table_name,
+            sa.Column("link_id", sa.String(), nullable=False),
+            sa.Column("bucket", sa.DateTime(), nullable=False),
+            sa.Column("source", sa.String(), nullable=False),
+            sa.Column("medium", sa.String(), nullable=False),
+            sa.Column("campaign", sa.String(), nullable=False),
+            sa.Column("is_bot", sa.Boolean(), nullable=False),
+            sa.Column("clicks", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(
+                ["link_id"],
+                ["shortened_link.code"],
+            ),
+            sa.PrimaryKeyConstraint("link_id", "bucket", "source", "medium", "campaign", "is_bot"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("shortened_link_click_daily")
+    op.drop_table("shortened_link_click_hourly")
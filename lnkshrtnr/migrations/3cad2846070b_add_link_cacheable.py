@@ -0,0 +1,24 @@
+"""Add link cacheable flag
+
+Revision ID: 3cad2846070b
+Revises: c44decbed078
+Create Date: 2026-10-18 19:02:44.915230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3cad2846070b"
+down_revision = "c44decbed078"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("shortened_link", sa.Column("cacheable", sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("shortened_link") as batch_op:
+        batch_op.drop_column("cacheable")
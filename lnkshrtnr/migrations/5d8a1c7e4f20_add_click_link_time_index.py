@@ -0,0 +1,34 @@
+"""Add click (link_id, clicked_at) index
+
+Revision ID: 5d8a1c7e4f20
+Revises: 3c5e0f2a9b71
+Create Date: 2026-10-18 11:02:17.548312
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d8a1c7e4f20"
+down_revision = "3c5e0f2a9b71"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built concurrently so the click table stays writable while the index is created.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_shortened_link_click_link_id_clicked_at",
+            "shortened_link_click",
+            ["link_id", "clicked_at"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_shortened_link_click_link_id_clicked_at",
+            table_name="shortened_link_click",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,33 @@
+"""Add code block sequence
+
+Revision ID: 8b2f6d0c3e19
+Revises: 5d8a1c7e4f20
+Create Date: 2026-10-18 12:40:55.871204
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b2f6d0c3e19"
+down_revision = "5d8a1c7e4f20"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(sa.schema.CreateSequence(sa.Sequence("shortened_link_code_block_seq")))
+    else:
+        op.create_table(
+            "code_block",
+            sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(sa.schema.DropSequence(sa.Sequence("shortened_link_code_block_seq")))
+    else:
+        op.drop_table("code_block")
@@ -0,0 +1,33 @@
+"""Add visitor sketches
+
+Revision ID: c44decbed078
+Revises: 2d1cc1f71943
+Create Date: 2026-10-18 18:41:07.296514
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c44decbed078"
+down_revision = "2d1cc1f71943"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "shortened_link_visitor_sketch",
+        sa.Column("link_id", sa.String(), nullable=False),
+        sa.Column("bucket", sa.DateTime(), nullable=False),
+        sa.Column("sketch", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["link_id"],
+            ["shortened_link.code"],
+        ),
+        sa.PrimaryKeyConstraint("link_id", "bucket"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("shortened_link_visitor_sketch")
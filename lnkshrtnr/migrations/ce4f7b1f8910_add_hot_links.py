@@ -0,0 +1,35 @@
+"""Add hot links
+
+Revision ID: ce4f7b1f8910
+Revises: 3a3c03cc6d62
+Create Date: 2026-10-18 20:21:36.804112
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "ce4f7b1f8910"
+down_revision = "3a3c03cc6d62"
+branch_labels = ()
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "hot_link",
+        sa.Column("worker", sa.String(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Integer(), nullable=False),
+        sa.Column("window_start", sa.DateTime(), nullable=False),
+        sa.Column("window_end", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("worker", "kind", "key"),
+    )
+    op.create_index(op.f("ix_hot_link_window_end"), "hot_link", ["window_end"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_hot_link_window_end"), table_name="hot_link")
+    op.drop_table("hot_link")
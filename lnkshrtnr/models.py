@@ -1,8 +1,20 @@
 import uuid
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+    text,
+)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.sql import false, func
 
 from .database import db
 
@@ -16,13 +28,47 @@ class ShortenedLink(db.Model):
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
     deleted_at = Column(DateTime, nullable=True)
+    # Served as a cacheable permanent redirect, without tracking clicks.
+    cacheable = Column(Boolean, nullable=False, default=False, server_default=false())
+
+
+class ClickDimension(db.Model):
+    """A distinct browser, OS, device class or referer host, keyed by a small integer (see enrichment.py)."""
+
+    __table_args__ = (UniqueConstraint("kind", "value"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False)
+    value = Column(String, nullable=False)
+
+
+class EnrichmentCheckpoint(db.Model):
+    """How far click enrichment has got."""
+
+    name = Column(String, primary_key=True)
+    clicked_at = Column(DateTime, nullable=False)
+    enriched = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=func.now(), onupdate=func.now())
 
 
 class ShortenedLinkClick(db.Model):
+    __table_args__ = (
+        Index("ix_shortened_link_click_link_id_clicked_at", "link_id", "clicked_at"),
+        # Only clicks still waiting for enrichment, so it stays small.
+        Index(
+            "ix_shortened_link_click_unenriched",
+            "clicked_at",
+            "id",
+            postgresql_where=text("device_class_id IS NULL"),
+            sqlite_where=text("device_class_id IS NULL"),
+        ),
+    )
+
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     clicker = Column(UUID(as_uuid=True), default=uuid.uuid4)
     link_id = Column(ForeignKey(ShortenedLink.code))
-    clicked_at = Column(DateTime, default=func.now())
+    # Part of the key because the table is partitioned on it (see partitions.py).
+    clicked_at = Column(DateTime, primary_key=True, default=func.now())
     client_ip = Column(String, nullable=False)
     referer = Column(String, nullable=False)
     user_agent = Column(String, nullable=False)
@@ -31,3 +77,55 @@ class ShortenedLinkClick(db.Model):
     campaign = Column(String, nullable=True)
     term = Column(String, nullable=True)
     content = Column(String, nullable=True)
+    # Filled in after the fact by enrichment.py; device_class_id is NULL until then.
+    browser_id = Column(ForeignKey(ClickDimension.id), nullable=True)
+    os_id = Column(ForeignKey(ClickDimension.id), nullable=True)
+    device_class_id = Column(ForeignKey(ClickDimension.id), nullable=True)
+    referer_host_id = Column(ForeignKey(ClickDimension.id), nullable=True)
+
+
+class CodeBlock(db.Model):
+    """Stand-in for the Postgres ``shortened_link_code_block_seq`` sequence on sqlite."""
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+
+class ClickRollupMixin:
+    @declared_attr
+    def link_id(cls):
+        return Column(ForeignKey(ShortenedLink.code), primary_key=True)
+
+    bucket = Column(DateTime, primary_key=True)
+    source = Column(String, primary_key=True, default="")
+    medium = Column(String, primary_key=True, default="")
+    campaign = Column(String, primary_key=True, default="")
+    is_bot = Column(Boolean, primary_key=True, default=False)
+    clicks = Column(Integer, nullable=False, default=0)
+
+
+class ShortenedLinkClickHourly(ClickRollupMixin, db.Model):
+    pass
+
+
+class ShortenedLinkClickDaily(ClickRollupMixin, db.Model):
+    pass
+
+
+class ShortenedLinkVisitorSketch(db.Model):
+    """A HyperLogLog sketch (see hll.py) of the distinct clickers on a link in a day."""
+
+    link_id = Column(ForeignKey(ShortenedLink.code), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    sketch = Column(LargeBinary, nullable=False)
+
+
+class HotLink(db.Model):
+    """One worker's count for a hot link (or QR code) over its last window (see hot.py)."""
+
+    worker = Column(String, primary_key=True)
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    requests = Column(Integer, nullable=False)
+    error = Column(Integer, nullable=False)
+    window_start = Column(DateTime, nullable=False)
+    window_end = Column(DateTime, nullable=False, index=True)
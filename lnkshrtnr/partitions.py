@@ -0,0 +1,92 @@
+"""Monthly partitions of ``shortened_link_click``.
+
+On Postgres the click table is range-partitioned on ``clicked_at``, one partition per
+calendar month (``shortened_link_click_y2026m10``), plus a default partition that catches
+clicks for months nobody created a partition for. ``flask maintain-click-partitions``
+should run at least monthly (e.g. from the scheduler) to create partitions ahead of time;
+a partition created late adopts whatever its month put into the default partition.
+
+On other databases (sqlite in tests) the table is not partitioned and these are no-ops.
+"""
+import datetime
+
+import woodchipper
+from sqlalchemy import text
+
+from .database import db
+
+PARENT = "shortened_link_click"
+DEFAULT_PARTITION = f"{PARENT}_default"
+
+logger = woodchipper.get_logger(__name__)
+
+
+def month_start(timestamp):
+    return datetime.datetime(timestamp.year, timestamp.month, 1)
+
+
+def next_month(month):
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{PARENT}_y{month.year}m{month.month:02d}"
+
+
+def partitioned():
+    return db.engine.dialect.name == "postgresql"
+
+
+def existing_partitions():
+    return set(
+        db.session.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits"
+                " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+                " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+                " WHERE parent.relname = :parent"
+            ),
+            dict(parent=PARENT),
+        ).scalars()
+    )
+
+
+def create_partition(month):
+    """Create ``month``'s partition, moving any of its clicks out of the default partition."""
+    name = partition_name(month)
+    bounds = f"FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    db.session.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    moved = db.session.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE clicked_at >= :start AND clicked_at < :end"
+            f" RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        ),
+        dict(start=month, end=next_month(month)),
+    ).rowcount
+    db.session.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    logger.info("Created click partition.", partition=name, moved_from_default=moved)
+
+
+def ensure_partitions(ahead=3, now=None):
+    """Make sure partitions exist from the current month through ``ahead`` months from now."""
+    if not partitioned():
+        return []
+    existing = existing_partitions()
+    month = month_start(now or datetime.datetime.utcnow())
+    created = []
+    for _ in range(ahead + 1):
+        if partition_name(month) not in existing:
+            create_partition(month)
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+
+def drop_partition(month):
+    """Detach and drop ``month``'s partition, if it has one. Returns whether it did."""
+    name = partition_name(month)
+    if not partitioned() or name not in existing_partitions():
+        return False
+    db.session.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    db.session.execute(text(f"DROP TABLE {name}"))
+    return True
@@ -0,0 +1,66 @@
+"""Purging cached redirects from a CDN.
+
+Cacheable links are served with a ``Surrogate-Key`` header naming the link, and every
+PUT/DELETE of a link calls ``purge_link(code)`` once the change is committed. Handlers
+registered with ``register()`` receive the surrogate key. If ``CDN_PURGE_URL`` is set, a
+built-in handler POSTs to it with ``{key}`` replaced by the surrogate key (e.g. Fastly's
+``https://api.fastly.com/service/<id>/purge/{key}``), sending the headers in the JSON
+object ``CDN_PURGE_HEADERS``. Purges run in the background and failures are only logged;
+``CACHEABLE_MAX_AGE`` bounds how long a missed purge, or a browser's copy, can be stale.
+
+Cacheable links are redirected with ``CACHEABLE_REDIRECT_STATUS`` (301; any of 301, 302,
+303, 307 or 308) by the app and the standalone resolver alike.
+"""
+import json
+import os
+import threading
+import urllib.request
+
+import woodchipper
+
+logger = woodchipper.get_logger(__name__)
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+# Untracked links: how they redirect, and how long browsers and CDNs may reuse the redirect.
+CACHEABLE_REDIRECT_STATUS = int(os.getenv("CACHEABLE_REDIRECT_STATUS", "301"))
+CACHEABLE_MAX_AGE = int(os.getenv("CACHEABLE_MAX_AGE", "3600"))
+if CACHEABLE_REDIRECT_STATUS not in REDIRECT_STATUSES:
+    raise RuntimeError(f"CACHEABLE_REDIRECT_STATUS must be one of {sorted(REDIRECT_STATUSES)}.")
+
+_handlers = []
+
+
+def surrogate_key(code):
+    return f"link-{code}"
+
+
+def register(handler):
+    """Call ``handler(surrogate_key)`` whenever a link's cached responses must be dropped."""
+    _handlers.append(handler)
+
+
+def purge_link(code):
+    key = surrogate_key(code)
+    for handler in _handlers:
+        threading.Thread(target=_run, args=(handler, key), name="lnkshrtnr-purge", daemon=True).start()
+
+
+def _run(handler, key):
+    try:
+        handler(key)
+    except Exception:
+        logger.exception("CDN purge failed.", surrogate_key=key)
+
+
+def http_purge(key):
+    request = urllib.request.Request(
+        os.getenv("CDN_PURGE_URL").replace("{key}", key),
+        method="POST",
+        headers=json.loads(os.getenv("CDN_PURGE_HEADERS", "{}")),
+    )
+    with urllib.request.urlopen(request, timeout=float(os.getenv("CDN_PURGE_TIMEOUT", "5"))) as response:  # nosec
+        logger.info("Purged CDN cache.", surrogate_key=key, status=response.status)
+
+
+if os.getenv("CDN_PURGE_URL"):
+    register(http_purge)
@@ -0,0 +1,177 @@
+"""Batch QR code rendering for print runs.
+
+``POST /_qr/batch`` takes a JSON list of ``{"code", "parameter", "utm", "format"}`` entries
+(``parameter`` and ``utm`` optional, ``format`` png by default; at most
+``QR_BATCH_MAX_ENTRIES``, 1000) and streams back a ZIP with a file per entry, each written
+as soon as it is ready. Cached codes go out first. The rest are rendered by
+``repository.render_qrcode`` in a pool of ``QR_BATCH_PROCESSES`` processes (one per CPU, up
+to 4) while the request worker only waits, and are cached as if they had been requested
+one at a time, so every file is byte-identical to ``GET /<code>[/<parameter>]?qr=<format>``
+with the same UTM tags (``utm`` keys are the ``repository.UTM_TAGS`` names, without the
+``utm_`` prefix). Entries that can't be rendered (unknown code, bad format or tag) are
+listed in ``errors.json`` at the end of the archive.
+
+Each worker starts its pool on its first batch, with the ``QR_BATCH_START_METHOD``
+multiprocessing start method (spawn, which is safe from a worker running threads).
+"""
+import atexit
+import io
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+
+import woodchipper
+
+from . import metrics, repository
+
+logger = woodchipper.get_logger(__name__)
+
+MAX_ENTRIES = int(os.getenv("QR_BATCH_MAX_ENTRIES", "1000"))
+PROCESSES = int(os.getenv("QR_BATCH_PROCESSES", str(min(os.cpu_count() or 1, 4))))
+START_METHOD = os.getenv("QR_BATCH_START_METHOD", "spawn")
+
+QRJob = namedtuple("QRJob", ["index", "name", "format", "etag", "url"])
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESSES, mp_context=multiprocessing.get_context(START_METHOD)
+            )
+            _executor_pid = os.getpid()
+            atexit.register(_executor.shutdown, wait=False)
+        return _executor
+
+
+def _discard_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+
+
+def prepare(items):
+    """Turn request entries into ``([QRJob], [error])``; this is where links are looked up."""
+    jobs = []
+    errors = []
+    names = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append(dict(index=index, error="invalid"))
+            continue
+        code = str(item.get("code", "")).lower()
+        parameter = item.get("parameter")
+        format = item.get("format", "png")
+        utm_tags = item.get("utm") or {}
+        if format not in repository.QR_CONTENT_TYPES:
+            errors.append(dict(index=index, code=code, error="invalid_format"))
+            continue
+        if (parameter is not None and not isinstance(parameter, str)) or not (
+            isinstance(utm_tags, dict)
+            and set(utm_tags) <= set(repository.UTM_TAGS)
+            and all(isinstance(value, str) for value in utm_tags.values())
+        ):
+            errors.append(dict(index=index, code=code, error="invalid"))
+            continue
+        link = repository.resolve_link(code)
+        # The same checks as the redirect routes, which would 404.
+        if (
+            link is None
+            or (parameter is None and link.template.parameterized and link.default_parameter is None)
+            or (parameter is not None and not link.template.parameterized)
+        ):
+            errors.append(dict(index=index, code=code, error="not_found"))
+            continue
+        base = f"{code}-{quote(parameter, safe='')}" if parameter else code
+        name = f"{base}.{format}" if f"{base}.{format}" not in names else f"{base}-{index}.{format}"
+        names.add(name)
+        jobs.append(
+            QRJob(
+                index=index,
+                name=name,
+                format=format,
+                etag=repository.qrcode_etag(format, code, parameter, **utm_tags),
+                url=repository.qrcode_url(code, parameter, **utm_tags),
+            )
+        )
+    return jobs, errors
+
+
+class _Chunks(io.RawIOBase):
+    """An unseekable sink that ``zipfile`` streams into, emptied after every entry."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _write(archive, job, content):
+    compression = zipfile.ZIP_STORED if job.format == "png" else zipfile.ZIP_DEFLATED
+    archive.writestr(job.name, content, compress_type=compression)
+
+
+def stream_zip(jobs, errors):
+    """Yield a ZIP of ``jobs`` chunk by chunk, in the order they finish rendering."""
+    sink = _Chunks()
+    # Jobs that encode the same thing are rendered once.
+    rendering = {}
+    pool = None
+    try:
+        with zipfile.ZipFile(sink, "w") as archive:
+            for job in jobs:
+                if job.etag in rendering:
+                    rendering[job.etag][1].append(job)
+                    continue
+                content, served_from = repository.cached_qrcode(job.format, job.etag)
+                if content is None:
+                    pool = pool or executor()
+                    rendering[job.etag] = (pool.submit(repository.render_qrcode, job.format, job.url), [job])
+                    continue
+                metrics.QR_REQUESTS.labels(served_from).inc()
+                _write(archive, job, content)
+                yield sink.take()
+            futures = {future: same for future, same in rendering.values()}
+            for future in as_completed(futures):
+                try:
+                    content = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_executor(pool)
+                    logger.exception("Failed to render QR code.", url=futures[future][0].url)
+                    errors.extend(dict(index=job.index, error="render_failed") for job in futures[future])
+                    continue
+                repository.cache_qrcode(futures[future][0].format, futures[future][0].etag, content)
+                metrics.QR_REQUESTS.labels("render").inc()
+                for job in futures[future]:
+                    _write(archive, job, content)
+                yield sink.take()
+            if errors:
+                archive.writestr("errors.json", json.dumps(sorted(errors, key=lambda error: error["index"])))
+        yield sink.take()
+    finally:
+        # The client may have gone away mid-stream.
+        for future, _ in rendering.values():
+            future.cancel()
@@ -0,0 +1,159 @@
+"""Per-client rate limits for redirects, QR codes and writes.
+
+Requests are classed as ``redirect``, ``qr`` (``?qr=``) or ``write`` (POST, PUT, PATCH,
+DELETE), each with its own limit ``RATE_LIMIT_<CLASS>`` of ``<requests>/<seconds>``
+(defaults 600/60, 120/60 and 60/60; ``off`` disables one class, ``RATE_LIMIT=off`` all of
+them). The limit applies separately to the client IP, taken from X-Forwarded-For as for
+clicks (``XFF_TRUSTED_HOPS``), and to the ``clicker`` cookie, and a request has to fit
+both. Buckets are per worker, so with N workers a client spread across them gets up to N
+times the limit.
+
+A bucket is one float: the time at which it will be full again (GCRA, the scheduling form
+of a token bucket). A request fits if taking it pushes that time no more than a period
+ahead of now. A full bucket behaves like no bucket at all, so every
+``RATE_LIMIT_SWEEP_INTERVAL`` seconds (10) the next request drops those, and memory only
+grows with the clients seen in the last period.
+
+Over its limit a client gets a 429 with Retry-After, except on redirects: by default
+(``RATE_LIMIT_REDIRECT_MODE=skip-click``) those are still served but no click is
+recorded, so a client hammering a link costs no database writes while people sharing an
+office or NAT address with it still get where they were going. ``reject`` answers
+redirects with a 429 as well.
+"""
+import functools
+import math
+import os
+import threading
+import time
+import uuid
+
+import woodchipper
+from flask import g, make_response, request
+
+from . import metrics, repository
+
+logger = woodchipper.get_logger(__name__)
+
+REDIRECT = "redirect"
+QR = "qr"
+WRITE = "write"
+DEFAULT_LIMITS = {REDIRECT: "600/60", QR: "120/60", WRITE: "60/60"}
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+REJECT = "reject"
+SKIP_CLICK = "skip-click"
+REDIRECT_MODE = os.getenv("RATE_LIMIT_REDIRECT_MODE", SKIP_CLICK)
+SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "10"))
+
+
+class RateLimiter:
+    """``requests`` per ``period`` seconds for each key, with bursts of up to ``requests``."""
+
+    def __init__(self, requests, period, sweep_interval=10.0, clock=time.monotonic):
+        self.requests = requests
+        self.period = period
+        self.interval = period / requests
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._full_at = {}
+        self._lock = threading.Lock()
+        self._next_sweep = clock() + sweep_interval
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, keys):
+        """Take a request from each key's bucket; return 0, or the seconds until one would fit."""
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            full_at = [max(self._full_at.get(key, now), now) + self.interval for key in keys]
+            wait = max((at - now - self.period for at in full_at), default=0)
+            if wait > 0:
+                self.limited += 1
+                return wait
+            for key, at in zip(keys, full_at):
+                self._full_at[key] = at
+            self.allowed += 1
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._full_at.clear()
+
+    def _sweep(self, now):
+        self._full_at = {key: at for key, at in self._full_at.items() if at > now}
+        self._next_sweep = now + self.sweep_interval
+
+    def stats(self):
+        return dict(clients=len(self._full_at), allowed=self.allowed, limited=self.limited)
+
+
+def _limiter(route):
+    value = os.getenv(f"RATE_LIMIT_{route.upper()}", DEFAULT_LIMITS[route])
+    if value == "off":
+        return None
+    requests, _, seconds = value.partition("/")
+    return RateLimiter(int(requests), float(seconds or "1"), sweep_interval=SWEEP_INTERVAL)
+
+
+limiters = {} if os.getenv("RATE_LIMIT", "on") == "off" else {route: _limiter(route) for route in DEFAULT_LIMITS}
+
+
+def request_class():
+    if request.method in WRITE_METHODS:
+        return WRITE
+    return QR if request.args.get("qr") else REDIRECT
+
+
+def client_keys():
+    keys = []
+    ip = repository.client_ip(request.headers.get("x-forwarded-for"), request.remote_addr)
+    if ip:
+        keys.append(ip)
+    clicker = request.cookies.get("clicker")
+    if clicker:
+        try:
+            keys.append(str(uuid.UUID(clicker)))
+        except ValueError:
+            pass
+    return keys
+
+
+def rate_limited(fn):
+    """Apply the limit for the request's class; a redirect over it may instead skip its click."""
+
+    @functools.wraps(fn)
+    def __wrapped__(*args, **kwargs):
+        route = request_class()
+        limiter = limiters.get(route)
+        if limiter is not None:
+            wait = limiter.acquire(client_keys())
+            if wait:
+                if route == REDIRECT and REDIRECT_MODE == SKIP_CLICK:
+                    metrics.RATE_LIMITED.labels(route, "skip_click").inc()
+                    g.skip_click = True
+                else:
+                    metrics.RATE_LIMITED.labels(route, "rejected").inc()
+                    logger.info("Rate limited request.", route=route, path=request.path, retry_after=wait)
+                    response = make_response("Too many requests", 429)
+                    response.headers["Retry-After"] = str(math.ceil(wait))
+                    return response
+        return fn(*args, **kwargs)
+
+    return __wrapped__
+
+
+def reset():
+    for limiter in limiters.values():
+        if limiter is not None:
+            limiter.clear()
+
+
+def stats():
+    return {
+        f"{route}_{stat}": value
+        for route, limiter in limiters.items()
+        if limiter is not None
+        for stat, value in limiter.stats().items()
+    }
@@ -1,31 +1,98 @@
+import datetime
+import hashlib
 import os
-import random
 import re
-import string
+import threading
+import time
 import uuid
+from collections import namedtuple
 from io import BytesIO, StringIO
-from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
+from urllib.parse import parse_qs, quote_plus, urlencode, urlparse, urlunparse
 
-import pyqrcode
 import validators.url
+import woodchipper
 from flask import request
-from sqlalchemy import update
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.exc import IntegrityError
-from user_agents import parse
 
-from .database import db
+from . import archive, clicks, codes, invalidation, metrics
+from .agents import classify_user_agent
+from .cache import BloomFilter, DiskCache, LRUCache
+from .database import db, dialect_insert, naive_utc, replica
 from .exceptions import LinkShortenerException
 from .models import ShortenedLink, ShortenedLinkClick
 
+logger = woodchipper.get_logger(__name__)
+
 VALID_CODE_RE = re.compile(r"^[a-z0-9_\.-]+$")
 PARAMETER_PLACEHOLDER = "{}"
+UTM_TAGS = ["source", "medium", "campaign", "term", "content"]
+
+ResolvedLink = namedtuple(
+    "ResolvedLink", ["code", "redirect_to", "default_parameter", "deleted", "template", "cacheable"]
+)
+
+link_cache = LRUCache(
+    maxsize=int(os.getenv("LINK_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("LINK_CACHE_TTL", "60")),
+)
+# Codes that had no link when last looked up, so repeated misses skip the database.
+missing_cache = LRUCache(
+    maxsize=int(os.getenv("MISSING_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("MISSING_CACHE_TTL", "10")),
+)
+
+# A Bloom filter of live codes answers most lookups for unknown codes (scanners, typos)
+# without a query. Each worker builds it when it starts (gunicorn's post_worker_init calls
+# build_code_filter), or else on its first lookup, and adds codes published on the
+# invalidation channel, so a code created by another worker is only visible here
+# once notifications are delivered, i.e. on Postgres; set CODE_FILTER=off to run several
+# workers on anything else. Memory is about 1.2MB per million codes of capacity at the
+# default 1% false positive rate (see BloomFilter); the capacity used is the larger of
+# CODE_FILTER_CAPACITY and twice the live codes at build time.
+CODE_FILTER_ENABLED = os.getenv("CODE_FILTER", "on") != "off"
+CODE_FILTER_CAPACITY = int(os.getenv("CODE_FILTER_CAPACITY", "1000000"))
+CODE_FILTER_ERROR_RATE = float(os.getenv("CODE_FILTER_ERROR_RATE", "0.01"))
+
+_code_filter = None
+_code_filter_lock = threading.Lock()
+
+
+# Codes written in the last REPLICA_LAG_WINDOW seconds, which are read from the primary.
+recent_writes = LRUCache(maxsize=10000, ttl=float(os.getenv("REPLICA_LAG_WINDOW", "5")))
+
+
+def _on_link_invalidated(code):
+    if code is None:
+        link_cache.clear()
+        missing_cache.clear()
+        reset_code_filter()
+        return
+    link_cache.invalidate(code)
+    missing_cache.invalidate(code)
+    recent_writes.set(code, True)
+    _add_to_code_filter([code])
+
+
+invalidation.subscribe("link", _on_link_invalidated)
+
+# Bump to invalidate cached QR codes (and their ETags) when rendering changes.
+QR_RENDER_VERSION = 1
+QR_CONTENT_TYPES = {"png": "image/png", "eps": "application/postscript", "svg": "image/svg+xml"}
+
+qr_cache = LRUCache(maxsize=int(os.getenv("QR_CACHE_BYTES", str(64 * 1024 * 1024))), weigh=len)
+qr_disk_cache = (
+    DiskCache(os.getenv("QR_CACHE_DIR"), int(os.getenv("QR_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))))
+    if os.getenv("QR_CACHE_DIR")
+    else None
+)
 
 
 def merge_utm_tags(url, utm_tags):
     if utm_tags:
         url_parts = urlparse(url)
         qs = parse_qs(url_parts.query)
-        for utm_tag in ["source", "medium", "campaign", "term", "content"]:
+        for utm_tag in UTM_TAGS:
             if utm_tag in utm_tags:
                 qs[f"utm_{utm_tag}"] = utm_tags[utm_tag]
         new_query = urlencode(qs, doseq=True)
@@ -33,70 +100,188 @@ def merge_utm_tags(url, utm_tags):
     return url
 
 
-def qrcode_for_link(format, code, param=None, **utm_tags):
+class RedirectTemplate:
+    """A link's ``redirect_to`` compiled once, so redirects don't reparse it.
+
+    ``url(parameter, utm_tags)`` returns exactly what substituting the parameter and then
+    calling ``merge_utm_tags`` would. With no UTM tags that is plain concatenation; with
+    them, the base query is already parsed and only needs the tags merged in and encoding.
+    A placeholder outside the URL path, or a parameter that would change how the URL
+    splits, falls back to the general path.
+    """
+
+    _UNSAFE_PARAMETER_CHARS = frozenset(";?#")
+
+    def __init__(self, redirect_to):
+        self.redirect_to = redirect_to
+        self.parameterized = PARAMETER_PLACEHOLDER in redirect_to
+        if self.parameterized:
+            self.head, self.tail = redirect_to.split(PARAMETER_PLACEHOLDER, 1)
+        url_parts = urlparse(redirect_to)
+        self.compiled = not self.parameterized or (
+            PARAMETER_PLACEHOLDER in url_parts.path
+            and PARAMETER_PLACEHOLDER not in url_parts.scheme + url_parts.netloc
+        )
+        if self.compiled:
+            prefix = urlunparse(url_parts._replace(query="", fragment=""))
+            if self.parameterized:
+                self.prefix_head, self.prefix_tail = prefix.split(PARAMETER_PLACEHOLDER, 1)
+            else:
+                self.prefix = prefix
+            self.query = parse_qs(url_parts.query)
+            self.encoded_query = urlencode(self.query, doseq=True)
+            self.has_utm_tags = any(f"utm_{utm_tag}" in self.query for utm_tag in UTM_TAGS)
+            self.fragment = f"#{url_parts.fragment}" if url_parts.fragment else ""
+
+    def url(self, parameter=None, utm_tags=None):
+        if not utm_tags:
+            return self.head + parameter + self.tail if self.parameterized else self.redirect_to
+        if self.parameterized:
+            if not self.compiled or not self._UNSAFE_PARAMETER_CHARS.isdisjoint(parameter):
+                return merge_utm_tags(self.head + parameter + self.tail, utm_tags)
+            prefix = self.prefix_head + parameter + self.prefix_tail
+        else:
+            prefix = self.prefix
+        if self.has_utm_tags:
+            qs = dict(self.query)
+            for utm_tag in UTM_TAGS:
+                if utm_tag in utm_tags:
+                    qs[f"utm_{utm_tag}"] = utm_tags[utm_tag]
+            query = urlencode(qs, doseq=True)
+        else:
+            # New keys go last, so the already-encoded base query is a prefix.
+            pairs = [self.encoded_query] if self.encoded_query else []
+            pairs.extend(
+                f"utm_{utm_tag}={quote_plus(utm_tags[utm_tag])}" for utm_tag in UTM_TAGS if utm_tag in utm_tags
+            )
+            query = "&".join(pairs)
+        return f"{prefix}?{query}{self.fragment}" if query else prefix + self.fragment
+
+
+def qrcode_url(code, param=None, **utm_tags):
     url = f"https://{os.getenv('HOSTNAME')}/{code}{'/'+param if param else ''}"
-    url = merge_utm_tags(url, utm_tags)
+    return merge_utm_tags(url, utm_tags)
+
+
+def qrcode_etag(format, code, param=None, **utm_tags):
+    """Strong ETag for a rendered QR code, and the key it is cached under.
+
+    Rendering is deterministic, so the code is addressed by what it encodes: the format and
+    the final URL, which covers the code, parameter, UTM tags and hostname.
+    """
+    url = qrcode_url(code, param, **utm_tags)
+    return hashlib.sha256(f"{QR_RENDER_VERSION}:{format}:{url}".encode("utf8")).hexdigest()
+
+
+def render_qrcode(format, url):
+    import pyqrcode
+
     qr = pyqrcode.create(url, error="H")
     buffer = BytesIO()
     if format == "png":
         qr.png(buffer, scale=10)
-        content_type = "image/png"
     if format == "eps":
         temp_buffer = StringIO()
         qr.eps(temp_buffer, scale=10)
         buffer.write(temp_buffer.getvalue().encode("utf8"))
-        content_type = "application/postscript"
     if format == "svg":
         qr.svg(buffer, scale=10)
-        content_type = "image/svg+xml"
-    buffer.seek(0)
-    return content_type, buffer
+    return buffer.getvalue()
+
+
+def cached_qrcode(format, etag):
+    """``(content, "memory" or "disk")`` for an already rendered QR code, or ``(None, None)``."""
+    content = qr_cache.get(etag)
+    if content is not None:
+        return content, "memory"
+    if qr_disk_cache is not None:
+        content = qr_disk_cache.get(f"{etag}.{format}")
+        if content is not None:
+            qr_cache.set(etag, content)
+            return content, "disk"
+    return None, None
 
 
+def cache_qrcode(format, etag, content):
+    qr_cache.set(etag, content)
+    if qr_disk_cache is not None:
+        qr_disk_cache.set(f"{etag}.{format}", content)
+
+
+@metrics.timer("qrcode")
+def qrcode_for_link(format, code, param=None, **utm_tags):
+    etag = qrcode_etag(format, code, param, **utm_tags)
+    content, served_from = cached_qrcode(format, etag)
+    if content is None:
+        served_from = "render"
+        content = render_qrcode(format, qrcode_url(code, param, **utm_tags))
+        cache_qrcode(format, etag, content)
+    metrics.QR_REQUESTS.labels(served_from).inc()
+    return QR_CONTENT_TYPES[format], BytesIO(content)
+
+
+def client_ip(forwarded_for, remote_addr):
+    """The client's address: the hop ``XFF_TRUSTED_HOPS`` proxies back in X-Forwarded-For."""
+    client_ip = forwarded_for if forwarded_for is not None else remote_addr
+    if client_ip is not None and "," in client_ip:
+        ip_sequence = [ip.strip() for ip in client_ip.split(",")]
+        trusted_hops = int(os.getenv("XFF_TRUSTED_HOPS", "0"))
+        try:
+            client_ip = ip_sequence[-1 * (trusted_hops + 1)]
+        except IndexError:
+            client_ip = None
+    return client_ip
+
+
+@metrics.timer("record_click")
 def record_click(shortened_link):
     try:
-        user_agent = request.headers.get("user-agent")
-        if parse(user_agent).is_bot:
-            return
+        user_agent = request.headers.get("user-agent", "")
+        with metrics.timer("ua_parse"):
+            is_bot = classify_user_agent(user_agent).is_bot
     except RuntimeError:
-        pass
-    db.session.execute(
-        update(ShortenedLink)
-        .where(ShortenedLink.code == shortened_link.code)
-        .values(clicks=(ShortenedLink.clicks + 1))
-    )
+        is_bot = False
     clicker = request.cookies.get("clicker")
     if clicker:
         try:
             clicker = uuid.UUID(clicker)
         except ValueError:
             clicker = None
-    clicker = clicker or uuid.uuid4()
-    client_ip = request.headers.get("x-forwarded-for", request.remote_addr)
-    if client_ip is not None and "," in client_ip:
-        ip_sequence = [ip.strip() for ip in client_ip.split(",")]
-        trusted_hops = int(os.getenv("XFF_TRUSTED_HOPS", "0"))
-        try:
-            client_ip = ip_sequence[-1 * (trusted_hops + 1)]
-        except IndexError:
-            client_ip = None
-    click = ShortenedLinkClick(
-        link_id=shortened_link.code,
-        clicker=clicker,
-        client_ip=client_ip,
-        referer=request.headers.get("referer", ""),
-        user_agent=user_agent,
-        source=request.args.get("utm_source"),
-        medium=request.args.get("utm_medium"),
-        campaign=request.args.get("utm_campaign"),
-        term=request.args.get("utm_term"),
-        content=request.args.get("utm_content"),
+    ip = client_ip(request.headers.get("x-forwarded-for"), request.remote_addr)
+    has_cookie = clicker is not None
+    if has_cookie:
+        clients = [clicker]
+    else:
+        clicker = uuid.uuid4()
+        # Without an address (fewer hops than XFF_TRUSTED_HOPS) every new visitor would look alike.
+        clients = [ip, clicker] if ip else [clicker]
+    if clicks.is_duplicate(shortened_link.code, clients):
+        metrics.CLICKS.labels("duplicate").inc()
+        # A fresh clicker was never recorded; don't replace the one the first click set.
+        return clicker if has_cookie and not is_bot else None
+    metrics.CLICKS.labels("bot" if is_bot else "human").inc()
+    clicks.submit(
+        clicks.Click(
+            link_id=shortened_link.code,
+            clicker=clicker,
+            clicked_at=datetime.datetime.now(datetime.timezone.utc),
+            client_ip=ip or "",
+            referer=request.headers.get("referer", ""),
+            user_agent=user_agent,
+            source=request.args.get("utm_source"),
+            medium=request.args.get("utm_medium"),
+            campaign=request.args.get("utm_campaign"),
+            term=request.args.get("utm_term"),
+            content=request.args.get("utm_content"),
+            is_bot=is_bot,
+        )
     )
-    db.session.add(click)
-    db.session.flush()
+    if is_bot:
+        return None
     return clicker
 
 
+@metrics.timer("lookup")
 def get_link_by_code(code):
     return (
         db.session.query(ShortenedLink)
@@ -105,6 +290,124 @@ def get_link_by_code(code):
     )
 
 
+@metrics.timer("lookup")
+def resolve_link(code):
+    """Look up a link for the redirect path through the in-process link cache.
+
+    Returns a read-only ``ResolvedLink`` (or ``None``), not an ORM object; anything that
+    modifies a link should use ``get_link_by_code`` and then call ``invalidate_link``.
+    """
+    invalidation.ensure_listening()
+    resolved = link_cache.get(code)
+    if resolved is None:
+        if not might_exist(code) or missing_cache.get(code):
+            return None
+        # A replica may not have caught up with a change made moments ago.
+        with replica(enabled=recent_writes.get(code) is None):
+            row = (
+                db.session.query(
+                    ShortenedLink.code,
+                    ShortenedLink.redirect_to,
+                    ShortenedLink.default_parameter,
+                    ShortenedLink.deleted_at,
+                    ShortenedLink.cacheable,
+                )
+                .filter(ShortenedLink.code == code)
+                .first()
+            )
+        if row is None:
+            missing_cache.set(code, True)
+            return None
+        deleted = row.deleted_at is not None
+        template = RedirectTemplate(row.redirect_to) if not deleted else None
+        resolved = ResolvedLink(
+            row.code, row.redirect_to, row.default_parameter, deleted, template, bool(row.cacheable)
+        )
+        link_cache.set(code, resolved)
+    return None if resolved.deleted else resolved
+
+
+def invalidate_link(code):
+    """Drop ``code`` from this worker's link cache and, once committed, from every other worker's."""
+    invalidate_links([code])
+
+
+def invalidate_links(codes):
+    for code in codes:
+        link_cache.invalidate(code)
+        missing_cache.invalidate(code)
+        recent_writes.set(code, True)
+    _add_to_code_filter(codes)
+    invalidation.publish("link", *codes)
+
+
+def might_exist(code):
+    """False only if ``code`` is certainly not a live link."""
+    if not CODE_FILTER_ENABLED:
+        return True
+    code_filter = _code_filter
+    if code_filter is None:
+        code_filter = _build_code_filter()
+    return code in code_filter
+
+
+def build_code_filter():
+    """Build this worker's code filter now, so no request pays for the scan; call before serving traffic."""
+    if not CODE_FILTER_ENABLED:
+        return
+    # The listener drops the filter when it connects, so it has to be connected first.
+    if not invalidation.wait_until_listening(timeout=10):
+        logger.warning("Not listening for invalidations yet; the code filter may be rebuilt on a request.")
+    started = time.monotonic()
+    code_filter = _build_code_filter()
+    logger.info("Built code filter.", codes=code_filter.count, seconds=round(time.monotonic() - started, 3))
+
+
+def _build_code_filter():
+    global _code_filter
+    # Held throughout so a notification arriving mid-build is added once the build is done.
+    with _code_filter_lock:
+        if _code_filter is None:
+            live = ShortenedLink.deleted_at == None  # noqa: E711
+            count = db.session.query(func.count(ShortenedLink.code)).filter(live).scalar()
+            code_filter = BloomFilter(max(CODE_FILTER_CAPACITY, 2 * count), CODE_FILTER_ERROR_RATE)
+            statement = select(ShortenedLink.code).where(live)
+            for code in db.session.execute(statement, execution_options=dict(stream_results=True, yield_per=10000)):
+                code_filter.add(code.code)
+            _code_filter = code_filter
+        return _code_filter
+
+
+def _add_to_code_filter(codes):
+    global _code_filter
+    # Deleted codes are never removed; they fall through to the link cache, which knows.
+    with _code_filter_lock:
+        if _code_filter is not None:
+            for code in codes:
+                _code_filter.add(code)
+            if _code_filter.count > _code_filter.capacity:
+                # Rebuild at twice the size rather than let false positives climb.
+                _code_filter = None
+
+
+def reset_code_filter():
+    global _code_filter
+    with _code_filter_lock:
+        _code_filter = None
+
+
+def code_filter_stats():
+    code_filter = _code_filter
+    return code_filter.stats() if code_filter is not None else None
+
+
+def get_click_count(code):
+    """The stored click counter for ``code`` plus this worker's not-yet-folded increments."""
+    with replica():
+        stored = db.session.query(ShortenedLink.clicks).filter(ShortenedLink.code == code).scalar()
+    return (stored or 0) + clicks.pending_count(code)
+
+
 def get_clicks_for_link(code):
     return (
         db.session.query(ShortenedLinkClick)
@@ -114,28 +417,147 @@ def get_clicks_for_link(code):
     )
 
 
+def iter_clicks(code, since=None, until=None, page_size=5000):
+    """Stream the clicks on ``code`` in (clicked_at, id) order with constant memory.
+
+    Archived months come first, read back from the cold archive (see archive.py). Pages
+    of clicks still in the database are fetched by keyset on (clicked_at, id) rather than
+    OFFSET, so each page is an index range scan on (link_id, clicked_at), and rows within a
+    page are streamed from a server-side cursor.
+    """
+    since = naive_utc(since) if since is not None else None
+    until = naive_utc(until) if until is not None else None
+    yield from archive.iter_archived_clicks(code, since=since, until=until)
+    table = ShortenedLinkClick.__table__
+    last = None
+    while True:
+        statement = select(table).where(table.c.link_id == code, table.c.clicked_at != None)  # noqa: E711
+        if since is not None:
+            statement = statement.where(table.c.clicked_at >= since)
+        if until is not None:
+            statement = statement.where(table.c.clicked_at < until)
+        if last is not None:
+            statement = statement.where(
+                or_(
+                    table.c.clicked_at > last.clicked_at,
+                    and_(table.c.clicked_at == last.clicked_at, table.c.id > last.id),
+                )
+            )
+        statement = statement.order_by(table.c.clicked_at, table.c.id).limit(page_size)
+        count = 0
+        with replica():
+            result = db.session.execute(statement, execution_options=dict(stream_results=True, yield_per=1000))
+        for row in result:
+            count += 1
+            last = row
+            yield row
+        if count < page_size:
+            return
+
+
 def id_gen():
-    digits = string.digits + string.ascii_lowercase
-    id_int = random.randint(0, (36**8) - 1)
-    id_str = ""
-    power = 7
-    while power >= 0:
-        placevalue = id_int // (36**power)
-        id_str += digits[placevalue]
-        id_int -= placevalue * (36**power)
-        power -= 1
-    return id_str
-
-
-def create_redirect(code, redirect_to, created_by, default_parameter=None):
-    if not VALID_CODE_RE.match(code):
+    return codes.allocator.allocate()
+
+
+def validate_redirect(code, redirect_to, cacheable=False):
+    if not isinstance(code, str) or not VALID_CODE_RE.match(code):
         raise LinkShortenerException("Unacceptable code", "bad_code")
-    if not validators.url(redirect_to.replace(PARAMETER_PLACEHOLDER, "foo", 1)):
+    if not isinstance(redirect_to, str) or not validators.url(redirect_to.replace(PARAMETER_PLACEHOLDER, "foo", 1)):
         raise LinkShortenerException("Bad URL", "invalid_url")
+    if not isinstance(cacheable, bool):
+        raise LinkShortenerException("cacheable must be true or false", "invalid")
+
+
+def create_redirect(code, redirect_to, created_by, default_parameter=None, cacheable=False):
+    validate_redirect(code, redirect_to, cacheable)
     try:
         link = ShortenedLink(
-            code=code, redirect_to=redirect_to, default_parameter=default_parameter, created_by=created_by
+            code=code,
+            redirect_to=redirect_to,
+            default_parameter=default_parameter,
+            created_by=created_by,
+            cacheable=cacheable,
         )
         db.session.add(link)
+        invalidate_link(code)
     except IntegrityError:
         raise LinkShortenerException("Code already in use.", "already_exists")
+
+
+def _insert_links(rows):
+    """INSERT ... ON CONFLICT DO NOTHING ``rows`` in one statement; returns the codes inserted."""
+    table = ShortenedLink.__table__
+    statement = dialect_insert(table).values(rows).on_conflict_do_nothing(index_elements=["code"])
+    if db.engine.dialect.name == "postgresql":
+        return set(db.session.execute(statement.returning(table.c.code)).scalars())
+    # sqlite (tests) can't RETURNING here; the transaction makes a prior lookup equivalent.
+    existing = set(
+        db.session.execute(select(table.c.code).where(table.c.code.in_([row["code"] for row in rows]))).scalars()
+    )
+    db.session.execute(statement)
+    return {row["code"] for row in rows} - existing
+
+
+def bulk_create_redirects(items, batch_size=1000, generate_attempts=3):
+    """Validate and insert many links in the current transaction.
+
+    ``items`` are dicts shaped like the ``POST /`` body. Returns one result dict per item,
+    in order, with the (possibly generated) code and a ``result`` of ``created`` or the
+    same failure results ``create_redirect`` uses.
+    """
+    results = [None] * len(items)
+    pending = []
+    seen = set()
+    for index, item in enumerate(items):
+        code = None
+        try:
+            if not isinstance(item, dict):
+                raise LinkShortenerException("Expected an object", "invalid")
+            code = item.get("code") or ""
+            code = code.lower() if isinstance(code, str) else code
+            generated = not code
+            while generated and (not code or code in seen):
+                code = id_gen()
+            validate_redirect(code, item["redirect_to"], item.get("cacheable", False))
+            if code in seen and not generated:
+                raise LinkShortenerException("Code already in use.", "already_exists")
+            row = dict(
+                code=code,
+                redirect_to=item["redirect_to"],
+                default_parameter=item.get("default_parameter"),
+                created_by=item["created_by"],
+                cacheable=item.get("cacheable", False),
+            )
+        except LinkShortenerException as e:
+            results[index] = dict(code=code, result=e.result, error=e.msg)
+            continue
+        except KeyError as e:
+            results[index] = dict(code=code, result="missing_arg", error=str(e))
+            continue
+        seen.add(code)
+        pending.append((index, row, generated))
+
+    created = []
+    for attempt in range(1, generate_attempts + 1):
+        inserted = set()
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            # A regenerated code may repeat within a batch; the first item keeps it.
+            rows = {}
+            for _, row, _ in batch:
+                rows.setdefault(row["code"], row)
+            inserted |= _insert_links(list(rows.values()))
+        retry = []
+        for index, row, generated in pending:
+            if row["code"] in inserted:
+                inserted.discard(row["code"])
+                created.append(row["code"])
+                results[index] = dict(code=row["code"], result="created")
+            elif generated and attempt < generate_attempts:
+                row["code"] = id_gen()
+                retry.append((index, row, generated))
+            else:
+                results[index] = dict(code=row["code"], result="already_exists", error="Code already in use.")
+        pending = retry
+    invalidate_links(created)
+    return results
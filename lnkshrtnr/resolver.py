@@ -0,0 +1,157 @@
+"""A standalone, read-only redirect server.
+
+``gunicorn 'lnkshrtnr.resolver:create_application()'`` serves ``GET /<code>`` and
+``GET /<code>/<parameter>`` from the link snapshot in ``LINK_SNAPSHOT_DIR`` (see
+snapshot.py) without a database connection, for edge locations or to keep redirects up
+while Postgres is down. It checks for a newer export every ``SNAPSHOT_RELOAD_INTERVAL``
+seconds (5). Clicks on tracked links go to the click spool in ``CLICK_SPOOL_DIR`` (see
+spool.py) for the main app to ingest; without one they are not recorded. Redirects
+behave like the main app's, including the clicker cookie and cacheable links; everything
+else (QR codes, writes, stats) is a 404 and belongs on the main app.
+"""
+import datetime
+import os
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+import woodchipper
+
+from . import events, purge
+from .cache import LRUCache
+from .clicks import Click
+from .repository import RedirectTemplate, client_ip
+from .snapshot import LinkSnapshot, snapshot_files
+from .spool import ClickSpool
+
+logger = woodchipper.get_logger(__name__)
+
+STATUS_LINES = {status: f"{status} {HTTPStatus(status).phrase}" for status in purge.REDIRECT_STATUSES}
+
+
+class Resolver:
+    def __init__(self, snapshot_dir, spool_dir=None, reload_interval=5.0):
+        self.snapshot_dir = snapshot_dir
+        self.spool = ClickSpool(spool_dir) if spool_dir else None
+        self.reload_interval = reload_interval
+        # The snapshot and the templates compiled from it, swapped together on reload.
+        self._state = (None, None)
+        self._files = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Map the newest snapshot in the directory if it changed; returns whether it did."""
+        files = snapshot_files(self.snapshot_dir)
+        if files == self._files:
+            return False
+        snapshot = LinkSnapshot(*files) if files is not None else None
+        # The old mapping is left to the garbage collector, as requests may still be using it.
+        self._state = (snapshot, LRUCache(maxsize=int(os.getenv("LINK_CACHE_SIZE", "10000"))))
+        self._files = files
+        logger.info("Loaded link snapshot.", files=snapshot.paths if snapshot is not None else None)
+        return True
+
+    def _maybe_reload(self):
+        if time.monotonic() < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            self.reload()
+        except Exception:
+            logger.exception("Failed to reload link snapshot.", directory=self.snapshot_dir)
+        finally:
+            self._lock.release()
+
+    def resolve(self, code):
+        """``(LinkRecord, RedirectTemplate)`` for a live link, or ``None``."""
+        snapshot, templates = self._state
+        cached = templates.get(code) if templates is not None else None
+        if cached is None:
+            record = snapshot.get(code) if snapshot is not None else None
+            if record is None:
+                return None
+            cached = (record, RedirectTemplate(record.redirect_to))
+            templates.set(code, cached)
+        return cached
+
+    def __call__(self, environ, start_response):
+        self._maybe_reload()
+        if environ["REQUEST_METHOD"] not in {"GET", "HEAD"}:
+            return _respond(start_response, "405 Method Not Allowed", [("Allow", "GET, HEAD")])
+        path = environ.get("PATH_INFO", "").encode("latin-1").decode("utf8", "replace")
+        parts = path.strip("/").split("/") if path.strip("/") else []
+        args = {}
+        for key, value in parse_qsl(environ.get("QUERY_STRING", ""), keep_blank_values=True):
+            args.setdefault(key, value)
+        if not 1 <= len(parts) <= 2 or "qr" in args:
+            return _respond(start_response, "404 Not Found")
+        code = parts[0].lower()
+        parameter = parts[1] if len(parts) == 2 else None
+        resolved = self.resolve(code)
+        if resolved is None:
+            logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, result="not_found")
+            return _respond(start_response, "404 Not Found")
+        record, template = resolved
+        if parameter is None and template.parameterized:
+            parameter = record.default_parameter
+        if (parameter is not None) != template.parameterized:
+            logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, result="not_found")
+            return _respond(start_response, "404 Not Found")
+        utm_tags = {key[4:]: value for key, value in args.items() if key.startswith("utm_")}
+        headers = [("Location", template.url(parameter, utm_tags))]
+        if record.cacheable:
+            status = STATUS_LINES[purge.CACHEABLE_REDIRECT_STATUS]
+            headers.append(("Cache-Control", f"public, max-age={purge.CACHEABLE_MAX_AGE}"))
+            headers.append(("Surrogate-Key", purge.surrogate_key(code)))
+        else:
+            status = STATUS_LINES[302]
+            clicker = self._record_click(environ, code, args)
+            headers.append(("Set-Cookie", f"clicker={clicker}; Path=/"))
+            headers.append(("Cache-Control", "no-store, private"))
+        logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, utm_tags=utm_tags, result="success")
+        return _respond(start_response, status, headers)
+
+    def _record_click(self, environ, code, args):
+        cookie = SimpleCookie(environ.get("HTTP_COOKIE", ""))
+        try:
+            clicker = uuid.UUID(cookie["clicker"].value)
+        except (KeyError, ValueError):
+            clicker = uuid.uuid4()
+        if self.spool is not None:
+            self.spool.append(
+                Click(
+                    link_id=code,
+                    clicker=clicker,
+                    clicked_at=datetime.datetime.now(datetime.timezone.utc),
+                    client_ip=client_ip(environ.get("HTTP_X_FORWARDED_FOR"), environ.get("REMOTE_ADDR")) or "",
+                    referer=environ.get("HTTP_REFERER", ""),
+                    user_agent=environ.get("HTTP_USER_AGENT", ""),
+                    source=args.get("utm_source"),
+                    medium=args.get("utm_medium"),
+                    campaign=args.get("utm_campaign"),
+                    term=args.get("utm_term"),
+                    content=args.get("utm_content"),
+                )
+            )
+        return clicker
+
+
+def _respond(start_response, status, headers=()):
+    start_response(status, [*headers, ("Content-Length", "0")])
+    return [b""]
+
+
+def create_application():
+    snapshot_dir = os.getenv("LINK_SNAPSHOT_DIR")
+    if not snapshot_dir:
+        raise RuntimeError("LINK_SNAPSHOT_DIR is not set")
+    return Resolver(
+        snapshot_dir,
+        spool_dir=os.getenv("CLICK_SPOOL_DIR"),
+        reload_interval=float(os.getenv("SNAPSHOT_RELOAD_INTERVAL", "5")),
+    )
@@ -1,50 +1,115 @@
+import csv
 import datetime
+import io
+import json
 import os
 
 import validators.url
 import woodchipper
-from flask import abort, redirect, request, send_file
+from flask import abort, g, redirect, request, send_file, stream_with_context
 from sqlalchemy.exc import IntegrityError
 
-from . import events, exceptions, repository
+from . import (
+    agents,
+    clicks,
+    codes,
+    enrichment,
+    events,
+    exceptions,
+    hot,
+    metrics,
+    purge,
+    qrbatch,
+    ratelimit,
+    repository,
+    rollups,
+    visitors,
+)
 from .app import app
-from .auth import write_requires_psk
+from .auth import requires_psk, write_requires_psk
 from .database import db
 
 logger = woodchipper.get_logger(__name__)
 
+EXPORT_COLUMNS = [
+    "id",
+    "link_id",
+    "clicker",
+    "clicked_at",
+    "client_ip",
+    "referer",
+    "user_agent",
+    "source",
+    "medium",
+    "campaign",
+    "term",
+    "content",
+]
+
+
+def commit():
+    with metrics.timer("commit"):
+        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+
+
+def redirect_response(link, parameter, utm_tags):
+    """Redirect to ``link``, recording a click unless it is cacheable or the client is over its rate limit."""
+    hot.record(link.code)
+    location = link.template.url(parameter, utm_tags)
+    if link.cacheable:
+        response = redirect(location, code=purge.CACHEABLE_REDIRECT_STATUS)
+        response.headers["Cache-Control"] = f"public, max-age={purge.CACHEABLE_MAX_AGE}"
+        response.headers["Surrogate-Key"] = purge.surrogate_key(link.code)
+        return response
+    response = redirect(location)
+    if not g.get("skip_click"):
+        clicker = repository.record_click(link)
+        commit()
+        if clicker is not None:
+            response.set_cookie("clicker", str(clicker))
+    response.headers["Cache-Control"] = "no-store, private"
+    return response
+
+
+def not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
 
 @app.route("/<code>", methods=["GET", "PUT", "DELETE"], strict_slashes=False)
+@ratelimit.rate_limited
 @write_requires_psk
 def simple_redirect(code):
     code = code.lower()
     if request.method == "GET":
-        link = repository.get_link_by_code(code)
+        link = repository.resolve_link(code)
         if link is None:
             logger.info(events.REDIRECT_EVENT, code=code, parameter=None, result="not_found")
             abort(404)
-        if repository.PARAMETER_PLACEHOLDER in link.redirect_to:
-            if link.default_parameter is not None:
-                redirect_to = link.redirect_to.replace(repository.PARAMETER_PLACEHOLDER, link.default_parameter, 1)
-            else:
+        parameter = None
+        if link.template.parameterized:
+            if link.default_parameter is None:
                 logger.info(events.REDIRECT_EVENT, code=code, parameter=None, result="not_found")
                 abort(404)
-        else:
-            redirect_to = link.redirect_to
+            parameter = link.default_parameter
         utm_tags = {tag[4:]: request.args[tag] for tag in request.args if tag.startswith("utm_")}
-        logger.info("utm_tags", utm_tags=utm_tags, merged=repository.merge_utm_tags(redirect_to, utm_tags))
         if format := request.args.get("qr"):
             if format not in ["svg", "png", "eps"]:
                 logger.warning(events.INVALID_QR_FORMAT, format=format)
                 abort(400)
+            hot.record_qr(format, code, utm_tags=utm_tags)
+            etag = repository.qrcode_etag(format, code, **utm_tags)
+            # Only once the link is known to exist, so deleted links 404 like everything else.
+            if etag in request.if_none_match:
+                metrics.QR_REQUESTS.labels("not_modified").inc()
+                return not_modified(etag)
             content_type, buffer = repository.qrcode_for_link(format, code, **utm_tags)
-            return send_file(buffer, as_attachment=True, download_name=f"{code}.{format}", mimetype=content_type)
-        clicker = repository.record_click(link)
-        db.session.flush() if os.getenv("TESTING") else db.session.commit()
-        logger.info(events.REDIRECT_EVENT, code=code, parameter=None, result="success")
-        response = redirect(repository.merge_utm_tags(redirect_to, utm_tags))
-        response.set_cookie("clicker", str(clicker))
-        response.headers["Cache-Control"] = "no-store, private"
+            return send_file(
+                buffer, as_attachment=True, download_name=f"{code}.{format}", mimetype=content_type, etag=etag
+            )
+        response = redirect_response(link, parameter, utm_tags)
+        logger.info(events.REDIRECT_EVENT, code=code, parameter=None, utm_tags=utm_tags, result="success")
         return response
 
     elif request.method == "PUT":
@@ -56,11 +121,18 @@ def simple_redirect(code):
         if link is None:
             logger.info(events.UPDATE_EVENT, code=code, redirect_to=redirect_to, result="not_found")
             abort(404)
+        if not isinstance(request.json.get("cacheable", False), bool):
+            logger.info(events.UPDATE_EVENT, code=code, redirect_to=redirect_to, result="invalid")
+            return "cacheable must be true or false", 400
         link.redirect_to = redirect_to
         if "default_parameter" in request.json:
-            link.default_parameter = request.form["default_parameter"]
+            link.default_parameter = request.json["default_parameter"]
+        if "cacheable" in request.json:
+            link.cacheable = request.json["cacheable"]
         db.session.add(link)
-        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        repository.invalidate_link(code)
+        commit()
+        purge.purge_link(code)
         logger.info(events.UPDATE_EVENT, code=code, redirect_to=redirect_to, result="success")
         return "", 204
     elif request.method == "DELETE":
@@ -70,45 +142,49 @@ def simple_redirect(code):
             abort(404)
         link.deleted_at = datetime.datetime.now(datetime.timezone.utc)
         db.session.add(link)
-        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        repository.invalidate_link(code)
+        commit()
+        purge.purge_link(code)
         logger.info(events.DELETE_EVENT, code=code, result="success")
         return "", 204
 
 
 @app.route("/<code>/<parameter>", strict_slashes=False)
+@ratelimit.rate_limited
 def redirect_with_parameter(code, parameter):
     code = code.lower()
-    link = repository.get_link_by_code(code)
+    link = repository.resolve_link(code)
     if link is None:
         logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, result="not_found")
         abort(404)
-    if repository.PARAMETER_PLACEHOLDER not in link.redirect_to:
+    if not link.template.parameterized:
         logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, result="not_found")
         abort(404)
-    else:
-        redirect_to = link.redirect_to.replace(repository.PARAMETER_PLACEHOLDER, parameter, 1)
     utm_tags = {tag[4:]: request.args[tag] for tag in request.args if tag.startswith("utm_")}
     if format := request.args.get("qr"):
         if format not in ["svg", "png", "eps"]:
             logger.warning(events.INVALID_QR_FORMAT, format=format)
             abort(400)
+        hot.record_qr(format, code, parameter, utm_tags)
+        etag = repository.qrcode_etag(format, code, parameter, **utm_tags)
+        if etag in request.if_none_match:
+            metrics.QR_REQUESTS.labels("not_modified").inc()
+            return not_modified(etag)
         content_type, buffer = repository.qrcode_for_link(format, code, parameter, **utm_tags)
         return send_file(
             buffer,
             as_attachment=True,
             download_name=f"{code}-{parameter}.{format}",
             mimetype=content_type,
+            etag=etag,
         )
-    clicker = repository.record_click(link)
-    db.session.flush() if os.getenv("TESTING") else db.session.commit()
-    logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, result="success")
-    response = redirect(repository.merge_utm_tags(redirect_to, utm_tags))
-    response.set_cookie("clicker", str(clicker))
-    response.headers["Cache-Control"] = "no-store, private"
+    response = redirect_response(link, parameter, utm_tags)
+    logger.info(events.REDIRECT_EVENT, code=code, parameter=parameter, utm_tags=utm_tags, result="success")
     return response
 
 
 @app.route("/", methods=["POST"])
+@ratelimit.rate_limited
 @write_requires_psk
 def create_redirect():
     try:
@@ -118,8 +194,11 @@ def create_redirect():
         redirect_to = request.json["redirect_to"]
         default_parameter = request.json.get("default_parameter")
         created_by = request.json["created_by"]
-        repository.create_redirect(code, redirect_to, created_by, default_parameter=default_parameter)
-        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        cacheable = request.json.get("cacheable", False)
+        repository.create_redirect(
+            code, redirect_to, created_by, default_parameter=default_parameter, cacheable=cacheable
+        )
+        commit()
         logger.info(events.CREATE_EVENT, code=code, redirect_to=redirect_to, result="success")
         return code, 201
     except exceptions.LinkShortenerException as e:
@@ -131,3 +210,196 @@ def create_redirect():
     except IntegrityError:
         logger.info(events.CREATE_EVENT, code=code, redirect_to=redirect_to, result="duplicate")
         return "Code already in use.", 400
+
+
+STATS_SOURCES = dict(
+    link_cache=repository.link_cache.stats,
+    missing_cache=repository.missing_cache.stats,
+    code_filter=repository.code_filter_stats,
+    user_agent_cache=agents.stats,
+    click_writer=clicks.stats,
+    click_dedup=clicks.dedup_stats,
+    code_allocator=codes.allocator.stats,
+    qr_cache=repository.qr_cache.stats,
+    hot_links=hot.stats,
+    rate_limits=ratelimit.stats,
+    qr_disk_cache=lambda: repository.qr_disk_cache.stats() if repository.qr_disk_cache is not None else None,
+)
+for name, stats in STATS_SOURCES.items():
+    metrics.register_stats(name, stats)
+
+
+@app.route("/_internal/stats")
+@requires_psk
+def internal_stats():
+    return {name: stats() for name, stats in STATS_SOURCES.items()}
+
+
+@app.route("/_metrics")
+@requires_psk
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    return app.response_class(body, content_type=content_type)
+
+
+@app.route("/_hot")
+@requires_psk
+def hot_links():
+    kind = request.args.get("kind", hot.LINK)
+    if kind not in {hot.LINK, hot.QR}:
+        return "Invalid kind", 400
+    try:
+        limit = min(int(request.args.get("limit", "50")), 1000)
+    except ValueError:
+        return "Invalid limit", 400
+    return dict(kind=kind, window=float(os.getenv("HOT_WINDOW", "60")), hot=hot.top(kind, limit))
+
+
+@app.route("/_stats/<code>")
+@requires_psk
+def link_stats(code):
+    code = code.lower()
+    granularity = request.args.get("granularity", "day")
+    group_by = [dimension for dimension in request.args.get("group_by", "").split(",") if dimension]
+    if granularity not in rollups.GRANULARITIES or not set(group_by) <= set(rollups.DIMENSIONS):
+        return "Invalid granularity or group_by", 400
+    try:
+        since = datetime.datetime.fromisoformat(request.args["since"]) if "since" in request.args else None
+        until = datetime.datetime.fromisoformat(request.args["until"]) if "until" in request.args else None
+    except ValueError:
+        return "Invalid since or until", 400
+    if repository.resolve_link(code) is None:
+        abort(404)
+    series = rollups.query(
+        code,
+        granularity=granularity,
+        since=since,
+        until=until,
+        group_by=group_by,
+        include_bots=request.args.get("include_bots") in {"1", "true"},
+    )
+    return dict(code=code, granularity=granularity, total=sum(row["clicks"] for row in series), series=series)
+
+
+@app.route("/_stats/<code>/visitors")
+@requires_psk
+def link_visitors(code):
+    code = code.lower()
+    try:
+        since = datetime.datetime.fromisoformat(request.args["since"]) if "since" in request.args else None
+        until = datetime.datetime.fromisoformat(request.args["until"]) if "until" in request.args else None
+    except ValueError:
+        return "Invalid since or until", 400
+    if repository.resolve_link(code) is None:
+        abort(404)
+    return dict(code=code, **visitors.query(code, since=since, until=until))
+
+
+@app.route("/_stats/<code>/breakdown")
+@requires_psk
+def link_breakdown(code):
+    code = code.lower()
+    by = request.args.get("by", "browser")
+    if by not in enrichment.DIMENSIONS:
+        return "Invalid breakdown", 400
+    try:
+        since = datetime.datetime.fromisoformat(request.args["since"]) if "since" in request.args else None
+        until = datetime.datetime.fromisoformat(request.args["until"]) if "until" in request.args else None
+    except ValueError:
+        return "Invalid since or until", 400
+    if repository.resolve_link(code) is None:
+        abort(404)
+    return dict(code=code, by=by, **enrichment.breakdown(code, by, since=since, until=until))
+
+
+def _export_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return None if value is None else str(value)
+
+
+@app.route("/_export/<code>")
+@requires_psk
+def export_clicks(code):
+    code = code.lower()
+    format = request.args.get("format", "ndjson")
+    if format not in {"ndjson", "csv"}:
+        return "Invalid format", 400
+    try:
+        since = datetime.datetime.fromisoformat(request.args["since"]) if "since" in request.args else None
+        until = datetime.datetime.fromisoformat(request.args["until"]) if "until" in request.args else None
+    except ValueError:
+        return "Invalid since or until", 400
+    page_size = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))
+    rows = repository.iter_clicks(code, since=since, until=until, page_size=page_size)
+
+    def generate_ndjson():
+        for row in rows:
+            yield json.dumps({column: _export_value(row._mapping[column]) for column in EXPORT_COLUMNS}) + "\n"
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for count, row in enumerate(rows, 1):
+            writer.writerow([_export_value(row._mapping[column]) for column in EXPORT_COLUMNS])
+            if count % 1000 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    logger.info(events.EXPORT_EVENT, code=code, format=format, since=since, until=until)
+    generate = generate_ndjson if format == "ndjson" else generate_csv
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson" if format == "ndjson" else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={code}-clicks.{format}"},
+    )
+
+
+@app.route("/_bulk", methods=["POST"])
+@ratelimit.rate_limited
+@write_requires_psk
+def bulk_create_redirects():
+    try:
+        if request.mimetype == "application/x-ndjson":
+            items = [json.loads(line) for line in request.stream if line.strip()]
+        else:
+            items = json.loads(request.get_data())
+    except ValueError:
+        return "Invalid JSON", 400
+    if not isinstance(items, list):
+        return "Expected a list of links", 400
+    if len(items) > int(os.getenv("BULK_MAX_LINKS", "10000")):
+        return "Too many links", 413
+    results = repository.bulk_create_redirects(items)
+    commit()
+    created = sum(1 for result in results if result["result"] == "created")
+    logger.info(events.BULK_CREATE_EVENT, links=len(items), created=created)
+    return dict(created=created, failed=len(items) - created, results=results), 200
+
+
+@app.route("/_qr/batch", methods=["POST"])
+@ratelimit.rate_limited
+@requires_psk
+def batch_qrcodes():
+    try:
+        items = json.loads(request.get_data())
+    except ValueError:
+        return "Invalid JSON", 400
+    if not isinstance(items, list):
+        return "Expected a list of QR codes", 400
+    if len(items) > qrbatch.MAX_ENTRIES:
+        return "Too many QR codes", 413
+    jobs, errors = qrbatch.prepare(items)
+    # The response streams until the last code is rendered; don't hold a connection idle in a
+    # transaction meanwhile (tests keep theirs open to roll back).
+    if not os.getenv("TESTING"):
+        db.session.close()
+    logger.info(events.QR_BATCH_EVENT, entries=len(items), errors=len(errors))
+    return app.response_class(
+        stream_with_context(qrbatch.stream_zip(jobs, errors)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=qrcodes.zip"},
+    )
@@ -1,47 +1,140 @@
+"""The /shortenlink Slack command (see ``USAGE``).
+
+Slack gives up on a command that isn't acknowledged within 3 seconds, so the listener
+only acks; the database work runs afterwards as a lazy listener on a pool of
+``SLACK_WORKERS`` threads (4) and answers through ``respond``. Commands beyond that wait
+their turn instead of tying up more of the web worker. Stats come from the link counter,
+the daily rollups and the visitor sketches, never from raw clicks, and are cached for
+``SLACK_STATS_TTL`` seconds (60).
+"""
+import datetime
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import woodchipper
-from flask import current_app
 from slack_bolt import App
 
-from . import repository
+from . import repository, rollups, visitors
+from .app import app as flask_app
+from .cache import LRUCache
 from .database import db
 
-app = App(signing_secret=os.getenv("SLACK_SIGNING_SECRET"), token=os.getenv("SLACK_BOT_TOKEN"))
+app = App(
+    signing_secret=os.getenv("SLACK_SIGNING_SECRET"),
+    token=os.getenv("SLACK_BOT_TOKEN"),
+    # Ack in the request thread; only the lazy listeners go to the pool.
+    process_before_response=True,
+    listener_executor=ThreadPoolExecutor(
+        max_workers=int(os.getenv("SLACK_WORKERS", "4")), thread_name_prefix="lnkshrtnr-slack"
+    ),
+)
 logger = woodchipper.get_logger(__name__)
 
+USAGE = """\
+/shortenlink <code> <url> [default parameter]: create a link
+/shortenlink bulk, then one `<code> <url> [default parameter]` per line: create many links ("-" generates a code)
+/shortenlink stats <code> [days]: clicks and visitors over the last 7 days, or [days]"""
+STATS_DAYS = 7
+MAX_STATS_DAYS = 90
+stats_cache = LRUCache(maxsize=1000, ttl=float(os.getenv("SLACK_STATS_TTL", "60")))
+
+
+def link_url(code):
+    return f"https://{os.getenv('HOSTNAME')}/{code}"
 
-def bind_flask_app(context, next):
-    context["flask_app"] = current_app._get_current_object()
-    next()
 
+def commit():
+    db.session.flush() if os.getenv("TESTING") else db.session.commit()
 
-@app.command("/shortenlink", middleware=[bind_flask_app])
-def shorten_link_command(ack, respond, context, command):
-    # Acknowledge command request
+
+def acknowledge(ack):
     ack()
-    context["flask_app"].app_context().push()
-    logger.info("Slack /shortenlink command received.", **command)
 
-    try:
-        # Extract arguments from command
-        code = command["text"].split()[0]
-        redirect_to = command["text"].split()[1]
-        default_parameter = None
-        if len(command["text"].split()) > 2:
-            default_parameter = command["text"].split()[2]
 
-        # Extract requesting user's Slack username
-        username = command["user_name"]
+def shorten_link_command(respond, command):
+    with flask_app.app_context():
+        logger.info("Slack /shortenlink command received.", **command)
+        args = command["text"].split()
+        if args and args[0] == "bulk" and (len(args) < 2 or "://" not in args[1]):
+            bulk_command(respond, command)
+        elif args and args[0] == "stats" and (len(args) < 2 or "://" not in args[1]):
+            stats_command(respond, args[1:])
+        elif len(args) >= 2:
+            create_command(respond, command["user_name"], *args[:3])
+        else:
+            respond(USAGE)
 
-        # Run create_redirect function
-        repository.create_redirect(code, redirect_to, username, default_parameter)
-        db.session.commit()
 
-        # Send message indicating success
+def create_command(respond, username, code, redirect_to, default_parameter=None):
+    try:
+        repository.create_redirect(code, redirect_to, username, default_parameter)
+        commit()
         logger.info("Successfully created redirect.", code=code, redirect_to=redirect_to)
-        respond(f"Successfully created redirect: <https://{os.getenv('HOSTNAME')}/{code}>")
+        respond(f"Successfully created redirect: <{link_url(code)}>")
     except Exception as e:
-        # Catch error and send message indicating error and details
+        db.session.rollback()
         logger.exception("Error creating redirect.", code=code, redirect_to=redirect_to)
         respond(f"Error: {type(e).__name__}\n{e}")
+
+
+def bulk_command(respond, command):
+    items = []
+    for line in command["text"].strip()[len("bulk") :].splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        item = dict(code="" if fields[0] == "-" else fields[0], created_by=command["user_name"])
+        if len(fields) > 1:
+            item["redirect_to"] = fields[1]
+        if len(fields) > 2:
+            item["default_parameter"] = fields[2]
+        items.append(item)
+    if not items:
+        respond(USAGE)
+        return
+    if len(items) > int(os.getenv("BULK_MAX_LINKS", "10000")):
+        respond("Too many links.")
+        return
+    try:
+        results = repository.bulk_create_redirects(items)
+        commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Error creating redirects.", links=len(items))
+        respond(f"Error: {type(e).__name__}\n{e}")
+        return
+    created = sum(1 for result in results if result["result"] == "created")
+    logger.info("Successfully created redirects.", links=len(items), created=created)
+    lines = [
+        f"<{link_url(result['code'])}>" if result["result"] == "created" else f"{result['code']}: {result['error']}"
+        for result in results
+    ]
+    respond(f"Created {created} of {len(items)} links:\n" + "\n".join(lines))
+
+
+def stats_command(respond, args):
+    if not args or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        respond(USAGE)
+        return
+    code = args[0].lower()
+    days = min(max(int(args[1]), 1), MAX_STATS_DAYS) if len(args) == 2 else STATS_DAYS
+    message = stats_cache.get((code, days))
+    if message is None:
+        if repository.resolve_link(code) is None:
+            respond(f"No link with code {code}.")
+            return
+        since = rollups.day_bucket(datetime.datetime.utcnow()) - datetime.timedelta(days=days - 1)
+        series = rollups.query(code, granularity="day", since=since)
+        unique = visitors.query(code, since=since)
+        lines = [
+            f"<{link_url(code)}>: {repository.get_click_count(code):,} clicks in total.",
+            f"Last {days} days: {sum(row['clicks'] for row in series):,} clicks from about"
+            f" {unique['visitors']:,} visitors (±{unique['standard_error']:.1%}).",
+        ]
+        lines.extend(f"{row['bucket'][:10]}: {row['clicks']:,}" for row in series)
+        message = "\n".join(lines)
+        stats_cache.set((code, days), message)
+    respond(message)
+
+
+app.command("/shortenlink")(ack=acknowledge, lazy=[shorten_link_command])
@@ -0,0 +1,286 @@
+"""Memory-mappable snapshots of the link table.
+
+``flask export-link-snapshot`` writes the live links into ``LINK_SNAPSHOT_DIR`` so the
+standalone resolver (see resolver.py) can serve redirects without a database. The first
+export, and every export once ``SNAPSHOT_MAX_DELTAS`` deltas have piled up (or with
+``--full``), writes a base file, ``links-<generation>.snap``. Later exports only look at
+links created, updated or deleted since the previous export and write the ones that
+actually changed to a delta, ``links-<generation>.<sequence>.snap``; a deleted link is a
+tombstone. Lookups try the deltas newest first, then the base. A new base removes the
+older generation's files; readers that still have them mapped keep working until they
+reload.
+
+Every file has the same layout: a fixed header, an index of record offsets sorted by
+code, then the records::
+
+    header  magic, version, generation, sequence, count, exported_at (microseconds)
+    index   count x uint32 offset into the records
+    record  flags, code length, redirect_to length, default_parameter length, then the
+            three UTF-8 strings
+
+so a lookup is a binary search over the mapped file with no parsing up front, and the
+file is shared between every process that maps it.
+"""
+import datetime
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+
+import woodchipper
+from sqlalchemy import func, or_, select
+
+from .database import db
+from .models import ShortenedLink
+
+logger = woodchipper.get_logger(__name__)
+
+MAGIC = b"LNKSNAP\x00"
+VERSION = 1
+HEADER = struct.Struct(">8sHQIIQ")
+OFFSET = struct.Struct(">I")
+RECORD = struct.Struct(">BHII")
+CACHEABLE = 0x01
+HAS_DEFAULT = 0x02
+DELETED = 0x04
+FILE_RE = re.compile(r"^links-(\d+)(?:\.(\d+))?\.snap$")
+EPOCH = datetime.datetime(1970, 1, 1)
+
+LinkRecord = namedtuple("LinkRecord", ["code", "redirect_to", "default_parameter", "cacheable", "deleted"])
+
+
+def _microseconds(timestamp):
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def write_snapshot(path, records, generation, sequence, exported_at):
+    """Write ``records`` (``LinkRecord``s, any order) to ``path`` atomically; returns the count."""
+    directory = os.path.dirname(path) or "."
+    index = []
+    with tempfile.TemporaryFile(dir=directory) as data:
+        offset = 0
+        for record in records:
+            code = record.code.encode("utf8")
+            redirect_to = record.redirect_to.encode("utf8")
+            default = (record.default_parameter or "").encode("utf8")
+            flags = (
+                (CACHEABLE if record.cacheable else 0)
+                | (HAS_DEFAULT if record.default_parameter is not None else 0)
+                | (DELETED if record.deleted else 0)
+            )
+            data.write(RECORD.pack(flags, len(code), len(redirect_to), len(default)))
+            data.write(code + redirect_to + default)
+            index.append((code, offset))
+            offset += RECORD.size + len(code) + len(redirect_to) + len(default)
+            if offset > 0xFFFFFFFF:
+                raise ValueError("Link snapshot records exceed 4GB")
+        index.sort()
+        data.seek(0)
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, generation, sequence, len(index), _microseconds(exported_at)))
+                f.write(b"".join(OFFSET.pack(record_offset) for _, record_offset in index))
+                shutil.copyfileobj(data, f)
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+    return len(index)
+
+
+class SnapshotFile:
+    """One mapped snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.generation, self.sequence, self.count, exported_at = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} link snapshot")
+        self.exported_at = EPOCH + datetime.timedelta(microseconds=exported_at)
+        self._records = HEADER.size + self.count * OFFSET.size
+
+    def _code_at(self, position):
+        (offset,) = OFFSET.unpack_from(self._map, HEADER.size + position * OFFSET.size)
+        start = self._records + offset
+        code_length = RECORD.unpack_from(self._map, start)[1]
+        return self._map[start + RECORD.size : start + RECORD.size + code_length], start
+
+    def _record_at(self, start):
+        flags, code_length, redirect_length, default_length = RECORD.unpack_from(self._map, start)
+        start += RECORD.size
+        code = self._map[start : start + code_length].decode("utf8")
+        start += code_length
+        redirect_to = self._map[start : start + redirect_length].decode("utf8")
+        start += redirect_length
+        default = self._map[start : start + default_length].decode("utf8") if flags & HAS_DEFAULT else None
+        return LinkRecord(code, redirect_to, default, bool(flags & CACHEABLE), bool(flags & DELETED))
+
+    def lookup(self, code):
+        """The record for ``code``, tombstones included, or ``None``."""
+        key = code.encode("utf8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found, start = self._code_at(middle)
+            if found == key:
+                return self._record_at(start)
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._record_at(self._code_at(position)[1])
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+
+def snapshot_files(directory):
+    """``(base, [deltas])`` paths of the newest generation in ``directory``, or ``None``."""
+    bases, deltas = {}, {}
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        match = FILE_RE.match(name)
+        if match is None:
+            continue
+        generation = int(match.group(1))
+        if match.group(2) is None:
+            bases[generation] = os.path.join(directory, name)
+        else:
+            deltas.setdefault(generation, {})[int(match.group(2))] = os.path.join(directory, name)
+    if not bases:
+        return None
+    generation = max(bases)
+    chain = []
+    for sequence in range(1, len(deltas.get(generation, {})) + 1):
+        if sequence not in deltas[generation]:
+            break
+        chain.append(deltas[generation][sequence])
+    return bases[generation], chain
+
+
+class LinkSnapshot:
+    """A base snapshot and its deltas, looked up newest first."""
+
+    def __init__(self, base, deltas=()):
+        self.base = SnapshotFile(base)
+        self.deltas = [SnapshotFile(path) for path in deltas]
+        self.paths = [base, *deltas]
+
+    @classmethod
+    def open(cls, directory):
+        """The current snapshot in ``directory``, or ``None`` if nothing was exported there yet."""
+        files = snapshot_files(directory)
+        return cls(*files) if files is not None else None
+
+    @property
+    def generation(self):
+        return self.base.generation
+
+    @property
+    def exported_at(self):
+        return (self.deltas[-1] if self.deltas else self.base).exported_at
+
+    def lookup(self, code):
+        for snapshot in reversed(self.deltas):
+            record = snapshot.lookup(code)
+            if record is not None:
+                return record
+        return self.base.lookup(code)
+
+    def get(self, code):
+        """The live link for ``code``, or ``None``."""
+        record = self.lookup(code)
+        return None if record is None or record.deleted else record
+
+    def close(self):
+        for snapshot in [self.base, *self.deltas]:
+            snapshot.close()
+
+
+def _database_now():
+    now = db.session.query(func.now()).scalar()
+    return datetime.datetime.fromisoformat(now) if isinstance(now, str) else now.replace(tzinfo=None)
+
+
+def _record(row):
+    return LinkRecord(
+        row.code, row.redirect_to, row.default_parameter, bool(row.cacheable), row.deleted_at is not None
+    )
+
+
+def _link_rows(*criteria):
+    link_table = ShortenedLink.__table__
+    statement = select(
+        link_table.c.code,
+        link_table.c.redirect_to,
+        link_table.c.default_parameter,
+        link_table.c.cacheable,
+        link_table.c.deleted_at,
+    ).where(*criteria)
+    return db.session.execute(statement, execution_options=dict(stream_results=True, yield_per=5000))
+
+
+def export_links(directory, full=False, max_deltas=None, overlap=None):
+    """Export the link table to ``directory``; returns ``(path, records)``, or ``(None, 0)`` if nothing changed.
+
+    Changes are picked up from the link timestamps, looking back ``overlap`` seconds
+    (``SNAPSHOT_DELTA_OVERLAP``, 60) past the previous export so links committed by
+    transactions that were still open then are not missed.
+    """
+    max_deltas = max_deltas if max_deltas is not None else int(os.getenv("SNAPSHOT_MAX_DELTAS", "24"))
+    overlap = overlap if overlap is not None else float(os.getenv("SNAPSHOT_DELTA_OVERLAP", "60"))
+    os.makedirs(directory, exist_ok=True)
+    exported_at = _database_now()
+    current = LinkSnapshot.open(directory)
+    try:
+        if current is None or full or len(current.deltas) >= max_deltas:
+            generation = _microseconds(exported_at)
+            if current is not None:
+                generation = max(generation, current.generation + 1)
+            path = os.path.join(directory, f"links-{generation}.snap")
+            rows = _link_rows(ShortenedLink.deleted_at == None)  # noqa: E711
+            count = write_snapshot(path, map(_record, rows), generation, 0, exported_at)
+            for name in os.listdir(directory):
+                match = FILE_RE.match(name)
+                if match is not None and int(match.group(1)) != generation:
+                    os.unlink(os.path.join(directory, name))
+            logger.info("Exported link snapshot.", path=path, links=count)
+            return path, count
+
+        since = current.exported_at - datetime.timedelta(seconds=overlap)
+        changes = []
+        for row in _link_rows(
+            or_(
+                ShortenedLink.created_at >= since, ShortenedLink.updated_at >= since, ShortenedLink.deleted_at >= since
+            )
+        ):
+            record = _record(row)
+            existing = current.get(record.code)
+            if record.deleted:
+                if existing is not None:
+                    changes.append(record)
+            elif existing is None or existing[:4] != record[:4]:
+                changes.append(record)
+        if not changes:
+            return None, 0
+        sequence = len(current.deltas) + 1
+        path = os.path.join(directory, f"links-{current.generation}.{sequence:06d}.snap")
+        write_snapshot(path, changes, current.generation, sequence, exported_at)
+        logger.info("Exported link snapshot delta.", path=path, links=len(changes))
+        return path, len(changes)
+    finally:
+        if current is not None:
+            current.close()
@@ -0,0 +1,116 @@
+"""Append-only click spool files.
+
+The standalone resolver can't write clicks to the database, so it appends them to
+``CLICK_SPOOL_DIR`` instead, one JSON object per line, in a file per process per UTC hour
+(``clicks-2026101818-<host>-<pid>.ndjson``). ``flask ingest-click-spool`` writes every
+file whose hour ended more than ``SPOOL_GRACE`` seconds ago (60) through the normal click
+path (raw clicks, counters, rollups and visitor sketches), classifying user agents as it
+goes, and deletes it once committed. A crash between the commit and the delete ingests
+that file again on the next run.
+"""
+import datetime
+import json
+import os
+import re
+import socket
+import threading
+import uuid
+
+import woodchipper
+
+from . import clicks
+from .agents import classify_user_agent
+from .database import db
+
+logger = woodchipper.get_logger(__name__)
+
+FILE_RE = re.compile(r"^clicks-(\d{10})-.+\.ndjson$")
+HOUR_FORMAT = "%Y%m%d%H"
+
+
+class ClickSpool:
+    """Appends clicks to this process's spool file for the current hour."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.host = socket.gethostname()
+        self._lock = threading.Lock()
+        self._fd = None
+        self._key = None
+        self.spooled = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, click):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        line = json.dumps(_encode(click)) + "\n"
+        key = (now.strftime(HOUR_FORMAT), os.getpid())
+        with self._lock:
+            if key != self._key:
+                if self._fd is not None:
+                    os.close(self._fd)
+                name = f"clicks-{key[0]}-{self.host}-{key[1]}.ndjson"
+                self._fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._key = key
+            os.write(self._fd, line.encode("utf8"))
+            self.spooled += 1
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd, self._key = None, None
+
+
+def _encode(click):
+    row = click._asdict()
+    row["clicker"] = str(click.clicker)
+    row["clicked_at"] = click.clicked_at.isoformat()
+    del row["is_bot"]
+    return row
+
+
+def read_spool(path):
+    """Yield the ``clicks.Click``s in a spool file, skipping lines that don't parse."""
+    with open(path, encoding="utf8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                row = json.loads(line)
+                row["clicker"] = uuid.UUID(row["clicker"])
+                row["clicked_at"] = datetime.datetime.fromisoformat(row["clicked_at"])
+                row["is_bot"] = classify_user_agent(row["user_agent"]).is_bot
+                yield clicks.Click(**row)
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Skipping unreadable spooled click.", path=path, line=number)
+
+
+def closed_files(directory, include_open=False, now=None):
+    """Spool files nobody writes to any more, oldest first; all of them with ``include_open``."""
+    now = now or datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(seconds=float(os.getenv("SPOOL_GRACE", "60")), hours=1)
+    paths = []
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        match = FILE_RE.match(name)
+        if match and (include_open or datetime.datetime.strptime(match.group(1), HOUR_FORMAT) < cutoff):
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+def ingest(directory, include_open=False, batch_size=1000):
+    """Write spooled clicks to the database, one file per transaction; returns ``[(path, clicks)]``."""
+    ingested = []
+    for path in closed_files(directory, include_open=include_open):
+        count = 0
+        batch = []
+        for click in read_spool(path):
+            batch.append(click)
+            if len(batch) >= batch_size:
+                clicks.write_clicks(batch)
+                count += len(batch)
+                batch = []
+        clicks.write_clicks(batch)
+        count += len(batch)
+        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        os.unlink(path)
+        logger.info("Ingested spooled clicks.", path=path, clicks=count)
+        ingested.append((path, count))
+    return ingested
@@ -0,0 +1,108 @@
+"""Unique visitor estimates from daily HyperLogLog sketches of clickers.
+
+Each batch of human clicks the click writer ingests is folded into one sketch per link
+per UTC day in ``shortened_link_visitor_sketch``. Any date range is answered by merging
+its days' sketches, so the cost depends on the number of days, not clicks. Estimates carry
+the error bounds documented in hll.py (1.6% standard error at the default precision).
+
+Each stored sketch records its own precision, so changing ``VISITOR_SKETCH_PRECISION``
+is safe: new clicks merge into an existing day at the lower of the two precisions.
+
+Because adding a clicker twice is harmless, ``flask backfill-visitor-sketches`` can fold
+the full click history (including archived months) into the existing sketches at any
+time without double counting.
+"""
+import os
+import uuid
+from collections import defaultdict
+
+import woodchipper
+from sqlalchemy import bindparam, select
+
+from .database import db, dialect_insert, naive_utc, replica
+from .hll import HyperLogLog
+from .models import ShortenedLink, ShortenedLinkVisitorSketch
+from .rollups import day_bucket
+
+logger = woodchipper.get_logger(__name__)
+
+PRECISION = int(os.getenv("VISITOR_SKETCH_PRECISION", "12"))
+
+
+def record_clicks(batch):
+    """Fold the clickers in ``batch`` into the daily sketches in the current session."""
+    sketches = defaultdict(lambda: HyperLogLog(PRECISION))
+    for click in batch:
+        if not click.is_bot and click.clicker is not None:
+            sketches[(click.link_id, day_bucket(click.clicked_at))].add(_clicker_bytes(click.clicker))
+    _merge(sketches)
+
+
+def _clicker_bytes(clicker):
+    return clicker.bytes if isinstance(clicker, uuid.UUID) else uuid.UUID(str(clicker)).bytes
+
+
+def _merge(sketches):
+    if not sketches:
+        return
+    table = ShortenedLinkVisitorSketch.__table__
+    keys = sorted(sketches)
+    # Make sure every row exists, then lock them (in a consistent order) to merge into.
+    db.session.execute(
+        dialect_insert(table).on_conflict_do_nothing(index_elements=["link_id", "bucket"]),
+        [dict(link_id=link_id, bucket=bucket, sketch=HyperLogLog(PRECISION).to_bytes()) for link_id, bucket in keys],
+    )
+    existing = {}
+    for link_id in sorted({link_id for link_id, _ in keys}):
+        buckets = [bucket for key_link_id, bucket in keys if key_link_id == link_id]
+        statement = (
+            select(table.c.bucket, table.c.sketch)
+            .where(table.c.link_id == link_id, table.c.bucket.in_(buckets))
+            .order_by(table.c.bucket)
+            .with_for_update()
+        )
+        for row in db.session.execute(statement):
+            existing[(link_id, naive_utc(row.bucket))] = HyperLogLog.from_bytes(row.sketch)
+    db.session.execute(
+        table.update()
+        .where(table.c.link_id == bindparam("key_link_id"), table.c.bucket == bindparam("key_bucket"))
+        .values(sketch=bindparam("merged")),
+        [
+            dict(key_link_id=link_id, key_bucket=bucket, merged=existing[(link_id, bucket)].merge(sketch).to_bytes())
+            for (link_id, bucket), sketch in sorted(sketches.items())
+        ],
+    )
+
+
+def query(code, since=None, until=None):
+    """Estimated distinct clickers on ``code`` per day and over the whole range."""
+    table = ShortenedLinkVisitorSketch.__table__
+    statement = select(table.c.bucket, table.c.sketch).where(table.c.link_id == code)
+    if since is not None:
+        statement = statement.where(table.c.bucket >= day_bucket(since))
+    if until is not None:
+        statement = statement.where(table.c.bucket < naive_utc(until))
+    with replica():
+        rows = db.session.execute(statement.order_by(table.c.bucket)).all()
+    total = HyperLogLog(PRECISION)
+    series = []
+    for row in rows:
+        sketch = HyperLogLog.from_bytes(row.sketch)
+        total.merge(sketch)
+        series.append(dict(bucket=row.bucket.isoformat(), visitors=sketch.count()))
+    return dict(visitors=total.count(), standard_error=round(total.standard_error, 4), series=series)
+
+
+def backfill():
+    """Fold every recorded click into the sketches, one link per transaction."""
+    from .repository import iter_clicks  # repository imports the click writer, which imports this
+
+    codes = [code for (code,) in db.session.query(ShortenedLink.code).order_by(ShortenedLink.code)]
+    for code in codes:
+        sketches = defaultdict(lambda: HyperLogLog(PRECISION))
+        for row in iter_clicks(code):
+            if row.clicker is not None:
+                sketches[(code, day_bucket(row.clicked_at))].add(_clicker_bytes(row.clicker))
+        _merge(sketches)
+        db.session.flush() if os.getenv("TESTING") else db.session.commit()
+        logger.info("Backfilled visitor sketches.", code=code, days=len(sketches))
@@ -2,8 +2,11 @@ import os
 
 import pytest
 
+from lnkshrtnr import ratelimit
 from lnkshrtnr.app import app
 from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+from lnkshrtnr.repository import link_cache, missing_cache, reset_code_filter
 
 
 def pytest_configure(config):
@@ -20,3 +23,15 @@ def app_ctx():
         db.session.rollback()
         db.session.expunge_all()
         db.session.expire_all()
+        link_cache.clear()
+        missing_cache.clear()
+        reset_code_filter()
+        ratelimit.reset()
+
+
+@pytest.fixture(scope="function")
+def client(app_ctx):
+    """A test client, with the link ``test`` redirecting to https://example.com/."""
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.flush()
+    return app.test_client()
@@ -0,0 +1,92 @@
+import datetime
+import os
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr import archive
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink, ShortenedLinkClick
+from lnkshrtnr.repository import iter_clicks
+
+
+@pytest.fixture(scope="function")
+def archive_dir(app_ctx, tmp_path):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.add(ShortenedLink(code="other", redirect_to="https://example.com/", created_by="joeschmoe"))
+    for link_id, clicked_at in [
+        ("test", datetime.datetime(2024, 1, 5, 10)),
+        ("test", datetime.datetime(2024, 1, 31, 23)),
+        ("other", datetime.datetime(2024, 1, 6)),
+        ("test", datetime.datetime(2024, 3, 1)),
+        ("test", datetime.datetime(2025, 6, 1)),
+    ]:
+        db.session.add(
+            ShortenedLinkClick(
+                id=uuid.uuid4(),
+                link_id=link_id,
+                clicked_at=clicked_at,
+                client_ip="127.0.0.1",
+                referer="",
+                user_agent="test",
+                source="newsletter",
+            )
+        )
+    db.session.flush()
+    with patch.dict(os.environ, CLICK_ARCHIVE_DIR=str(tmp_path)):
+        yield tmp_path
+
+
+def test_archive_clicks(archive_dir):
+    before = [row._mapping for row in iter_clicks("test")]
+    archived = archive.archive_clicks(datetime.datetime(2025, 1, 1))
+    assert archived == [(datetime.datetime(2024, 1, 1), 3), (datetime.datetime(2024, 3, 1), 1)]
+    assert db.session.query(ShortenedLinkClick).count() == 1
+    assert len(list(archive_dir.glob("clicks-2024-01-*.json.gz"))) == 1
+
+    after = [row._mapping for row in iter_clicks("test")]
+    assert after == before
+    assert len(list(iter_clicks("test", since=datetime.datetime(2024, 1, 10)))) == 3
+    assert len(list(iter_clicks("test", until=datetime.datetime(2024, 3, 1)))) == 2
+    assert [row.link_id for row in iter_clicks("other")] == ["other"]
+
+    # Nothing left to archive; a rerun changes nothing.
+    assert archive.archive_clicks(datetime.datetime(2025, 1, 1)) == []
+    assert [row._mapping for row in iter_clicks("test")] == before
+
+    # Bounds from an export may carry an offset.
+    since = datetime.datetime(2024, 1, 31, 22, tzinfo=datetime.timezone(datetime.timedelta(hours=-2)))
+    assert [row.clicked_at for row in iter_clicks("test", since=since)] == [
+        datetime.datetime(2024, 3, 1),
+        datetime.datetime(2025, 6, 1),
+    ]
+
+
+def test_archived_parts_are_merged(archive_dir):
+    archive.archive_clicks(datetime.datetime(2025, 1, 1))
+    db.session.add(
+        ShortenedLinkClick(
+            id=uuid.uuid4(),
+            link_id="test",
+            clicked_at=datetime.datetime(2024, 1, 20),
+            client_ip="127.0.0.1",
+            referer="",
+            user_agent="test",
+        )
+    )
+    db.session.flush()
+    assert archive.archive_clicks(datetime.datetime(2025, 1, 1)) == [(datetime.datetime(2024, 1, 1), 1)]
+    assert len(list(archive_dir.glob("clicks-2024-01-*.json.gz"))) == 2
+    assert [
+        row.clicked_at.day for row in archive.iter_archived_clicks("test", until=datetime.datetime(2024, 2, 1))
+    ] == [
+        5,
+        20,
+        31,
+    ]
+
+
+def test_default_cutoff():
+    with patch.dict(os.environ, CLICK_ARCHIVE_AFTER_MONTHS="13"):
+        assert archive.default_cutoff(datetime.datetime(2026, 1, 15)) == datetime.datetime(2024, 12, 1)
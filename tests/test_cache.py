@@ -0,0 +1,61 @@
+from unittest.mock import patch
+
+from lnkshrtnr.cache import BloomFilter, DiskCache, LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_ttl_expiry():
+    cache = LRUCache(maxsize=10, ttl=5)
+    with patch("lnkshrtnr.cache.time.monotonic", return_value=100):
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+    with patch("lnkshrtnr.cache.time.monotonic", return_value=106):
+        assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_weighted_eviction():
+    cache = LRUCache(maxsize=10, weigh=len)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.set("c", b"1")
+    assert cache.get("a") is None
+    assert cache.weight == 6
+    cache.set("d", b"x" * 11)
+    assert cache.get("d") is None
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+    assert cache.get("a") is None
+    cache.set("a", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.set("b", b"123456")
+    assert cache.size <= 9
+    assert cache.stats()["evictions"] == 1
+    assert DiskCache(str(tmp_path), max_bytes=10).size == cache.size
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for n in range(1000):
+        bloom.add(f"code-{n}")
+    assert all(f"code-{n}" in bloom for n in range(1000))
+    false_positives = sum(1 for n in range(10000) if f"other-{n}" in bloom)
+    assert false_positives < 300
+    assert bloom.stats()["bytes"] == 1199
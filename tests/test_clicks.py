@@ -0,0 +1,171 @@
+import datetime
+import threading
+import uuid
+from unittest.mock import ANY, patch
+
+from lnkshrtnr import clicks, rollups
+from lnkshrtnr.app import app
+from lnkshrtnr.clicks import Click, ClickDeduplicator, ClickWriter, write_clicks
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+from lnkshrtnr.repository import get_click_count, get_clicks_for_link
+
+
+def make_click(code="test"):
+    return Click(
+        link_id=code,
+        clicker=uuid.uuid4(),
+        clicked_at=datetime.datetime.now(datetime.timezone.utc),
+        client_ip="127.0.0.1",
+        referer="",
+        user_agent="test",
+        source="newsletter",
+        medium=None,
+        campaign=None,
+        term=None,
+        content=None,
+    )
+
+
+def test_write_clicks(app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.add(ShortenedLink(code="other", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.flush()
+    write_clicks([make_click("test"), make_click("test"), make_click("other")])
+    assert db.session.query(ShortenedLink.clicks).filter(ShortenedLink.code == "test").scalar() == 2
+    assert db.session.query(ShortenedLink.clicks).filter(ShortenedLink.code == "other").scalar() == 1
+    assert len(get_clicks_for_link("test")) == 2
+    assert get_clicks_for_link("other")[0].source == "newsletter"
+
+
+def test_writer_batches_and_drains():
+    batches = []
+    writer = ClickWriter(app, batch_size=2, flush_interval=60)
+    with patch("lnkshrtnr.clicks.write_clicks", side_effect=lambda batch, count: batches.append(list(batch))), patch(
+        "lnkshrtnr.clicks.db"
+    ):
+        for _ in range(5):
+            assert writer.submit(make_click())
+        writer.stop()
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert writer.stats()["written"] == 5
+
+
+def test_writer_overflow():
+    release = threading.Event()
+    writer = ClickWriter(app, batch_size=1, flush_interval=60, max_queue=1)
+    with patch("lnkshrtnr.clicks.write_clicks", side_effect=lambda batch, count: release.wait(5)), patch(
+        "lnkshrtnr.clicks.db"
+    ):
+        assert writer.submit(make_click())
+        while not writer.queue.empty():
+            pass
+        assert writer.submit(make_click())
+        assert not writer.submit(make_click())
+        release.set()
+        writer.stop()
+    assert writer.stats()["overflowed"] == 1
+    assert writer.stats()["written"] == 2
+
+
+def test_writer_coalesces_counters(app_ctx):
+    writer = ClickWriter(app, batch_size=10, flush_interval=60, fold_interval=3600)
+    with patch("lnkshrtnr.clicks.write_clicks") as write, patch("lnkshrtnr.clicks.db"), patch(
+        "lnkshrtnr.clicks.update_click_counts"
+    ) as update_counts, patch("lnkshrtnr.clicks.writer", writer):
+        writer._flush([make_click("test"), make_click("test"), make_click("other")])
+        write.assert_called_with(ANY, count=False)
+        update_counts.assert_not_called()
+        assert writer.pending_count("test") == 2
+        db.session.add(
+            ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=5)
+        )
+        db.session.flush()
+        assert get_click_count("test") == 7
+        writer._fold()
+        update_counts.assert_called_once_with({"test": 2, "other": 1})
+        assert writer.pending_count("test") == 0
+
+
+def test_writer_drops_a_failing_batch(app_ctx):
+    writer = ClickWriter(app, batch_size=10, flush_interval=60, max_attempts=3)
+    with patch("lnkshrtnr.clicks.write_clicks", side_effect=RuntimeError("database went away")), patch(
+        "lnkshrtnr.clicks.db"
+    ), patch("lnkshrtnr.clicks.time.sleep") as sleep:
+        writer._flush([make_click(), make_click()])
+    # Backs off between attempts, but not after the last one.
+    assert [call.args for call in sleep.call_args_list] == [(1,), (2,)]
+    assert writer.stats()["dropped"] == 2
+
+
+def test_bot_clicks_only_roll_up(app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.flush()
+    write_clicks([make_click("test")._replace(is_bot=True), make_click("test")])
+    assert db.session.query(ShortenedLink.clicks).filter(ShortenedLink.code == "test").scalar() == 1
+    assert len(get_clicks_for_link("test")) == 1
+    assert rollups.query("test", include_bots=True, group_by=["is_bot"]) == [
+        dict(bucket=ANY, clicks=1, is_bot=False),
+        dict(bucket=ANY, clicks=1, is_bot=True),
+    ]
+
+
+def test_deduplicator():
+    now = [1000.0]
+    dedup = ClickDeduplicator(10, max_entries=3, clock=lambda: now[0])
+    assert not dedup.is_duplicate("test", ["a"])
+    assert dedup.is_duplicate("test", ["a"])
+    assert not dedup.is_duplicate("other", ["a"])
+    now[0] += 9
+    assert dedup.is_duplicate("test", ["a"])
+    # Suppressed clicks don't extend the window, and entries survive one rotation.
+    now[0] += 2
+    assert not dedup.is_duplicate("test", ["a"])
+    assert dedup.is_duplicate("test", ["a"])
+    assert not dedup.is_duplicate("test", ["b", "c"])
+    assert dedup.is_duplicate("test", ["c"])
+    # Over max_entries: recorded but not remembered.
+    assert not dedup.is_duplicate("test", ["d"])
+    assert not dedup.is_duplicate("test", ["d"])
+    assert dedup.stats() == dict(window=10, tracked=5, recorded=6, suppressed=4, untracked=2)
+    now[0] += 25
+    assert not dedup.is_duplicate("test", ["a"])
+    assert dedup.stats()["tracked"] == 1
+
+
+def test_duplicate_clicks_are_dropped(app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.flush()
+    with patch("lnkshrtnr.clicks.deduplicator", ClickDeduplicator(30)):
+        client = app.test_client()
+        for _ in range(3):
+            assert client.get("/test").status_code == 302
+        app.test_client().get("/test", headers={"X-Forwarded-For": "192.0.2.1"})
+        assert clicks.dedup_stats()["suppressed"] == 2
+    assert get_click_count("test") == 2
+
+
+def test_clicks_without_an_address_are_not_merged(app_ctx, monkeypatch):
+    monkeypatch.setenv("XFF_TRUSTED_HOPS", "2")
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.flush()
+    with patch("lnkshrtnr.clicks.deduplicator", ClickDeduplicator(30)):
+        # Fewer hops than trusted, so neither has an address.
+        app.test_client().get("/test", headers={"X-Forwarded-For": "192.0.2.1, 10.0.0.1"})
+        app.test_client().get("/test", headers={"X-Forwarded-For": "198.51.100.7, 10.0.0.1"})
+        assert clicks.dedup_stats()["suppressed"] == 0
+    assert get_click_count("test") == 2
+
+
+def test_duplicate_click_keeps_the_first_cookie(app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=0))
+    db.session.flush()
+    with patch("lnkshrtnr.clicks.deduplicator", ClickDeduplicator(30)):
+        first = app.test_client().get("/test")
+        assert "clicker=" in first.headers["Set-Cookie"]
+        # The second half of a double click, sent before the cookie arrived.
+        second = app.test_client().get("/test")
+        assert second.status_code == 302
+        assert "Set-Cookie" not in second.headers
+        assert clicks.dedup_stats()["suppressed"] == 1
+    assert get_click_count("test") == 1
@@ -0,0 +1,66 @@
+import itertools
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr.codes import CodeAllocator, FeistelPermutation, RandomCodeAllocator, allocator, default_allocator
+from lnkshrtnr.database import db
+from lnkshrtnr.exceptions import LinkShortenerException
+from lnkshrtnr.models import ShortenedLink
+
+
+def test_permutation_is_a_bijection():
+    for domain in [1, 2, 36, 1000, 36**3]:
+        permutation = FeistelPermutation(domain, "secret")
+        assert sorted(permutation(n) for n in range(domain)) == list(range(domain))
+    assert [FeistelPermutation(1000, "a")(n) for n in range(10)] != [
+        FeistelPermutation(1000, "b")(n) for n in range(10)
+    ]
+
+
+def test_allocator_skips_taken_codes():
+    blocks = itertools.count()
+    existing = set()
+    codes = CodeAllocator(
+        "abc", 3, "secret", block_size=5, reserve_block=lambda: next(blocks), taken=existing.intersection
+    )
+    existing.add(codes.code_for(3))
+    allocated = [codes.allocate() for _ in range(20)]
+    assert len(set(allocated)) == 20
+    assert codes.code_for(3) not in allocated
+    assert all(len(code) == 3 and set(code) <= set("abc") for code in allocated)
+    assert codes.stats()["skipped"] == 1
+
+
+def test_allocator_exhaustion():
+    blocks = itertools.count()
+    codes = CodeAllocator("ab", 2, "secret", block_size=2, reserve_block=lambda: next(blocks), taken=lambda c: set())
+    assert sorted(codes.allocate() for _ in range(4)) == ["aa", "ab", "ba", "bb"]
+    with pytest.raises(LinkShortenerException):
+        codes.allocate()
+
+
+def test_allocator_reserves_blocks_from_the_database(app_ctx):
+    first = allocator.allocate()
+    db.session.add(ShortenedLink(code=first, redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.flush()
+    assert allocator.allocate() != first
+    assert len(first) == 8
+
+
+def test_no_key_means_random_codes(monkeypatch):
+    monkeypatch.delenv("CODE_KEY", raising=False)
+    monkeypatch.delenv("TESTING")
+    assert isinstance(default_allocator(), RandomCodeAllocator)
+    monkeypatch.setenv("CODE_KEY", "secret")
+    assert not isinstance(default_allocator(), RandomCodeAllocator)
+
+    existing = set()
+    codes = RandomCodeAllocator("ab", 2, taken=existing.intersection)
+    existing.update(["aa", "ab", "ba"])
+    with patch("lnkshrtnr.codes.secrets.randbelow", side_effect=[0, 1, 3]):
+        assert codes.allocate() == "bb"
+    assert codes.skipped == 2
+    existing.add("bb")
+    with pytest.raises(LinkShortenerException):
+        codes.allocate()
@@ -0,0 +1,15 @@
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr.app import app
+from lnkshrtnr.database import check_schema
+
+
+def test_check_schema(app_ctx):
+    alembic = app.extensions["alembic"]
+    assert check_schema(alembic, mode="strict")
+    with patch.object(type(alembic.script_directory), "get_heads", return_value=["newer"]):
+        assert not check_schema(alembic, mode="warn")
+        with pytest.raises(RuntimeError):
+            check_schema(alembic, mode="strict")
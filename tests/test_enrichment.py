@@ -0,0 +1,53 @@
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr import enrichment
+from lnkshrtnr.agents import classify_user_agent
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ClickDimension, ShortenedLinkClick
+
+IPHONE_UA_STRING = "Mozilla/5.0 (iPhone; CPU iPhone OS 5_1 like Mac OS X) AppleWebKit/534.46 (KHTML, like Gecko) Version/5.1 Mobile/9B179 Safari/7534.48.3"  # noqa: E501
+DESKTOP_UA_STRING = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/118.0"
+
+
+@pytest.fixture(scope="function")
+def client(client):
+    yield client
+    enrichment.forget_dimensions()
+
+
+def test_enrich_clicks(client):
+    for user_agent, referer in [
+        (IPHONE_UA_STRING, "https://news.example.org/story"),
+        (IPHONE_UA_STRING, "https://news.example.org/other"),
+        (IPHONE_UA_STRING, ""),
+        (DESKTOP_UA_STRING, "https://mail.example.com/"),
+    ]:
+        client.get("/test", headers={"User-agent": user_agent, "Referer": referer})
+
+    assert enrichment.breakdown("test", "browser") == dict(series=[], pending=4)
+    with patch.object(classify_user_agent, "__wrapped__", wraps=classify_user_agent.__wrapped__) as parse:
+        assert enrichment.enrich_clicks() == 4
+    assert parse.call_count == 2
+    assert enrichment.enrich_clicks() == 0
+    assert db.session.query(ShortenedLinkClick).filter(ShortenedLinkClick.device_class_id == None).count() == 0  # noqa
+    assert db.session.query(ClickDimension).filter(ClickDimension.kind == "referer_host").count() == 2
+    assert enrichment.checkpoint()["enriched"] == 4
+
+    assert enrichment.breakdown("test", "device_class") == dict(
+        series=[dict(value="mobile", clicks=3), dict(value="pc", clicks=1)], pending=0
+    )
+    response = client.get("/_stats/test/breakdown?by=referer_host")
+    assert response.status_code == 200
+    assert response.json["series"] == [
+        dict(value="news.example.org", clicks=2),
+        dict(value=None, clicks=1),
+        dict(value="mail.example.com", clicks=1),
+    ]
+    assert client.get("/_stats/test/breakdown?by=referer").status_code == 400
+    # Bounds with an offset compare in UTC, like the other stats.
+    hour_ago = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=5))) - datetime.timedelta(hours=1)
+    response = client.get("/_stats/test/breakdown", query_string=dict(by="device_class", since=hour_ago.isoformat()))
+    assert sum(entry["clicks"] for entry in response.json["series"]) == 4
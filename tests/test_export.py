@@ -0,0 +1,60 @@
+import csv
+import datetime
+import io
+import json
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLinkClick
+from lnkshrtnr.repository import iter_clicks
+
+START = datetime.datetime(2023, 7, 1, 10)
+
+
+@pytest.fixture(scope="function")
+def client(client):
+    for minutes in [0, 0, 0, 1, 2, 3, 3]:
+        db.session.add(
+            ShortenedLinkClick(
+                id=uuid.uuid4(),
+                link_id="test",
+                clicked_at=START + datetime.timedelta(minutes=minutes),
+                client_ip="127.0.0.1",
+                referer="",
+                user_agent="test",
+            )
+        )
+    db.session.flush()
+    return client
+
+
+def test_iter_clicks_pages_by_keyset(client):
+    rows = list(iter_clicks("test", page_size=2))
+    assert len(rows) == 7
+    assert len({row.id for row in rows}) == 7
+    assert [(row.clicked_at, row.id) for row in rows] == sorted((row.clicked_at, row.id) for row in rows)
+    assert len(list(iter_clicks("test", since=START + datetime.timedelta(minutes=1), page_size=2))) == 4
+    assert len(list(iter_clicks("test", until=START + datetime.timedelta(minutes=3), page_size=3))) == 5
+
+
+def test_export_ndjson(client):
+    with patch.dict("os.environ", EXPORT_PAGE_SIZE="3"):
+        response = client.get("/_export/test?until=2023-07-01T10:03:00")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines) == 5
+    assert lines[0]["clicked_at"] == "2023-07-01T10:00:00"
+    assert lines[0]["link_id"] == "test"
+
+
+def test_export_csv(client):
+    response = client.get("/_export/test?format=csv&since=2023-07-01T10:02:00")
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 3
+    assert rows[-1]["clicked_at"] == "2023-07-01T10:03:00"
+    assert client.get("/_export/test?format=xml").status_code == 400
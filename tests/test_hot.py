@@ -0,0 +1,69 @@
+import random
+from collections import Counter
+
+import pytest
+
+from lnkshrtnr import hot, repository
+from lnkshrtnr.app import app
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+
+
+@pytest.fixture(scope="function")
+def client(app_ctx):
+    db.session.add(ShortenedLink(code="hot", redirect_to="https://example.com/hot", created_by="joeschmoe"))
+    db.session.add(ShortenedLink(code="warm", redirect_to="https://example.com/warm", created_by="joeschmoe"))
+    db.session.flush()
+    # Start from an empty window.
+    hot.tracker.publish()
+    return app.test_client()
+
+
+def test_space_saving():
+    random.seed(1)
+    stream = [f"code-{min(int(random.paretovariate(1.2)), 5000)}" for _ in range(20000)]
+    summary = hot.SpaceSaving(100)
+    for key in stream:
+        summary.add(key)
+    assert len(summary.counts) == 100
+    actual = Counter(stream)
+    for key, count, error in summary.top():
+        assert count - error <= actual[key] <= count
+    assert [key for key, _, _ in summary.top(5)] == [key for key, _ in actual.most_common(5)]
+
+
+def test_hot_links(client):
+    for _ in range(5):
+        client.get("/hot")
+    client.get("/warm")
+    client.get("/hot?qr=svg")
+    hot.tracker.publish()
+
+    response = client.get("/_hot")
+    assert response.status_code == 200
+    assert [(entry["key"], entry["requests"]) for entry in response.json["hot"]] == [("hot", 5), ("warm", 1)]
+    assert response.json["hot"][0]["rate"] > 0
+    assert [entry["key"] for entry in client.get("/_hot?kind=qr").json["hot"]] == ["svg:hot"]
+    assert client.get("/_hot?kind=nope").status_code == 400
+
+
+def test_prewarm(client):
+    client.get("/hot")
+    client.get("/hot?qr=svg")
+    client.get("/hot?qr=png&utm_source=print&utm_campaign=spring")
+    hot.tracker.publish()
+    repository.link_cache.clear()
+    repository.qr_cache.clear()
+    hot.prewarm()
+    assert repository.link_cache.get("hot") is not None
+    assert repository.link_cache.get("warm") is None
+    assert len(repository.qr_cache._data) == 2
+    # The tagged print code is warm too.
+    assert repository.qrcode_etag("png", "hot", source="print", campaign="spring") in repository.qr_cache._data
+
+
+def test_qr_key():
+    key = hot.qr_key("png", "hot", "a/b?c", dict(source="print", campaign="spring"))
+    assert key == "png:hot/a%2Fb%3Fc?campaign=spring&source=print"
+    assert hot.parse_qr_key(key) == ("png", "hot", "a/b?c", dict(source="print", campaign="spring"))
+    assert hot.parse_qr_key(hot.qr_key("svg", "hot")) == ("svg", "hot", None, {})
@@ -0,0 +1,44 @@
+from prometheus_client import REGISTRY
+
+from lnkshrtnr import metrics
+from lnkshrtnr.app import app
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_redirect_metrics(app_ctx):
+    db.session.add(ShortenedLink(code="metered", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.flush()
+    requests = sample("lnkshrtnr_request_seconds_count", route="simple_redirect", method="GET", status="302")
+    lookups = sample("lnkshrtnr_step_seconds_count", step="lookup")
+    humans = sample("lnkshrtnr_clicks_total", kind="human")
+    not_found = sample("lnkshrtnr_not_found_total", route="simple_redirect")
+    renders = sample("lnkshrtnr_qr_requests_total", served_from="render")
+
+    with app.test_client() as client:
+        assert client.get("/metered").status_code == 302
+        assert client.get("/missing").status_code == 404
+        assert client.get("/metered?qr=svg").status_code == 200
+
+    assert (
+        sample("lnkshrtnr_request_seconds_count", route="simple_redirect", method="GET", status="302") == requests + 1
+    )
+    assert sample("lnkshrtnr_step_seconds_count", step="lookup") == lookups + 3
+    assert sample("lnkshrtnr_clicks_total", kind="human") == humans + 1
+    assert sample("lnkshrtnr_not_found_total", route="simple_redirect") == not_found + 1
+    assert sample("lnkshrtnr_qr_requests_total", served_from="render") == renders + 1
+
+
+def test_metrics_endpoint(app_ctx):
+    metrics._last_refresh = 0
+    with app.test_client() as client:
+        response = client.get("/_metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert "lnkshrtnr_step_seconds_bucket" in body
+    assert 'lnkshrtnr_cache{cache="link_cache",stat="misses"}' in body
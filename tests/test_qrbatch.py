@@ -0,0 +1,59 @@
+import io
+import json
+import zipfile
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr import repository
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+
+
+@pytest.fixture(scope="function")
+def client(client):
+    db.session.add(ShortenedLink(code="param", redirect_to="https://example.com/{}", created_by="joeschmoe"))
+    db.session.flush()
+    repository.qr_cache.clear()
+    return client
+
+
+def test_batch_qrcodes(client):
+    response = client.post(
+        "/_qr/batch",
+        json=[
+            dict(code="test"),
+            dict(code="param", parameter="a b", format="svg", utm=dict(source="print")),
+            dict(code="Test", format="png"),
+            dict(code="missing"),
+            dict(code="param"),
+            dict(code="test", format="gif"),
+            dict(code="test", utm=dict(format="svg")),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    assert sorted(archive.namelist()) == ["errors.json", "param-a%20b.svg", "test-2.png", "test.png"]
+    assert json.loads(archive.read("errors.json")) == [
+        dict(index=3, code="missing", error="not_found"),
+        dict(index=4, code="param", error="not_found"),
+        dict(index=5, code="test", error="invalid_format"),
+        dict(index=6, code="test", error="invalid"),
+    ]
+
+    # Rendered by the pool, then served from the cache exactly as the single endpoints do.
+    assert archive.read("test.png") == archive.read("test-2.png") == client.get("/test?qr=png").get_data()
+    assert archive.read("param-a%20b.svg") == client.get("/param/a%20b?qr=svg&utm_source=print").get_data()
+    repository.qr_cache.clear()
+    assert archive.read("test.png") == client.get("/test?qr=png").get_data()
+
+    assert client.post("/_qr/batch", json=dict(code="test")).status_code == 400
+
+
+def test_batch_ends_the_session_before_streaming(client, monkeypatch):
+    monkeypatch.delenv("TESTING")
+    with patch.object(db.session, "close") as close:
+        response = client.post("/_qr/batch", json=[dict(code="test")])
+        close.assert_called_once()
+    assert zipfile.ZipFile(io.BytesIO(response.get_data())).namelist() == ["test.png"]
@@ -0,0 +1,71 @@
+import pytest
+
+from lnkshrtnr import ratelimit
+from lnkshrtnr.app import app
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+from lnkshrtnr.repository import client_ip, get_clicks_for_link
+
+
+@pytest.fixture(scope="function")
+def client(app_ctx, monkeypatch):
+    db.session.add(ShortenedLink(code="limited", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.flush()
+    monkeypatch.setitem(ratelimit.limiters, ratelimit.REDIRECT, ratelimit.RateLimiter(2, 60))
+    monkeypatch.setitem(ratelimit.limiters, ratelimit.WRITE, ratelimit.RateLimiter(1, 60))
+    return app.test_client()
+
+
+def test_rate_limiter():
+    now = [1000.0]
+    limiter = ratelimit.RateLimiter(2, 10, sweep_interval=30, clock=lambda: now[0])
+    assert limiter.acquire(["a"]) == 0
+    assert limiter.acquire(["a", "b"]) == 0
+    assert limiter.acquire(["a"]) == 5
+    # "b" was over too, so nothing was taken from "c".
+    assert limiter.acquire(["b", "c"]) == 0
+    assert limiter.acquire(["c"]) == 0
+    now[0] += 5
+    assert limiter.acquire(["a"]) == 0
+    assert limiter.stats() == dict(clients=3, allowed=5, limited=1)
+    now[0] += 30
+    limiter.acquire(["d"])
+    assert limiter.stats()["clients"] == 1
+
+
+def test_client_ip(monkeypatch):
+    assert client_ip(None, "10.0.0.1") == "10.0.0.1"
+    assert client_ip("192.0.2.1", "10.0.0.1") == "192.0.2.1"
+    assert client_ip("192.0.2.1, 198.51.100.7", "10.0.0.1") == "198.51.100.7"
+    monkeypatch.setenv("XFF_TRUSTED_HOPS", "1")
+    assert client_ip("192.0.2.1, 198.51.100.7", "10.0.0.1") == "192.0.2.1"
+    monkeypatch.setenv("XFF_TRUSTED_HOPS", "2")
+    assert client_ip("192.0.2.1, 198.51.100.7", "10.0.0.1") is None
+
+
+def test_rate_limited_routes(client, monkeypatch):
+    monkeypatch.setattr(ratelimit, "REDIRECT_MODE", ratelimit.REJECT)
+    assert client.get("/limited").status_code == 302
+    assert client.get("/limited").status_code == 302
+    response = client.get("/limited")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert client.get("/limited", headers={"X-Forwarded-For": "192.0.2.1"}).status_code == 302
+
+    assert client.put("/limited", json=dict(redirect_to="https://example.com/1")).status_code == 204
+    assert client.put("/limited", json=dict(redirect_to="https://example.com/2")).status_code == 429
+    assert ratelimit.stats()["write_limited"] == 1
+
+
+def test_skip_click(client):
+    assert ratelimit.REDIRECT_MODE == ratelimit.SKIP_CLICK
+    for _ in range(2):
+        assert client.get("/limited").status_code == 302
+    response = client.get("/limited")
+    assert response.status_code == 302
+    assert response.headers["Location"] == "https://example.com/"
+    assert "Set-Cookie" not in response.headers
+    assert len(get_clicks_for_link("limited")) == 2
+    # Writes are still refused.
+    assert client.put("/limited", json=dict(redirect_to="https://example.com/1")).status_code == 204
+    assert client.put("/limited", json=dict(redirect_to="https://example.com/2")).status_code == 429
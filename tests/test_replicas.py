@@ -0,0 +1,39 @@
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine, insert
+
+from lnkshrtnr import database, repository
+from lnkshrtnr.app import app
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+
+
+@pytest.fixture(scope="function")
+def replica(app_ctx, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    db.metadata.create_all(engine)
+    row = dict(code="test", redirect_to="https://replica.example.com/", created_by="joeschmoe", clicks=0)
+    with engine.begin() as connection:
+        connection.execute(insert(ShortenedLink.__table__), row)
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe", clicks=5))
+    db.session.flush()
+    with patch.object(database, "replica_engines", [engine]):
+        yield engine
+    repository.recent_writes.clear()
+    engine.dispose()
+
+
+def test_lookups_read_from_replica(replica):
+    with app.test_client() as client:
+        assert client.get("/test").headers["Location"] == "https://replica.example.com/"
+    assert repository.get_click_count("test") == 0
+
+
+def test_recent_writes_read_from_primary(replica):
+    with app.test_client() as client:
+        assert client.put("/test", json=dict(redirect_to="https://example.com/new")).status_code == 204
+        assert client.get("/test").headers["Location"] == "https://example.com/new"
+        repository.recent_writes.clear()
+        repository.link_cache.clear()
+        assert client.get("/test").headers["Location"] == "https://replica.example.com/"
@@ -1,11 +1,10 @@
 from unittest.mock import patch
 from urllib.parse import parse_qs, urlparse
 
-from sqlalchemy.orm import Session
-
+from lnkshrtnr.agents import classify_user_agent
 from lnkshrtnr.app import app
 from lnkshrtnr.models import ShortenedLink
-from lnkshrtnr.repository import merge_utm_tags, record_click
+from lnkshrtnr.repository import PARAMETER_PLACEHOLDER, RedirectTemplate, merge_utm_tags, record_click
 
 IPHONE_UA_STRING = "Mozilla/5.0 (iPhone; CPU iPhone OS 5_1 like Mac OS X) AppleWebKit/534.46 (KHTML, like Gecko) Version/5.1 Mobile/9B179 Safari/7534.48.3"  # noqa: E501
 SLACK_UA_STRING = "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"  # noqa: E501
@@ -13,16 +12,14 @@ SLACK_UA_STRING = "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"
 
 def test_no_click_for_bots(app_ctx):
     with app.test_request_context("/link", method="GET", headers={"User-agent": IPHONE_UA_STRING}):
-        with patch("lnkshrtnr.database.db.session", spec=Session) as db_session:
-            record_click(ShortenedLink(code="link"))
-            db_session.execute.assert_called()
-            db_session.add.assert_called()
+        with patch("lnkshrtnr.clicks.write_clicks") as write_clicks:
+            assert record_click(ShortenedLink(code="link")) is not None
+            assert not write_clicks.call_args.args[0][0].is_bot
 
     with app.test_request_context("/link", method="GET", headers={"User-agent": SLACK_UA_STRING}):
-        with patch("lnkshrtnr.database.db.session", spec=Session) as db_session:
-            record_click(ShortenedLink(code="link"))
-            db_session.execute.assert_not_called()
-            db_session.add.assert_not_called()
+        with patch("lnkshrtnr.clicks.write_clicks") as write_clicks:
+            assert record_click(ShortenedLink(code="link")) is None
+            assert write_clicks.call_args.args[0][0].is_bot
 
 
 def test_merge_utm_tags():
@@ -40,3 +37,36 @@ def test_merge_utm_tags():
     assert qs["utm_term"] == ["word"]
     assert qs["utm_content"] == ["happy"]
     assert "utm_invalid" not in qs
+
+
+def test_redirect_template_matches_merge_utm_tags():
+    urls = [
+        "https://example.com/",
+        "https://example.com/path;p?a=1&b=&a=2&utm_source=old#frag",
+        "https://example.com/path?a=1+2&c=%2F#frag",
+        "https://example.com",
+        f"https://example.com/{PARAMETER_PLACEHOLDER}/x?a=1#frag",
+        f"https://example.com/?q={PARAMETER_PLACEHOLDER}",
+        f"https://{PARAMETER_PLACEHOLDER}.example.com/",
+    ]
+    parameters = ["foo", "a b", "x?y=1", "x#y", "x;y", "%20"]
+    for utm_tags in [{}, dict(source="news letter", campaign="fall"), dict(invalid="nope")]:
+        for url in urls:
+            template = RedirectTemplate(url)
+            if PARAMETER_PLACEHOLDER not in url:
+                assert template.url(None, utm_tags) == merge_utm_tags(url, utm_tags)
+                continue
+            for parameter in parameters:
+                expected = merge_utm_tags(url.replace(PARAMETER_PLACEHOLDER, parameter, 1), utm_tags)
+                assert template.url(parameter, utm_tags) == expected
+
+
+def test_classify_user_agent_is_memoized():
+    classify_user_agent.cache_clear()
+    assert not classify_user_agent(IPHONE_UA_STRING).is_bot
+    assert classify_user_agent(IPHONE_UA_STRING).device_class == "mobile"
+    assert classify_user_agent(SLACK_UA_STRING).is_bot
+    assert classify_user_agent(None).device_class == "other"
+    info = classify_user_agent.cache_info()
+    assert info.hits == 1
+    assert info.misses == 3
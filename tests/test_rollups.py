@@ -0,0 +1,54 @@
+import datetime
+import uuid
+
+from lnkshrtnr import rollups
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLinkClick, ShortenedLinkClickDaily
+
+IPHONE_UA_STRING = "Mozilla/5.0 (iPhone; CPU iPhone OS 5_1 like Mac OS X) AppleWebKit/534.46 (KHTML, like Gecko) Version/5.1 Mobile/9B179 Safari/7534.48.3"  # noqa: E501
+
+
+def test_stats_from_rollups(client):
+    client.get("/test?utm_source=newsletter", headers={"User-agent": IPHONE_UA_STRING})
+    client.get("/test?utm_source=newsletter", headers={"User-agent": IPHONE_UA_STRING})
+    client.get("/test?utm_source=twitter", headers={"User-agent": IPHONE_UA_STRING})
+    client.get("/test", headers={"User-agent": "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"})
+
+    response = client.get("/_stats/test?granularity=hour&group_by=source")
+    assert response.status_code == 200
+    assert response.json["total"] == 3
+    assert {row["source"]: row["clicks"] for row in response.json["series"]} == {"newsletter": 2, "twitter": 1}
+
+    response = client.get("/_stats/test?include_bots=1&group_by=is_bot")
+    assert [(row["is_bot"], row["clicks"]) for row in response.json["series"]] == [(False, 3), (True, 1)]
+
+    assert client.get("/_stats/test?granularity=week").status_code == 400
+    assert client.get("/_stats/test?since=yesterday").status_code == 400
+    assert client.get("/_stats/nope").status_code == 404
+
+
+def test_backfill(client):
+    first_hour = datetime.datetime(2023, 7, 1, 10)
+    for minutes, source in [(0, "a"), (5, "a"), (70, None), (60 * 24, "a")]:
+        db.session.add(
+            ShortenedLinkClick(
+                id=uuid.uuid4(),
+                link_id="test",
+                clicked_at=first_hour + datetime.timedelta(minutes=minutes),
+                client_ip="127.0.0.1",
+                referer="",
+                user_agent=IPHONE_UA_STRING,
+                source=source,
+            )
+        )
+    db.session.flush()
+    cutoff = datetime.datetime(2023, 7, 2, 12)
+    rollups.backfill(cutoff)
+    rollups.backfill(cutoff)
+    assert rollups.query("test", granularity="hour", group_by=["source"]) == [
+        dict(bucket="2023-07-01T10:00:00", source="a", clicks=2),
+        dict(bucket="2023-07-01T11:00:00", source="", clicks=1),
+        dict(bucket="2023-07-02T10:00:00", source="a", clicks=1),
+    ]
+    assert [row["clicks"] for row in rollups.query("test")] == [3, 1]
+    assert db.session.query(ShortenedLinkClickDaily).count() == 3
@@ -1,5 +1,9 @@
+import json
+from unittest.mock import patch
+
 import pytest
 
+from lnkshrtnr import purge, repository
 from lnkshrtnr.app import app
 from lnkshrtnr.database import db
 from lnkshrtnr.models import ShortenedLink
@@ -185,3 +189,114 @@ def test_get_param_link_using_parameters_with_utm(client, parametrized_link_with
         == parametrized_link_with_default.redirect_to.replace(PARAMETER_PLACEHOLDER, "extra", 1)
         + "?utm_source=foo&utm_medium=bar"
     )
+
+
+def test_cached_link_invalidated_on_update(client, simple_link):
+    assert client.get("/test").headers["Location"] == "https://example.com/"
+    assert repository.link_cache.get("test") is not None
+    response = client.put("/test", json=dict(redirect_to="https://example.com/other"))
+    assert response.status_code == 204
+    assert client.get("/test").headers["Location"] == "https://example.com/other"
+
+
+def test_cached_link_invalidated_on_delete(client, simple_link):
+    assert client.get("/test").status_code == 302
+    assert client.delete("/test").status_code == 204
+    assert client.get("/test").status_code == 404
+
+
+def test_unknown_codes_skip_the_database(client, simple_link):
+    repository.build_code_filter()
+    assert repository.code_filter_stats() is not None
+    with patch.object(db.session, "query", side_effect=AssertionError("queried")):
+        assert repository.might_exist("test")
+        assert client.get("/nope").status_code == 404
+    response = client.post("/", json=dict(code="nope", redirect_to="https://example.com/new", created_by="joe"))
+    assert response.status_code == 201
+    assert client.get("/nope").status_code == 302
+
+
+def test_cacheable_link(client, simple_link):
+    with patch.object(purge, "purge_link") as purge_link:
+        response = client.put("/test", json=dict(redirect_to="https://example.com/", cacheable=True))
+        assert response.status_code == 204
+    purge_link.assert_called_once_with("test")
+    response = client.get("/test?utm_source=mail")
+    assert response.status_code == 301
+    assert response.headers["Location"] == "https://example.com/?utm_source=mail"
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+    assert response.headers["Surrogate-Key"] == "link-test"
+    assert "Set-Cookie" not in response.headers
+    db.session.refresh(simple_link)
+    assert simple_link.clicks == 0
+    assert client.put("/test", json=dict(redirect_to="https://example.com/", cacheable="yes")).status_code == 400
+
+
+def test_update_link_default_parameter(client, parametrized_link_with_default):
+    code = parametrized_link_with_default.code
+    response = client.put(
+        f"/{code}", json=dict(redirect_to=parametrized_link_with_default.redirect_to, default_parameter="other")
+    )
+    assert response.status_code == 204
+    assert client.get(f"/{code}").headers["Location"] == "https://example.com/other"
+
+
+def test_qrcode_etag(client, simple_link):
+    repository.qr_cache.clear()
+    response = client.get(f"/{simple_link.code}?qr=svg")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    hits = repository.qr_cache.hits
+    response = client.get(f"/{simple_link.code}?qr=svg")
+    assert response.headers["ETag"] == etag
+    assert repository.qr_cache.hits == hits + 1
+    response = client.get(f"/{simple_link.code}?qr=svg", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    response = client.get(f"/{simple_link.code}?qr=svg&utm_source=print", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # A matching ETag doesn't turn a 404 into a 304.
+    parameter_etag = repository.qrcode_etag("svg", simple_link.code, "x")
+    assert client.get(f"/{simple_link.code}/x?qr=svg", headers={"If-None-Match": parameter_etag}).status_code == 404
+    assert client.delete(f"/{simple_link.code}").status_code == 204
+    assert client.get(f"/{simple_link.code}?qr=svg", headers={"If-None-Match": etag}).status_code == 404
+
+
+def test_bulk_create(client, simple_link):
+    links = [
+        dict(code="bulk-1", redirect_to="https://example.com/1", created_by="somebody"),
+        dict(redirect_to="https://example.com/" + PARAMETER_PLACEHOLDER, default_parameter="x", created_by="somebody"),
+        dict(code="test", redirect_to="https://example.com/", created_by="somebody"),
+        dict(code="bulk-1", redirect_to="https://example.com/1", created_by="somebody"),
+        dict(code="bad code", redirect_to="https://example.com/", created_by="somebody"),
+        dict(code="bulk-2", redirect_to="htps://example.com/", created_by="somebody"),
+        dict(code="bulk-3", redirect_to="https://example.com/"),
+    ]
+    response = client.post("/_bulk", json=links)
+    assert response.status_code == 200
+    assert response.json["created"] == 2
+    assert [result["result"] for result in response.json["results"]] == [
+        "created",
+        "created",
+        "already_exists",
+        "already_exists",
+        "bad_code",
+        "invalid_url",
+        "missing_arg",
+    ]
+    generated = response.json["results"][1]["code"]
+    assert client.get(f"/{generated}").headers["Location"] == "https://example.com/x"
+    assert client.get("/bulk-1").headers["Location"] == "https://example.com/1"
+
+
+def test_bulk_create_ndjson(client):
+    body = "\n".join(
+        json.dumps(dict(code=f"bulk-{i}", redirect_to="https://example.com/", created_by="somebody")) for i in range(5)
+    )
+    response = client.post("/_bulk", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    assert response.json["created"] == 5
+    assert db.session.query(ShortenedLink).filter(ShortenedLink.code.like("bulk-%")).count() == 5
+    assert client.post("/_bulk", data="{", content_type="application/x-ndjson").status_code == 400
@@ -0,0 +1,98 @@
+import contextlib
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+from slack_sdk.web.slack_response import SlackResponse
+
+from lnkshrtnr import repository
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+
+AUTH_TEST = SlackResponse(
+    client=None,
+    http_verb="POST",
+    api_url="auth.test",
+    req_args={},
+    data=dict(ok=True, user_id="U1", bot_id="B1", team_id="T1"),
+    headers={},
+    status_code=200,
+)
+
+
+@pytest.fixture(scope="module")
+def slack_app():
+    # Links are rendered with HOSTNAME when the command runs, so keep it set for the whole module.
+    with patch.dict(
+        os.environ, SLACK_SIGNING_SECRET="secret", SLACK_BOT_TOKEN="xoxb-test", HOSTNAME="lnk.example.com"
+    ), patch("slack_sdk.WebClient.auth_test", return_value=AUTH_TEST):
+        from lnkshrtnr import slack_app
+
+        yield slack_app
+
+
+@pytest.fixture(scope="function")
+def run(slack_app, app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.flush()
+    slack_app.stats_cache.clear()
+
+    def run(text):
+        respond = Mock()
+        # Stay in the test's app context, and so its transaction.
+        with patch.object(slack_app.flask_app, "app_context", contextlib.nullcontext):
+            slack_app.shorten_link_command(respond, dict(text=text, user_name="joeschmoe"))
+        respond.assert_called_once()
+        return respond.call_args.args[0]
+
+    return run
+
+
+def test_usage(run, slack_app):
+    assert run("") == slack_app.USAGE
+    assert run("test") == slack_app.USAGE
+    assert run("bulk") == slack_app.USAGE
+    assert run("stats") == slack_app.USAGE
+    assert run("stats test many") == slack_app.USAGE
+
+
+def test_create(run):
+    assert (
+        run("created https://example.com/created")
+        == "Successfully created redirect: <https://lnk.example.com/created>"
+    )
+    assert repository.get_link_by_code("created").redirect_to == "https://example.com/created"
+    assert run("test https://example.com/other").startswith("Error: ")
+    # A link whose code is a subcommand name is still a link.
+    assert run("bulk https://example.com/bulk").startswith("Successfully created redirect")
+    assert run("stats https://example.com/stats {}").startswith("Successfully created redirect")
+    assert repository.get_link_by_code("stats").default_parameter == "{}"
+
+
+def test_bulk(run):
+    message = run("bulk\n- https://example.com/a\nnourl\none https://example.com/b\none https://example.com/c x")
+    lines = message.splitlines()
+    assert lines[0] == "Created 2 of 4 links:"
+    generated = lines[1][len("<https://lnk.example.com/") : -1]
+    assert repository.get_link_by_code(generated).redirect_to == "https://example.com/a"
+    assert lines[2] == "nourl: 'redirect_to'"
+    assert lines[3] == "<https://lnk.example.com/one>"
+    assert lines[4] == "one: Code already in use."
+
+    with patch.dict(os.environ, BULK_MAX_LINKS="1"):
+        assert run("bulk\n- https://example.com/a\n- https://example.com/b") == "Too many links."
+
+
+def test_stats(run):
+    assert run("stats nope") == "No link with code nope."
+    assert "Last 90 days: 0 clicks" in run("stats test 500")
+    assert "Last 1 days: 0 clicks" in run("stats TEST 0")
+    assert run("stats test").splitlines()[0] == "<https://lnk.example.com/test>: 0 clicks in total."
+
+
+def test_rollback_on_failed_commit(run, slack_app):
+    with patch.object(slack_app, "commit", side_effect=RuntimeError("database went away")):
+        assert run("broken https://example.com/") == "Error: RuntimeError\ndatabase went away"
+        assert run("bulk\nbroken2 https://example.com/") == "Error: RuntimeError\ndatabase went away"
+    assert repository.get_link_by_code("broken") is None
+    assert repository.get_link_by_code("broken2") is None
@@ -0,0 +1,128 @@
+import datetime
+import os
+from unittest.mock import patch
+
+import pytest
+from werkzeug.test import Client
+
+from lnkshrtnr import purge, snapshot, spool
+from lnkshrtnr.database import db
+from lnkshrtnr.models import ShortenedLink
+from lnkshrtnr.repository import PARAMETER_PLACEHOLDER
+from lnkshrtnr.resolver import Resolver
+
+
+@pytest.fixture(scope="function")
+def links(app_ctx):
+    db.session.add(ShortenedLink(code="test", redirect_to="https://example.com/", created_by="joeschmoe"))
+    db.session.add(
+        ShortenedLink(
+            code="param",
+            redirect_to="https://example.com/" + PARAMETER_PLACEHOLDER,
+            default_parameter="foobar",
+            created_by="joeschmoe",
+        )
+    )
+    db.session.add(
+        ShortenedLink(code="static", redirect_to="https://example.com/static", created_by="joeschmoe", cacheable=True)
+    )
+    db.session.add(
+        ShortenedLink(
+            code="gone",
+            redirect_to="https://example.com/",
+            created_by="joeschmoe",
+            deleted_at=datetime.datetime(2024, 1, 1),
+        )
+    )
+    db.session.flush()
+
+
+def test_snapshot_file_roundtrip(tmp_path):
+    records = [
+        snapshot.LinkRecord(f"code-{n}", f"https://example.com/{n}", None if n % 2 else "x", n % 3 == 0, False)
+        for n in range(500)
+    ]
+    path = str(tmp_path / "links-1.snap")
+    assert snapshot.write_snapshot(path, reversed(records), 1, 0, datetime.datetime(2026, 1, 1)) == 500
+    snap = snapshot.SnapshotFile(path)
+    assert snap.exported_at == datetime.datetime(2026, 1, 1)
+    for record in records:
+        assert snap.lookup(record.code) == record
+    assert snap.lookup("code-") is None
+    assert snap.lookup("zzz") is None
+    assert [record.code for record in snap] == sorted(record.code for record in records)
+    snap.close()
+
+
+def test_export_base_and_delta(links, tmp_path):
+    path, count = snapshot.export_links(str(tmp_path))
+    assert count == 3
+    current = snapshot.LinkSnapshot.open(str(tmp_path))
+    assert current.get("param") == snapshot.LinkRecord(
+        "param", "https://example.com/" + PARAMETER_PLACEHOLDER, "foobar", False, False
+    )
+    assert current.get("gone") is None
+    current.close()
+    assert snapshot.export_links(str(tmp_path)) == (None, 0)
+
+    link = db.session.get(ShortenedLink, "test")
+    link.deleted_at = datetime.datetime.utcnow()
+    db.session.get(ShortenedLink, "static").redirect_to = "https://example.com/moved"
+    db.session.add(ShortenedLink(code="new", redirect_to="https://example.com/new", created_by="joeschmoe"))
+    db.session.flush()
+    delta, count = snapshot.export_links(str(tmp_path))
+    assert count == 3
+    assert delta.endswith(".000001.snap")
+    current = snapshot.LinkSnapshot.open(str(tmp_path))
+    assert current.get("test") is None
+    assert current.get("static").redirect_to == "https://example.com/moved"
+    assert current.get("new").redirect_to == "https://example.com/new"
+    assert current.get("param") is not None
+    current.close()
+
+    base, count = snapshot.export_links(str(tmp_path), full=True)
+    assert count == 3
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(base)]
+
+
+def test_resolver(links, tmp_path):
+    snapshot.export_links(str(tmp_path / "links"))
+    resolver = Resolver(str(tmp_path / "links"), spool_dir=str(tmp_path / "spool"))
+    client = Client(resolver)
+    response = client.get("/test?utm_source=mail", headers={"User-Agent": "Mozilla/5.0"})
+    assert response.status_code == 302
+    assert response.headers["Location"] == "https://example.com/?utm_source=mail"
+    assert "clicker=" in response.headers["Set-Cookie"]
+    assert client.get("/param").headers["Location"] == "https://example.com/foobar"
+    assert client.get("/param/other").headers["Location"] == "https://example.com/other"
+    assert client.get("/test/other").status_code == 404
+    assert client.get("/gone").status_code == 404
+    assert client.get("/nope").status_code == 404
+    assert client.post("/test").status_code == 405
+    response = client.get("/static")
+    assert response.status_code == 301
+    assert response.headers["Cache-Control"] == "public, max-age=3600"
+    assert response.headers["Surrogate-Key"] == "link-static"
+    with patch.object(purge, "CACHEABLE_REDIRECT_STATUS", 307):
+        assert client.get("/static").status_code == 307
+
+    ingested = spool.ingest(str(tmp_path / "spool"), include_open=True)
+    assert [count for _, count in ingested] == [3]
+    assert os.listdir(tmp_path / "spool") == []
+    assert db.session.get(ShortenedLink, "test").clicks == 1
+    assert db.session.get(ShortenedLink, "param").clicks == 2
+    assert db.session.get(ShortenedLink, "static").clicks == 0
+
+
+def test_closed_spool_files(tmp_path):
+    for name in [
+        "clicks-2026101816-host-1.ndjson",
+        "clicks-2026101817-host-1.ndjson",
+        "clicks-2026101818-host-1.ndjson",
+    ]:
+        (tmp_path / name).touch()
+    now = datetime.datetime(2026, 10, 18, 18, 0, 30)
+    assert [os.path.basename(path) for path in spool.closed_files(str(tmp_path), now=now)] == [
+        "clicks-2026101816-host-1.ndjson"
+    ]
+    assert len(spool.closed_files(str(tmp_path), include_open=True, now=now)) == 3
@@ -0,0 +1,118 @@
+import datetime
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+from lnkshrtnr import visitors
+from lnkshrtnr.clicks import Click, write_clicks
+from lnkshrtnr.database import db
+from lnkshrtnr.hll import HyperLogLog
+from lnkshrtnr.models import ShortenedLinkClick, ShortenedLinkVisitorSketch
+from lnkshrtnr.repository import get_click_count
+
+IPHONE_UA_STRING = "Mozilla/5.0 (iPhone; CPU iPhone OS 5_1 like Mac OS X) AppleWebKit/534.46 (KHTML, like Gecko) Version/5.1 Mobile/9B179 Safari/7534.48.3"  # noqa: E501
+
+
+def test_hyperloglog():
+    sketch = HyperLogLog()
+    for n in range(50000):
+        sketch.add(str(n))
+    assert abs(sketch.count() - 50000) < 50000 * 4 * sketch.standard_error
+    assert len(sketch.to_bytes()) == 2 + 4096
+    assert HyperLogLog.from_bytes(sketch.to_bytes()).registers == sketch.registers
+
+    small = HyperLogLog()
+    for n in range(10):
+        small.add(str(n))
+        small.add(str(n))
+    assert small.count() == 10
+    assert len(small.to_bytes()) == 2 + 3 * 10
+    assert HyperLogLog.from_bytes(small.to_bytes()).registers == small.registers
+    assert small.merge(HyperLogLog.from_bytes(small.to_bytes())).count() == 10
+
+
+def test_fold():
+    fine, coarse = HyperLogLog(12), HyperLogLog(10)
+    for n in range(20000):
+        fine.add(str(n))
+        coarse.add(str(n))
+    assert fine.fold(10).registers == coarse.registers
+    assert HyperLogLog(10).merge(fine).registers == coarse.registers
+    assert fine.merge(coarse).precision == 10
+    with pytest.raises(ValueError):
+        coarse.fold(12)
+
+
+def make_click(clicker):
+    return Click(
+        link_id="test",
+        clicker=clicker,
+        clicked_at=datetime.datetime(2023, 7, 1, 12),
+        client_ip="127.0.0.1",
+        referer="",
+        user_agent="test",
+        source=None,
+        medium=None,
+        campaign=None,
+        term=None,
+        content=None,
+    )
+
+
+def test_precision_change(client, monkeypatch):
+    write_clicks([make_click(uuid.uuid4()) for _ in range(3)])
+    monkeypatch.setattr(visitors, "PRECISION", 10)
+    write_clicks([make_click(uuid.uuid4()) for _ in range(2)])
+    assert get_click_count("test") == 5
+    result = visitors.query("test")
+    assert result["visitors"] == 5
+    assert result["standard_error"] == 0.0325
+
+
+def test_sketch_failure_keeps_clicks(client):
+    with patch.object(visitors, "record_clicks", side_effect=RuntimeError("sketches went away")):
+        write_clicks([make_click(uuid.uuid4()) for _ in range(2)])
+    assert get_click_count("test") == 2
+    assert db.session.query(ShortenedLinkClick).filter_by(link_id="test").count() == 2
+
+
+def test_visitors_endpoint(client):
+    for _ in range(3):
+        client.get("/test", headers={"User-agent": IPHONE_UA_STRING})
+        client.get("/test", headers={"User-agent": IPHONE_UA_STRING})
+        client.delete_cookie("localhost", "clicker")
+    client.get("/test", headers={"User-agent": "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"})
+
+    response = client.get("/_stats/test/visitors")
+    assert response.status_code == 200
+    assert response.json["visitors"] == 3
+    assert response.json["standard_error"] == 0.0163
+    assert [row["visitors"] for row in response.json["series"]] == [3]
+    assert client.get("/_stats/test/visitors?until=2000-01-01").json["visitors"] == 0
+    assert client.get("/_stats/nope/visitors").status_code == 404
+
+
+def test_backfill(client):
+    clickers = [uuid.uuid4() for _ in range(5)]
+    for day in [1, 2]:
+        for n, clicker in enumerate(clickers):
+            db.session.add(
+                ShortenedLinkClick(
+                    id=uuid.uuid4(),
+                    link_id="test",
+                    clicker=clicker,
+                    clicked_at=datetime.datetime(2023, 7, day, n),
+                    client_ip="127.0.0.1",
+                    referer="",
+                    user_agent="test",
+                )
+            )
+    db.session.flush()
+    visitors.backfill()
+    visitors.backfill()
+    assert db.session.query(ShortenedLinkVisitorSketch).count() == 2
+    result = visitors.query("test")
+    assert result["visitors"] == 5
+    assert [row["visitors"] for row in result["series"]] == [5, 5]
+    assert visitors.query("test", since=datetime.datetime(2023, 7, 2))["visitors"] == 5